@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Concept Partition Benchmark for AcademGrad RAG System
+
+Compares filtered concept search before (search_concept_chunks, filter applied
+after the global ivfflat scan) and after (search_concept_chunks_partitioned,
+pruned to one partition) on latency and recall@k against an exact scan.
+Query vectors are sampled from existing concept chunks, filtered by the
+exam/subject of the concept they came from.
+Usage: python benchmark_concept_partitions.py --queries 50 --match-count 2
+"""
+
+import os
+import json
+import argparse
+import random
+import statistics
+import time
+from typing import Dict, List
+from supabase import create_client, Client
+
+# Configuration
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+
+def sample_queries(supabase: Client, count: int, seed: int) -> List[Dict]:
+    """Sample chunk embeddings with their concept's exam/subject as benchmark queries."""
+
+    rows = supabase.table('concept_chunks') \
+        .select('embedding, concept_docs(exam_type, subject)') \
+        .limit(count * 10).execute().data or []
+
+    random.Random(seed).shuffle(rows)
+
+    queries = []
+    for row in rows[:count]:
+        embedding = row['embedding']
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        doc = row.get('concept_docs') or {}
+        queries.append({
+            'embedding': embedding,
+            'exam_filter': doc.get('exam_type'),
+            'topic_filter': doc.get('subject')
+        })
+
+    return queries
+
+def timed_search(supabase: Client, rpc_name: str, params: Dict) -> tuple:
+    started = time.perf_counter()
+    rows = supabase.rpc(rpc_name, params).execute().data or []
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return elapsed_ms, [row['chunk_md'] for row in rows]
+
+def summarize(latencies: List[float], recalls: List[float]) -> Dict:
+    ordered = sorted(latencies)
+    return {
+        'p50_ms': round(statistics.median(ordered), 1),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        'mean_ms': round(statistics.mean(ordered), 1),
+        'recall': round(statistics.mean(recalls), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark partitioned concept retrieval')
+    parser.add_argument('--queries', type=int, default=50, help='Number of sampled queries')
+    parser.add_argument('--match-count', type=int, default=2, help='Results per query (k)')
+    parser.add_argument('--seed', type=int, default=42, help='Sampling seed')
+    parser.add_argument('--output', type=str, help='Write the JSON summary to this file')
+
+    args = parser.parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        print("Error: Missing required environment variables")
+        print("Required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY")
+        return
+
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+    queries = sample_queries(supabase, args.queries, args.seed)
+    if not queries:
+        print("No concept chunks to benchmark")
+        return
+
+    print(f"Benchmarking {len(queries)} filtered queries, k={args.match_count}")
+
+    stats = {
+        'before': {'latencies': [], 'recalls': []},
+        'after': {'latencies': [], 'recalls': []}
+    }
+    rpcs = {'before': 'search_concept_chunks', 'after': 'search_concept_chunks_partitioned'}
+
+    for query in queries:
+        filters = {
+            'query_embedding': query['embedding'],
+            'exam_filter': query['exam_filter'],
+            'topic_filter': query['topic_filter']
+        }
+
+        _, truth = timed_search(supabase, 'search_concept_chunks_exact', {
+            **filters, 'match_count': args.match_count
+        })
+        if not truth:
+            continue
+
+        for label, rpc_name in rpcs.items():
+            elapsed_ms, found = timed_search(supabase, rpc_name, {
+                **filters,
+                # Disable the threshold so only the index/filtering differs
+                'similarity_threshold': -1.0,
+                'match_count': args.match_count
+            })
+            stats[label]['latencies'].append(elapsed_ms)
+            stats[label]['recalls'].append(len(set(found) & set(truth)) / len(truth))
+
+    if not stats['before']['latencies']:
+        print("No query had ground truth results")
+        return
+
+    summary = {
+        'queries': len(stats['before']['latencies']),
+        'match_count': args.match_count,
+        **{label: summarize(data['latencies'], data['recalls']) for label, data in stats.items()}
+    }
+
+    print(f"\n{'':8} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'recall':>7}")
+    for label in ('before', 'after'):
+        row = summary[label]
+        print(f"{label:8} {row['p50_ms']:>8} {row['p95_ms']:>8} {row['mean_ms']:>8} {row['recall']:>7}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"\nSaved summary to {args.output}")
+
+if __name__ == '__main__':
+    main()
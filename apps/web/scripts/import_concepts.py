@@ -5,10 +5,13 @@ Concept Docs Import Script for AcademGrad RAG System
 This script processes theoretical content and creates embeddings for concept chunks.
 Usage: python import_concepts.py --file path/to/concept.md
        python import_concepts.py --directory path/to/concepts/
+       python import_concepts.py --directory path/to/concepts/ --sync --prune
 """
 
 import os
 import re
+import sys
+import time
 import json
 import argparse
 from typing import List, Dict, Tuple
@@ -18,6 +21,14 @@ import aiohttp
 from supabase import create_client, Client
 from datetime import datetime
 
+from lexical_index import BM25Index
+from near_duplicates import NearDuplicateDetector
+from retrieval import DEFAULT_CONCEPT_INDEX_PATH, concept_chunk_doc_id
+
+# Shared job instrumentation lives in the repository's top-level scripts/ directory
+sys.path.append(str(Path(__file__).resolve().parents[3] / 'scripts'))
+import instrumentation
+
 # Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
@@ -29,8 +40,14 @@ class ConceptChunk:
         self.embedding = embedding
 
 class ConceptParser:
-    def __init__(self):
+    def __init__(self, index_path: Path = DEFAULT_CONCEPT_INDEX_PATH, dedup_threshold: float = 0.85):
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        self.index_path = index_path
+        self.lexical_index = BM25Index.load(index_path)
+        # Near-duplicate chunks across the files of this run are collapsed before embedding,
+        # with one detector per (exam_type, subject) partition
+        self.dedup_threshold = dedup_threshold
+        self.duplicate_detectors: Dict[Tuple[str, str], NearDuplicateDetector] = {}
     
     def parse_concept_file(self, content: str, file_path: Path) -> Tuple[Dict, List[ConceptChunk]]:
         """
@@ -139,8 +156,11 @@ class ConceptParser:
             batch_size = 100
             all_embeddings = []
             
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
+            # Identical texts are embedded only once
+            unique_texts = list(dict.fromkeys(texts))
+            
+            for i in range(0, len(unique_texts), batch_size):
+                batch = unique_texts[i:i + batch_size]
                 
                 payload = {
                     'model': 'text-embedding-3-small',
@@ -162,31 +182,85 @@ class ConceptParser:
                 
                 await asyncio.sleep(0.1)
             
-            return all_embeddings
+            embeddings_by_text = dict(zip(unique_texts, all_embeddings))
+            return [embeddings_by_text[text] for text in texts]
+    
+    def reset_duplicate_detectors(self):
+        """Forget the chunks seen so far, e.g. before importing an unrelated set of files."""
+        
+        self.duplicate_detectors = {}
+    
+    def collapse_near_duplicates(self, file_path: Path, metadata: Dict,
+                                 concept_chunks: List[ConceptChunk]) -> Tuple[List[ConceptChunk], int]:
+        """
+        Drop chunks that near-duplicate a chunk already seen in this run for
+        the same exam and subject. Concepts of other exams or subjects are
+        searched in their own partitions, so similar text there is kept.
+        """
+        
+        if not self.dedup_threshold:
+            return concept_chunks, 0
+        
+        partition = (metadata.get('exam_type') or '', metadata.get('subject') or '')
+        if partition not in self.duplicate_detectors:
+            self.duplicate_detectors[partition] = NearDuplicateDetector(self.dedup_threshold)
+        detector = self.duplicate_detectors[partition]
+        
+        kept = []
+        for i, chunk in enumerate(concept_chunks):
+            if detector.check(f"{file_path.name}#{i}", chunk.chunk_md) is None:
+                kept.append(chunk)
+        
+        duplicates_count = len(concept_chunks) - len(kept)
+        if duplicates_count:
+            print(f"Collapsed {duplicates_count} near-duplicate chunks in {file_path}")
+        
+        return kept, duplicates_count
+    
+    def report_duplicates(self):
+        """Print the collapsed clusters of every exam/subject partition."""
+        
+        for (exam_type, subject), detector in sorted(self.duplicate_detectors.items()):
+            print(f"\n{exam_type or '-'} / {subject or '-'}:")
+            detector.report()
     
     async def process_concept_file(self, file_path: Path) -> Dict:
         """Process a single concept file and upload to database."""
         
         print(f"Processing concept file: {file_path}")
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Parse the markdown
-        metadata, concept_chunks = self.parse_concept_file(content, file_path)
+        with instrumentation.stage('parse'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            # Parse the markdown
+            metadata, concept_chunks = self.parse_concept_file(content, file_path)
         
         if not concept_chunks:
             print(f"Warning: No chunks found in {file_path}")
             return {'status': 'skipped', 'reason': 'No chunks found'}
         
+        with instrumentation.stage('dedup'):
+            concept_chunks, duplicates_count = self.collapse_near_duplicates(file_path, metadata, concept_chunks)
+        instrumentation.count('chunks_collapsed', duplicates_count)
+        if not concept_chunks:
+            # The concept is still updated so chunks of its previous version do not stay searchable
+            print(f"Warning: All chunks in {file_path} duplicate already imported concepts")
+        
         # Generate embeddings
         chunk_texts = [chunk.chunk_md for chunk in concept_chunks]
-        embeddings = await self.generate_embeddings(chunk_texts)
+        embeddings = []
+        if chunk_texts:
+            with instrumentation.stage('embed'):
+                embeddings = await self.generate_embeddings(chunk_texts)
+        instrumentation.count('chunks_embedded', len(chunk_texts))
         
         # Assign embeddings
         for chunk, embedding in zip(concept_chunks, embeddings):
             chunk.embedding = embedding
         
+        write_started = time.perf_counter()
+        
         # Create or update concept doc in database
         concept_data = {
             **metadata,
@@ -233,10 +307,26 @@ class ConceptParser:
         else:
             print(f"Warning: No chunks inserted for concept {concept_id}")
         
+        # Mirror the chunks into their exam/subject partition for filtered search
+        self.supabase.rpc('insert_concept_chunks_partitioned', {
+            'p_concept_id': concept_id,
+            'p_chunks': chunks_data
+        }).execute()
+        
+        instrumentation.record_stage('write', time.perf_counter() - write_started)
+        
+        # Keep the lexical index in sync with the chunks just stored
+        with instrumentation.stage('index'):
+            self.lexical_index.replace_group(f"concept:{concept_id}", [
+                (concept_chunk_doc_id(concept_id, chunk.chunk_md), chunk.chunk_md)
+                for chunk in concept_chunks
+            ])
+        
         return {
             'status': 'success',
             'concept_id': concept_id,
             'chunks_count': len(concept_chunks),
+            'duplicates_count': duplicates_count,
             'file_path': str(file_path)
         }
     
@@ -244,7 +334,8 @@ class ConceptParser:
         """Process all markdown files in a directory."""
         
         results = []
-        md_files = list(directory.glob('*.md'))
+        # Sorted, so the same file keeps a chunk shared with others on every run
+        md_files = sorted(directory.glob('*.md'))
         
         print(f"Found {len(md_files)} concept files in {directory}")
         
@@ -261,20 +352,221 @@ class ConceptParser:
                 })
         
         return results
+    
+    def fetch_concept_ids(self, page_size: int = 1000) -> Dict[str, str]:
+        """Map every existing concept tag to its id, one page of rows per request."""
+        
+        concept_ids = {}
+        start = 0
+        while True:
+            result = self.supabase.table('concept_docs').select('id, tag').order('tag').range(start, start + page_size - 1).execute()
+            for row in result.data:
+                concept_ids[row['tag']] = row['id']
+            if len(result.data) < page_size:
+                return concept_ids
+            start += page_size
+    
+    async def sync_directory(self, directory: Path, batch_size: int = 25, prune: bool = False) -> List[Dict]:
+        """
+        Synchronize all concept files of a directory in bulk.
+        
+        Existing tags are fetched once, concept_docs rows are upserted by tag
+        ``batch_size`` concepts at a time and the chunks of each batch are
+        replaced with one insert_concept_chunks_bulk call. With ``prune``,
+        concepts whose tag no longer has a file are deleted.
+        """
+        
+        results = []
+        parsed = {}
+        unreadable = 0
+        md_files = sorted(directory.glob('*.md'))
+        
+        print(f"Found {len(md_files)} concept files in {directory}")
+        
+        for file_path in md_files:
+            try:
+                with instrumentation.stage('parse'):
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                    metadata, concept_chunks = self.parse_concept_file(content, file_path)
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}")
+                results.append({'status': 'error', 'file_path': str(file_path), 'error': str(e)})
+                unreadable += 1
+                continue
+            
+            if metadata['tag'] in parsed:
+                print(f"Warning: {file_path} reuses tag '{metadata['tag']}' of {parsed[metadata['tag']]['file_path']}, skipping")
+                results.append({'status': 'skipped', 'file_path': str(file_path), 'reason': 'Duplicate tag'})
+                continue
+            
+            with instrumentation.stage('dedup'):
+                concept_chunks, duplicates_count = self.collapse_near_duplicates(file_path, metadata, concept_chunks)
+            instrumentation.count('chunks_collapsed', duplicates_count)
+            
+            parsed[metadata['tag']] = {
+                'file_path': file_path,
+                'metadata': metadata,
+                'content': content,
+                'chunks': concept_chunks,
+                'duplicates_count': duplicates_count
+            }
+        
+        # Files without chunks still count as present for pruning. Files whose chunks all
+        # duplicate other concepts are imported without chunks, replacing their old ones.
+        to_import = [concept for concept in parsed.values() if concept['chunks'] or concept['duplicates_count']]
+        for concept in parsed.values():
+            if not concept['chunks'] and not concept['duplicates_count']:
+                print(f"Warning: No chunks to import in {concept['file_path']}")
+                results.append({'status': 'skipped', 'file_path': str(concept['file_path']), 'reason': 'No chunks found'})
+            elif not concept['chunks']:
+                print(f"Warning: All chunks in {concept['file_path']} duplicate already imported concepts")
+        
+        # One embedding pass for every chunk of every file
+        chunk_texts = [chunk.chunk_md for concept in to_import for chunk in concept['chunks']]
+        if chunk_texts:
+            with instrumentation.stage('embed'):
+                embeddings = await self.generate_embeddings(chunk_texts)
+            instrumentation.count('chunks_embedded', len(chunk_texts))
+            embedding_iter = iter(embeddings)
+            for concept in to_import:
+                for chunk in concept['chunks']:
+                    chunk.embedding = next(embedding_iter)
+        
+        with instrumentation.stage('lookup'):
+            existing_ids = self.fetch_concept_ids()
+        print(f"Found {len(existing_ids)} concepts in the database")
+        
+        for i in range(0, len(to_import), batch_size):
+            batch = to_import[i:i + batch_size]
+            try:
+                with instrumentation.stage('write'):
+                    concept_ids = self.write_concept_batch(batch)
+            except Exception as e:
+                print(f"Error writing concepts {i + 1}-{i + len(batch)}: {str(e)}")
+                results.extend({'status': 'error', 'file_path': str(concept['file_path']), 'error': str(e)} for concept in batch)
+                continue
+            
+            with instrumentation.stage('index'):
+                for concept in batch:
+                    concept_id = concept_ids[concept['metadata']['tag']]
+                    self.lexical_index.replace_group(f"concept:{concept_id}", [
+                        (concept_chunk_doc_id(concept_id, chunk.chunk_md), chunk.chunk_md)
+                        for chunk in concept['chunks']
+                    ])
+            
+            for concept in batch:
+                tag = concept['metadata']['tag']
+                results.append({
+                    'status': 'success',
+                    'concept_id': concept_ids[tag],
+                    'created': tag not in existing_ids,
+                    'chunks_count': len(concept['chunks']),
+                    'duplicates_count': concept['duplicates_count'],
+                    'file_path': str(concept['file_path'])
+                })
+            print(f"Synced {min(i + batch_size, len(to_import))}/{len(to_import)} concepts")
+        
+        if prune:
+            if unreadable:
+                # Their tags are unknown, so their concepts would be deleted
+                print("Warning: Not pruning because some files could not be read")
+            else:
+                with instrumentation.stage('prune'):
+                    self.prune_concepts({tag: concept_id for tag, concept_id in existing_ids.items() if tag not in parsed}, batch_size)
+        
+        return results
+    
+    def write_concept_batch(self, batch: List[Dict]) -> Dict[str, str]:
+        """Upsert the concept docs of a batch by tag and replace their chunks. Returns tag -> id."""
+        
+        now = datetime.now().isoformat()
+        result = self.supabase.table('concept_docs').upsert([
+            {
+                **concept['metadata'],
+                'content_md': concept['content'],
+                'updated_at': now
+            }
+            for concept in batch
+        ], on_conflict='tag').execute()
+        concept_ids = {row['tag']: row['id'] for row in result.data}
+        
+        missing = [concept['metadata']['tag'] for concept in batch if concept['metadata']['tag'] not in concept_ids]
+        if missing:
+            raise Exception(f"Failed to upsert concepts: {', '.join(missing)}")
+        
+        chunks_data = [
+            {
+                'concept_id': concept_ids[concept['metadata']['tag']],
+                'chunk_md': chunk.chunk_md,
+                'embedding': chunk.embedding
+            }
+            for concept in batch
+            for chunk in concept['chunks']
+        ]
+        # Concepts listed without chunk_md lose their old chunks and get none
+        chunks_data.extend(
+            {'concept_id': concept_ids[concept['metadata']['tag']], 'chunk_md': None, 'embedding': None}
+            for concept in batch
+            if not concept['chunks']
+        )
+        result = self.supabase.rpc('insert_concept_chunks_bulk', {'p_chunks': chunks_data}).execute()
+        print(f"Inserted {result.data} chunks for {len(batch)} concepts")
+        
+        return concept_ids
+    
+    def prune_concepts(self, stale_ids: Dict[str, str], batch_size: int = 100):
+        """Delete concepts (and through ON DELETE CASCADE their chunks) whose files are gone."""
+        
+        if not stale_ids:
+            print("No concepts to prune")
+            return
+        
+        tags = sorted(stale_ids)
+        for i in range(0, len(tags), batch_size):
+            self.supabase.table('concept_docs').delete().in_('tag', tags[i:i + batch_size]).execute()
+        
+        for tag in tags:
+            self.lexical_index.replace_group(f"concept:{stale_ids[tag]}", [])
+        
+        instrumentation.count('concepts_pruned', len(tags))
+        print(f"Pruned {len(tags)} concepts without files: {', '.join(tags)}")
+    
+    def save_index(self):
+        """Persist the lexical index next to the vector data."""
+        
+        self.lexical_index.save(self.index_path)
+        print(f"Saved lexical index with {len(self.lexical_index)} chunks to {self.index_path}")
 
 async def main():
     parser = argparse.ArgumentParser(description='Import concept docs for RAG system')
     parser.add_argument('--file', type=str, help='Single markdown file to process')
     parser.add_argument('--directory', type=str, help='Directory of markdown files to process')
+    parser.add_argument('--index-path', type=str, default=str(DEFAULT_CONCEPT_INDEX_PATH),
+                        help='Lexical (BM25) index file to update')
+    parser.add_argument('--dedup-threshold', type=float, default=0.85,
+                        help='Jaccard similarity above which chunks are collapsed as near-duplicates (0 disables)')
+    parser.add_argument('--sync', action='store_true',
+                        help='Synchronize the directory in bulk: batched upserts by tag and chunk writes')
+    parser.add_argument('--sync-batch-size', type=int, default=25, help='Concepts per upsert and chunk write in --sync')
+    parser.add_argument('--prune', action='store_true', help='With --sync, delete concepts whose files are gone')
+    instrumentation.add_profile_argument(parser)
     
     args = parser.parse_args()
+    if args.prune and not args.sync:
+        parser.error('--prune requires --sync')
     
+    with instrumentation.instrumented_run('import_concepts', args.profile):
+        await run(args, parser)
+
+async def run(args, parser):
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY or not OPENAI_API_KEY:
         print("Error: Missing required environment variables")
         print("Required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, OPENAI_API_KEY")
+        instrumentation.mark_failed()
         return
     
-    concept_parser = ConceptParser()
+    concept_parser = ConceptParser(Path(args.index_path), args.dedup_threshold)
     
     if args.file:
         file_path = Path(args.file)
@@ -283,6 +575,7 @@ async def main():
             return
         
         result = await concept_parser.process_concept_file(file_path)
+        concept_parser.save_index()
         print(json.dumps(result, indent=2, ensure_ascii=False))
     
     elif args.directory:
@@ -291,7 +584,11 @@ async def main():
             print(f"Error: Directory not found: {directory}")
             return
         
-        results = await concept_parser.process_directory(directory)
+        if args.sync:
+            results = await concept_parser.sync_directory(directory, args.sync_batch_size, args.prune)
+        else:
+            results = await concept_parser.process_directory(directory)
+        concept_parser.save_index()
         
         # Print summary
         successful = sum(1 for r in results if r['status'] == 'success')
@@ -300,12 +597,16 @@ async def main():
         print(f"\nProcessing complete:")
         print(f"✅ Successful: {successful}")
         print(f"❌ Errors: {errors}")
+        instrumentation.count('files_imported', successful)
+        instrumentation.count('files_failed', errors)
         
         if errors > 0:
             print("\nErrors:")
             for result in results:
                 if result['status'] == 'error':
                     print(f"  {result['file_path']}: {result['error']}")
+        
+        concept_parser.report_duplicates()
     
     else:
         parser.print_help()
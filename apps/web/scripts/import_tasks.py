@@ -9,6 +9,8 @@ Usage: python import_tasks.py --file path/to/task.md --task-id uuid
 
 import os
 import re
+import sys
+import time
 import json
 import argparse
 import hashlib
@@ -19,20 +21,41 @@ import aiohttp
 from supabase import create_client, Client
 from datetime import datetime
 
+from lexical_index import BM25Index
+from retrieval import DEFAULT_TASK_INDEX_PATH, task_chunk_doc_id
+
+# Shared job instrumentation lives in the repository's top-level scripts/ directory
+sys.path.append(str(Path(__file__).resolve().parents[3] / 'scripts'))
+import instrumentation
+
 # Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+def chunk_content_hash(chunk_md: str) -> str:
+    """Content address of a chunk; matches encode(sha256(convert_to(chunk_md, 'UTF8')), 'hex')."""
+    return hashlib.sha256(chunk_md.encode('utf-8')).hexdigest()
+
 class TaskChunk:
     def __init__(self, step_idx: int, chunk_md: str, embedding: List[float] = None):
         self.step_idx = step_idx
         self.chunk_md = chunk_md
         self.embedding = embedding
+    
+    @property
+    def content_hash(self) -> str:
+        return chunk_content_hash(self.chunk_md)
 
 class TaskParser:
-    def __init__(self):
+    def __init__(self, index_path: Path = DEFAULT_TASK_INDEX_PATH):
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        self.index_path = index_path
+        self.lexical_index = BM25Index.load(index_path)
+        # Content hashes known to have an embedding in chunk_contents
+        self.known_hashes = set()
+        self.embedded_count = 0
+        self.reused_count = 0
     
     def parse_markdown_task(self, content: str) -> Tuple[Dict, List[TaskChunk]]:
         """
@@ -129,8 +152,11 @@ class TaskParser:
             batch_size = 100
             all_embeddings = []
             
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
+            # Identical texts are embedded only once
+            unique_texts = list(dict.fromkeys(texts))
+            
+            for i in range(0, len(unique_texts), batch_size):
+                batch = unique_texts[i:i + batch_size]
                 
                 payload = {
                     'model': 'text-embedding-3-small',
@@ -153,30 +179,66 @@ class TaskParser:
                 # Add delay to respect rate limits
                 await asyncio.sleep(0.1)
             
-            return all_embeddings
+            embeddings_by_text = dict(zip(unique_texts, all_embeddings))
+            return [embeddings_by_text[text] for text in texts]
+    
+    def find_missing_contents(self, chunks: List[TaskChunk]) -> Dict[str, str]:
+        """Return ``{content_hash: chunk_md}`` for chunks whose contents still need an embedding."""
+        
+        candidates = {}
+        for chunk in chunks:
+            if chunk.content_hash not in self.known_hashes:
+                candidates.setdefault(chunk.content_hash, chunk.chunk_md)
+        
+        if not candidates:
+            return {}
+        
+        result = self.supabase.rpc('missing_chunk_contents', {
+            'p_hashes': list(candidates)
+        }).execute()
+        missing = {row['content_hash'] for row in result.data or []}
+        
+        self.known_hashes.update(h for h in candidates if h not in missing)
+        return {h: text for h, text in candidates.items() if h in missing}
     
     async def process_task_file(self, file_path: Path, task_id: str = None) -> Dict:
         """Process a single task file and upload to database."""
         
         print(f"Processing task file: {file_path}")
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Parse the markdown
-        task_metadata, solution_chunks = self.parse_markdown_task(content)
+        with instrumentation.stage('parse'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            # Parse the markdown
+            task_metadata, solution_chunks = self.parse_markdown_task(content)
         
         if not solution_chunks:
             print(f"Warning: No solution steps found in {file_path}")
             return {'status': 'skipped', 'reason': 'No solution steps'}
         
-        # Generate embeddings for all chunks
-        chunk_texts = [chunk.chunk_md for chunk in solution_chunks]
-        embeddings = await self.generate_embeddings(chunk_texts)
+        # Embed only chunk contents not yet in the shared chunk_contents store
+        with instrumentation.stage('lookup'):
+            new_contents = self.find_missing_contents(solution_chunks)
+        if new_contents:
+            with instrumentation.stage('embed'):
+                embeddings = await self.generate_embeddings(list(new_contents.values()))
+            with instrumentation.stage('write'):
+                self.supabase.rpc('upsert_chunk_contents', {
+                    'p_contents': [
+                        {'content_hash': content_hash, 'chunk_md': chunk_md, 'embedding': embedding}
+                        for (content_hash, chunk_md), embedding in zip(new_contents.items(), embeddings)
+                    ]
+                }).execute()
+            self.known_hashes.update(new_contents)
         
-        # Assign embeddings to chunks
-        for chunk, embedding in zip(solution_chunks, embeddings):
-            chunk.embedding = embedding
+        self.embedded_count += len(new_contents)
+        self.reused_count += len(solution_chunks) - len(new_contents)
+        instrumentation.count('chunks_embedded', len(new_contents))
+        instrumentation.count('chunks_reused', len(solution_chunks) - len(new_contents))
+        print(f"Embedded {len(new_contents)} new chunk contents, reused {len(solution_chunks) - len(new_contents)}")
+        
+        write_started = time.perf_counter()
         
         # Create or update task in database
         if not task_id:
@@ -213,8 +275,7 @@ class TaskParser:
         for chunk in solution_chunks:
             chunks_data.append({
                 'step_idx': chunk.step_idx,
-                'chunk_md': chunk.chunk_md,
-                'embedding': chunk.embedding
+                'content_hash': chunk.content_hash
             })
         
         # Insert chunks using the custom function
@@ -228,6 +289,15 @@ class TaskParser:
         else:
             print(f"Warning: No chunks inserted for task {task_id}")
         
+        instrumentation.record_stage('write', time.perf_counter() - write_started)
+        
+        # Keep the lexical index in sync with the chunks just stored
+        with instrumentation.stage('index'):
+            self.lexical_index.replace_group(f"task:{task_id}", [
+                (task_chunk_doc_id(task_id, chunk.step_idx), chunk.chunk_md)
+                for chunk in solution_chunks
+            ])
+        
         return {
             'status': 'success',
             'task_id': task_id,
@@ -256,6 +326,12 @@ class TaskParser:
                 })
         
         return results
+    
+    def save_index(self):
+        """Persist the lexical index next to the vector data."""
+        
+        self.lexical_index.save(self.index_path)
+        print(f"Saved lexical index with {len(self.lexical_index)} chunks to {self.index_path}")
 
 async def main():
     parser = argparse.ArgumentParser(description='Import tasks for RAG system')
@@ -263,15 +339,23 @@ async def main():
     parser.add_argument('--directory', type=str, help='Directory of markdown files to process')
     parser.add_argument('--task-id', type=str, help='Specific task ID to update')
     parser.add_argument('--batch', action='store_true', help='Process all files in directory')
+    parser.add_argument('--index-path', type=str, default=str(DEFAULT_TASK_INDEX_PATH),
+                        help='Lexical (BM25) index file to update')
+    instrumentation.add_profile_argument(parser)
     
     args = parser.parse_args()
     
+    with instrumentation.instrumented_run('import_tasks', args.profile):
+        await run(args, parser)
+
+async def run(args, parser):
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY or not OPENAI_API_KEY:
         print("Error: Missing required environment variables")
         print("Required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, OPENAI_API_KEY")
+        instrumentation.mark_failed()
         return
     
-    task_parser = TaskParser()
+    task_parser = TaskParser(Path(args.index_path))
     
     if args.file:
         file_path = Path(args.file)
@@ -280,6 +364,7 @@ async def main():
             return
         
         result = await task_parser.process_task_file(file_path, args.task_id)
+        task_parser.save_index()
         print(json.dumps(result, indent=2, ensure_ascii=False))
     
     elif args.directory:
@@ -289,6 +374,7 @@ async def main():
             return
         
         results = await task_parser.process_directory(directory)
+        task_parser.save_index()
         
         # Print summary
         successful = sum(1 for r in results if r['status'] == 'success')
@@ -297,6 +383,9 @@ async def main():
         print(f"\nProcessing complete:")
         print(f"✅ Successful: {successful}")
         print(f"❌ Errors: {errors}")
+        print(f"🧮 Chunk embeddings: {task_parser.embedded_count} new, {task_parser.reused_count} reused")
+        instrumentation.count('files_imported', successful)
+        instrumentation.count('files_failed', errors)
         
         if errors > 0:
             print("\nErrors:")
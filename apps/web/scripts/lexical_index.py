@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Lexical (BM25) index for AcademGrad RAG chunks.
+
+Builds a compact inverted index over task and concept chunk text with Russian
+stemming and LaTeX-aware tokenization, so that exact terms and formulas from a
+student question ("формула приведения", "sin^2") can be matched even when
+cosine similarity ranks them low.
+"""
+
+import gzip
+import json
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import snowballstemmer
+    _STEMMER = snowballstemmer.stemmer('russian')
+except ImportError:  # pragma: no cover - optional dependency
+    _STEMMER = None
+
+INDEX_VERSION = 1
+
+# Frequent Russian function words that carry no retrieval signal
+RUSSIAN_STOPWORDS = {
+    'а', 'без', 'более', 'бы', 'был', 'была', 'были', 'было', 'быть', 'в', 'вам',
+    'во', 'вот', 'все', 'всё', 'где', 'да', 'для', 'до', 'его', 'ее', 'её', 'если',
+    'есть', 'еще', 'ещё', 'же', 'за', 'и', 'из', 'или', 'им', 'их', 'к', 'как',
+    'ко', 'когда', 'ли', 'мы', 'на', 'над', 'не', 'нет', 'ни', 'но', 'о', 'об',
+    'от', 'по', 'под', 'при', 'с', 'со', 'так', 'также', 'то', 'тогда', 'только',
+    'у', 'уже', 'что', 'чтобы', 'это', 'этот', 'эта', 'эти', 'я',
+}
+
+# Longest suffixes first; used only when snowballstemmer is not installed
+_FALLBACK_SUFFIXES = sorted([
+    'иями', 'ями', 'ами', 'ией', 'ий', 'ый', 'ой', 'ей', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ую', 'юю',
+    'ах', 'ях', 'ия', 'ие', 'ию', 'ии', 'ов', 'ев', 'ам', 'ям', 'ть', 'ться',
+    'ет', 'ут', 'ют', 'ит', 'ат', 'ят', 'ешь', 'ишь', 'а', 'я', 'о', 'е', 'ы', 'и',
+    'у', 'ю', 'ь',
+], key=len, reverse=True)
+
+# \sin^2, sin^{2}, x^2 -> "sin^2", "x^2"
+_POWER_RE = re.compile(r'\\?([a-zA-Z]+|\d+)\s*\^\s*\{?\s*([0-9a-zA-Z]+)\s*\}?')
+# \frac, \sqrt, \cos -> "frac", "sqrt", "cos"
+_LATEX_COMMAND_RE = re.compile(r'\\([a-zA-Z]+)')
+_WORD_RE = re.compile(r'[0-9a-zа-я]+')
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Reduce a Russian word to its stem; Latin words and numbers pass through."""
+
+    if not _CYRILLIC_RE.search(word):
+        return word
+
+    if _STEMMER is not None:
+        return _STEMMER.stemWord(word)
+
+    for suffix in _FALLBACK_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split chunk or query text into index terms.
+
+    Markdown math delimiters are dropped, LaTeX commands keep their name
+    (``\\sin`` -> ``sin``), powers become compound tokens (``\\sin^2 x`` ->
+    ``sin^2``, ``sin``, ``x``) and Russian words are stemmed.
+    """
+
+    text = text.lower().replace('ё', 'е').replace('$', ' ')
+
+    compound = [f"{base}^{exp}" for base, exp in _POWER_RE.findall(text)]
+    text = _POWER_RE.sub(lambda m: f" {m.group(1)} ", text)
+    text = _LATEX_COMMAND_RE.sub(lambda m: f" {m.group(1)} ", text)
+
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        if word in RUSSIAN_STOPWORDS:
+            continue
+        tokens.append(stem(word))
+
+    tokens.extend(compound)
+    return tokens
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index.
+
+    Documents are grouped (e.g. ``task:<task_id>`` or ``concept:<concept_id>``)
+    so an importer can replace all chunks of one task when it is re-imported.
+    Only term frequencies are stored, not chunk text, which keeps the index
+    small enough to ship alongside the importers.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Dict[str, int]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.groups: Dict[str, List[str]] = {}
+        self.doc_groups: Dict[str, str] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def avg_doc_len(self) -> float:
+        return self.total_len / len(self.doc_len) if self.doc_len else 0.0
+
+    def add_document(self, doc_id: str, text: str, group: Optional[str] = None):
+        """Index a single chunk, replacing any previous version of it."""
+
+        if doc_id in self.doc_len:
+            self.remove_document(doc_id)
+
+        terms: Dict[str, int] = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = terms
+        self.doc_len[doc_id] = length
+        self.total_len += length
+
+        if group is not None:
+            self.groups.setdefault(group, []).append(doc_id)
+            self.doc_groups[doc_id] = group
+
+    def remove_document(self, doc_id: str):
+        """Drop a chunk from the index and from its group."""
+
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+
+        group = self.doc_groups.pop(doc_id, None)
+        members = self.groups.get(group)
+        if members is not None:
+            members.remove(doc_id)
+            if not members:
+                del self.groups[group]
+
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+        self.total_len -= self.doc_len.pop(doc_id)
+
+    def replace_group(self, group: str, documents: Iterable[Tuple[str, str]]):
+        """Replace all chunks of a group with ``(doc_id, text)`` pairs."""
+
+        for doc_id in self.groups.pop(group, []):
+            self.remove_document(doc_id)
+
+        for doc_id, text in documents:
+            self.add_document(doc_id, text, group=group)
+
+    def search(self, query: str, limit: int = 10, group: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Return ``(doc_id, score)`` pairs ranked by BM25, optionally within one group."""
+
+        allowed = set(self.groups.get(group, [])) if group is not None else None
+        if allowed is not None and not allowed:
+            return []
+
+        n_docs = len(self.doc_len)
+        avg_len = self.avg_doc_len or 1.0
+        scores: Dict[str, float] = {}
+
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def save(self, path: Path):
+        """Persist the index as gzipped JSON."""
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        payload = {
+            'version': INDEX_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'doc_terms': self.doc_terms,
+            'groups': self.groups,
+        }
+
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'BM25Index':
+        """Load an index saved with :meth:`save`; a missing file yields an empty index."""
+
+        path = Path(path)
+        if not path.exists():
+            return cls()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+
+        if payload.get('version') != INDEX_VERSION:
+            print(f"Warning: Ignoring lexical index {path} with unsupported version {payload.get('version')}")
+            return cls()
+
+        index = cls(k1=payload['k1'], b=payload['b'])
+        # Older saves could list a re-added chunk twice in its group
+        index.groups = {group: list(dict.fromkeys(doc_ids)) for group, doc_ids in payload['groups'].items()}
+        for group, doc_ids in index.groups.items():
+            for doc_id in doc_ids:
+                index.doc_groups[doc_id] = group
+        for doc_id, terms in payload['doc_terms'].items():
+            for term, tf in terms.items():
+                index.postings.setdefault(term, {})[doc_id] = tf
+            length = sum(terms.values())
+            index.doc_terms[doc_id] = terms
+            index.doc_len[doc_id] = length
+            index.total_len += length
+
+        return index
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Concept Partition Migration Script for AcademGrad RAG System
+
+Backfills concept_chunks_partitioned from the legacy concept_chunks table, one
+exam/subject partition at a time, and (re)builds each partition's vector index.
+Usage: python migrate_concept_partitions.py
+       python migrate_concept_partitions.py --exam егэ --subject математика
+       python migrate_concept_partitions.py --reindex-only
+       python migrate_concept_partitions.py --dry-run
+"""
+
+import os
+import json
+import argparse
+import time
+from typing import List, Tuple
+from supabase import create_client, Client
+
+# Configuration
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+
+PAGE_SIZE = 1000
+
+def list_partitions(supabase: Client) -> List[Tuple[str, str]]:
+    """Return every distinct (exam_type, subject) pair present in concept_docs."""
+
+    pairs = set()
+    offset = 0
+
+    while True:
+        rows = supabase.table('concept_docs').select('exam_type, subject') \
+            .range(offset, offset + PAGE_SIZE - 1).execute().data or []
+        for row in rows:
+            pairs.add((row['exam_type'] or '', row['subject'] or ''))
+        if len(rows) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    return sorted(pairs)
+
+def migrate_partition(supabase: Client, exam: str, subject: str, reindex_only: bool = False) -> dict:
+    """Backfill (or just reindex) a single exam/subject partition."""
+
+    started = time.perf_counter()
+
+    if reindex_only:
+        rows = 0
+        index_state = supabase.rpc('maintain_concept_partition_index', {
+            'p_exam': exam,
+            'p_subject': subject,
+            'p_force': True
+        }).execute().data
+    else:
+        rows = supabase.rpc('backfill_concept_partition', {
+            'p_exam': exam,
+            'p_subject': subject
+        }).execute().data or 0
+        index_state = supabase.rpc('maintain_concept_partition_index', {
+            'p_exam': exam,
+            'p_subject': subject,
+            'p_force': False
+        }).execute().data
+
+    return {
+        'exam_type': exam,
+        'subject': subject,
+        'rows': rows,
+        'index': index_state,
+        'seconds': round(time.perf_counter() - started, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate concept chunks into exam/subject partitions')
+    parser.add_argument('--exam', type=str, help='Only migrate this exam_type')
+    parser.add_argument('--subject', type=str, help='Only migrate this subject')
+    parser.add_argument('--reindex-only', action='store_true', help='Rebuild partition indexes without copying rows')
+    parser.add_argument('--dry-run', action='store_true', help='List partitions without changing anything')
+
+    args = parser.parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        print("Error: Missing required environment variables")
+        print("Required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY")
+        return
+
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+    partitions = [
+        (exam, subject) for exam, subject in list_partitions(supabase)
+        if (args.exam is None or exam == args.exam)
+        and (args.subject is None or subject == args.subject)
+    ]
+
+    print(f"Found {len(partitions)} exam/subject partitions")
+
+    if args.dry_run:
+        for exam, subject in partitions:
+            print(f"  {exam or '-'} / {subject or '-'}")
+        return
+
+    results = []
+    for exam, subject in partitions:
+        try:
+            result = migrate_partition(supabase, exam, subject, args.reindex_only)
+            results.append(result)
+            print(f"✓ {exam or '-'} / {subject or '-'}: {result['rows']} rows, index {result['index']} ({result['seconds']}s)")
+        except Exception as e:
+            print(f"✗ {exam or '-'} / {subject or '-'}: {e}")
+            results.append({'exam_type': exam, 'subject': subject, 'error': str(e)})
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate chunk detection for AcademGrad RAG System
+
+Several concept files restate the same formulas, and every copy ends up
+embedded and competing for the two ``match_count`` slots of
+search_concept_chunks. This module detects near-duplicate chunks with MinHash
+signatures and LSH banding before they are embedded.
+
+Only one compact signature per distinct (representative) chunk is kept, so
+memory grows with the number of distinct chunks (~0.6 KB each at 128
+permutations), not with the number of comparisons.
+"""
+
+import hashlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lexical_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional acceleration
+    np = None
+
+# Mersenne prime 2^31 - 1; a * h + b stays below 2^64 for 32-bit shingle hashes
+_PRIME = (1 << 31) - 1
+
+def shingles(text: str, size: int = 3) -> List[int]:
+    """Hash the word ``size``-grams of a chunk into 32-bit integers."""
+
+    tokens = tokenize(text)
+    if not tokens:
+        return []
+
+    if len(tokens) < size:
+        grams = [' '.join(tokens)]
+    else:
+        grams = [' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+    return sorted({
+        int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=4).digest(), 'little')
+        for gram in grams
+    })
+
+def _integrate(func, start: float, end: float, steps: int = 100) -> float:
+    width = (end - start) / steps
+    return sum(func(start + (i + 0.5) * width) for i in range(steps)) * width
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Pick ``(bands, rows)`` with ``bands * rows == num_perm`` minimizing the
+    sum of the false positive and false negative areas under the LSH
+    S-curve ``1 - (1 - s ** rows) ** bands`` around ``threshold``.
+    """
+
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+
+        def collision(s, bands=bands, rows=rows):
+            return 1 - (1 - s ** rows) ** bands
+
+        false_positive = _integrate(collision, 0.0, threshold)
+        false_negative = _integrate(lambda s: 1 - collision(s), threshold, 1.0)
+        error = false_positive + false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+
+    return best[1], best[2]
+
+class NearDuplicateDetector:
+    """
+    Streaming MinHash/LSH near-duplicate detector.
+
+    Chunks are fed one at a time through :meth:`check`. The first chunk of a
+    cluster becomes its representative; later chunks whose estimated Jaccard
+    similarity to a representative is at least ``threshold`` are collapsed
+    into that cluster and should not be embedded.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128,
+                 shingle_size: int = 3, seed: int = 1):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Jaccard threshold must be in (0, 1], got {threshold}")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+
+        rng = hashlib.sha256(str(seed).encode('utf-8')).digest()
+        coefficients = []
+        counter = 0
+        while len(coefficients) < 2 * num_perm:
+            rng = hashlib.sha256(rng + counter.to_bytes(4, 'little')).digest()
+            counter += 1
+            for offset in range(0, len(rng), 4):
+                value = int.from_bytes(rng[offset:offset + 4], 'little') % _PRIME
+                if value:
+                    coefficients.append(value)
+        self._a = coefficients[:num_perm]
+        self._b = coefficients[num_perm:2 * num_perm]
+
+        if np is not None:
+            self._np_a = np.array(self._a, dtype=np.uint64)[:, None]
+            self._np_b = np.array(self._b, dtype=np.uint64)[:, None]
+
+        self._signatures: Dict[str, array] = {}
+        self._buckets: List[Dict[int, List[str]]] = [{} for _ in range(self.bands)]
+        self._members: Dict[str, List[str]] = {}
+
+        self.checked = 0
+        self.duplicates = 0
+
+    def signature(self, text: str) -> Optional[array]:
+        """MinHash signature of a chunk, or None for chunks without tokens."""
+
+        hashed = shingles(text, self.shingle_size)
+        if not hashed:
+            return None
+
+        if np is not None:
+            values = np.array(hashed, dtype=np.uint64)[None, :]
+            mins = ((self._np_a * values + self._np_b) % _PRIME).min(axis=1)
+            return array('I', mins.astype(np.uint32).tolist())
+
+        return array('I', [
+            min((a * h + b) % _PRIME for h in hashed)
+            for a, b in zip(self._a, self._b)
+        ])
+
+    def _band_keys(self, sig: array) -> Iterable[Tuple[int, int]]:
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, hash(tuple(sig[start:start + self.rows]))
+
+    @staticmethod
+    def similarity(left: array, right: array) -> float:
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+    def check(self, key: str, text: str) -> Optional[str]:
+        """
+        Register a chunk under ``key``.
+
+        Returns the key of the representative it duplicates, or None when the
+        chunk is new and becomes a representative itself.
+        """
+
+        self.checked += 1
+        sig = self.signature(text)
+        if sig is None:
+            return None
+
+        band_keys = list(self._band_keys(sig))
+
+        seen = set()
+        for band, band_hash in band_keys:
+            for candidate in self._buckets[band].get(band_hash, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if self.similarity(sig, self._signatures[candidate]) >= self.threshold:
+                    self._members[candidate].append(key)
+                    self.duplicates += 1
+                    return candidate
+
+        self._signatures[key] = sig
+        self._members[key] = [key]
+        for band, band_hash in band_keys:
+            self._buckets[band].setdefault(band_hash, []).append(key)
+
+        return None
+
+    def clusters(self) -> Dict[str, List[str]]:
+        """Clusters with at least one collapsed duplicate, keyed by representative."""
+        return {rep: members for rep, members in self._members.items() if len(members) > 1}
+
+    def report(self, limit: int = 20):
+        """Print a short summary of collapsed clusters."""
+
+        clusters = self.clusters()
+        print(f"\nNear-duplicate detection (Jaccard >= {self.threshold}, {self.bands}x{self.rows} LSH bands):")
+        print(f"  Checked {self.checked} chunks, collapsed {self.duplicates} into {len(clusters)} clusters")
+
+        largest = sorted(clusters.items(), key=lambda item: len(item[1]), reverse=True)[:limit]
+        for rep, members in largest:
+            print(f"  {rep}: {len(members) - 1} duplicates")
+            for member in members[1:4]:
+                print(f"    - {member}")
+            if len(members) > 4:
+                print(f"    ... and {len(members) - 4} more")
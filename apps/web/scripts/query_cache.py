@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Query embedding cache for AcademGrad RAG System
+
+Chat questions repeat word for word across thousands of students, so their
+embeddings are cached in two tiers: an in-memory LRU in front of a persistent
+SQLite store. Both tiers are keyed by normalized question text and model and
+honour a TTL; a hit never calls the embedding API.
+
+Usage:
+    embedder = QueryEmbedder(QueryEmbeddingCache('rag_index/query_embeddings.sqlite3'))
+    retriever = HybridRetriever(supabase, embedder=embedder)
+    retriever.search_task_chunks(task_id, question)
+    retriever.cache_stats()
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+EMBEDDING_MODEL = 'text-embedding-3-small'
+DEFAULT_CACHE_PATH = Path('rag_index') / 'query_embeddings.sqlite3'
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different spellings share a cache entry."""
+
+    text = unicodedata.normalize('NFKC', question).lower().replace('ё', 'е')
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+    return text.rstrip('?!. ')
+
+def cache_key(question: str, model: str = EMBEDDING_MODEL) -> str:
+    """Cache key of a question for a given embedding model."""
+
+    return hashlib.sha256(f"{model}\n{normalize_question(question)}".encode('utf-8')).hexdigest()
+
+class QueryEmbeddingCache:
+    """
+    Two-tier embedding cache.
+
+    ``memory_entries`` bounds the in-process LRU, ``max_entries`` bounds the
+    persistent store (least recently used rows are evicted first) and
+    ``ttl_seconds`` expires entries in both tiers. Embeddings are stored as
+    packed float32 to keep the store compact.
+    """
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, model: str = EMBEDDING_MODEL,
+                 memory_entries: int = 2048, max_entries: int = 200_000,
+                 ttl_seconds: int = 30 * 24 * 3600):
+        self.model = model
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: 'OrderedDict[str, Tuple[float, List[float]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                cache_key  TEXT PRIMARY KEY,
+                model      TEXT NOT NULL,
+                embedding  BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used  REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used)'
+        )
+        self._conn.commit()
+
+    def get(self, question: str) -> Optional[List[float]]:
+        """Return the cached embedding of a question, or None."""
+
+        key = cache_key(question, self.model)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return embedding
+                del self._memory[key]
+
+            row = self._conn.execute(
+                'SELECT embedding, created_at FROM query_embeddings WHERE cache_key = ?', (key,)
+            ).fetchone()
+
+            if row is None or row[1] + self.ttl_seconds <= now:
+                if row is not None:
+                    self._conn.execute('DELETE FROM query_embeddings WHERE cache_key = ?', (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE query_embeddings SET last_used = ? WHERE cache_key = ?', (now, key))
+            self._conn.commit()
+
+            embedding = array('f', row[0]).tolist()
+            self._remember(key, row[1] + self.ttl_seconds, embedding)
+            self.store_hits += 1
+            return embedding
+
+    def put(self, question: str, embedding: List[float]):
+        """Store a freshly computed embedding in both tiers."""
+
+        key = cache_key(question, self.model)
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now + self.ttl_seconds, embedding)
+            self._conn.execute("""
+                INSERT OR REPLACE INTO query_embeddings (cache_key, model, embedding, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, self.model, array('f', embedding).tobytes(), now, now))
+            self._conn.commit()
+
+            # Size-based eviction is amortized over many writes
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self._writes_since_evict = 0
+                self._evict_store(now)
+
+    def _remember(self, key: str, expires_at: float, embedding: List[float]):
+        self._memory[key] = (expires_at, embedding)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_store(self, now: float):
+        self._conn.execute('DELETE FROM query_embeddings WHERE created_at <= ?', (now - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM query_embeddings WHERE cache_key IN (
+                SELECT cache_key FROM query_embeddings
+                ORDER BY last_used DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for both tiers."""
+
+        lookups = self.memory_hits + self.store_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'memory_size': len(self._memory),
+            'hit_rate': (self.memory_hits + self.store_hits) / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        self._conn.close()
+
+class QueryEmbedder:
+    """Embeds chat questions through the cache, calling OpenAI only on a miss."""
+
+    def __init__(self, cache: QueryEmbeddingCache):
+        self.cache = cache
+
+    async def embed(self, question: str) -> List[float]:
+        """
+        Embedding of a question, from the cache when possible.
+
+        The normalized question (see :func:`normalize_question`) is what gets
+        embedded, not the raw text: every spelling sharing a cache key then
+        gets the same vector whichever of them was asked first. Vectors can
+        differ slightly from embedding the raw question directly.
+        """
+
+        embedding = self.cache.get(question)
+        if embedding is not None:
+            return embedding
+
+        async with aiohttp.ClientSession() as session:
+            headers = {
+                'Authorization': f'Bearer {OPENAI_API_KEY}',
+                'Content-Type': 'application/json'
+            }
+
+            payload = {
+                'model': self.cache.model,
+                'input': normalize_question(question)
+            }
+
+            async with session.post(
+                'https://api.openai.com/v1/embeddings',
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"OpenAI API error: {response.status} - {error_text}")
+
+                result = await response.json()
+                embedding = result['data'][0]['embedding']
+
+        self.cache.put(question, embedding)
+        return embedding
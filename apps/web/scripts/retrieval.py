@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Hybrid retrieval for AcademGrad RAG System
+
+Fuses BM25 scores from the lexical index built by the importers with cosine
+similarity from pgvector, so exact formulas and terms quoted by a student are
+found without inflating ``match_count`` and the prompt sent to the LLM.
+"""
+
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from supabase import Client
+
+from lexical_index import BM25Index
+from query_cache import QueryEmbedder
+
+DEFAULT_TASK_INDEX_PATH = Path('rag_index') / 'task_chunks.bm25.json.gz'
+DEFAULT_CONCEPT_INDEX_PATH = Path('rag_index') / 'concept_chunks.bm25.json.gz'
+
+def task_chunk_doc_id(task_id: str, step_idx: int) -> str:
+    """Lexical index document id of a task solution step."""
+    return f"task:{task_id}:{step_idx}"
+
+def content_key(chunk_md: str) -> str:
+    """Short content hash used to match concept chunks across retrievers."""
+    return hashlib.sha1(chunk_md.encode('utf-8')).hexdigest()[:16]
+
+def concept_chunk_doc_id(concept_id: str, chunk_md: str) -> str:
+    """Lexical index document id of a concept chunk (concept chunks have no position column)."""
+    return f"concept:{concept_id}:{content_key(chunk_md)}"
+
+def _normalize(scores: Dict[str, float]) -> Dict[str, float]:
+    """Min-max normalize scores into [0, 1]."""
+
+    if not scores:
+        return {}
+
+    low = min(scores.values())
+    high = max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+
+    return {key: (value - low) / (high - low) for key, value in scores.items()}
+
+def fuse_scores(vector_scores: Dict[str, float], lexical_scores: Dict[str, float],
+                lexical_weight: float = 0.4) -> List[tuple]:
+    """
+    Combine vector and lexical scores into one ranking.
+
+    Both score sets are min-max normalized first; a candidate missing from one
+    side contributes 0 for that side. Returns ``(key, fused_score)`` pairs,
+    best first.
+    """
+
+    vector_norm = _normalize(vector_scores)
+    lexical_norm = _normalize(lexical_scores)
+
+    fused = {}
+    for key in set(vector_norm) | set(lexical_norm):
+        fused[key] = (
+            (1 - lexical_weight) * vector_norm.get(key, 0.0)
+            + lexical_weight * lexical_norm.get(key, 0.0)
+        )
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+class HybridRetriever:
+    def __init__(self, supabase: Client,
+                 task_index_path: Path = DEFAULT_TASK_INDEX_PATH,
+                 concept_index_path: Path = DEFAULT_CONCEPT_INDEX_PATH,
+                 lexical_weight: float = 0.4,
+                 candidate_multiplier: int = 3,
+                 partitioned_concepts: bool = True,
+                 embedder: Optional[QueryEmbedder] = None):
+        self.supabase = supabase
+        # Embeds questions searched without a query embedding, through the query cache
+        self.embedder = embedder
+        self.task_index = BM25Index.load(task_index_path)
+        self.concept_index = BM25Index.load(concept_index_path)
+        self.lexical_weight = lexical_weight
+        self.candidate_multiplier = candidate_multiplier
+        self.partitioned_concepts = partitioned_concepts
+
+    async def embed_question(self, question: str) -> List[float]:
+        """Embed a question through the embedder; async callers pass the result to the search methods."""
+
+        if self.embedder is None:
+            raise ValueError('query_embedding is required when the retriever has no embedder')
+        return await self.embedder.embed(question)
+
+    def _query_embedding(self, question: str, query_embedding: Optional[List[float]]) -> List[float]:
+        if query_embedding is not None:
+            return query_embedding
+        return asyncio.run(self.embed_question(question))
+
+    def cache_stats(self) -> Dict[str, float]:
+        """Hit/miss counters of the query embedding cache (empty without an embedder)."""
+
+        return self.embedder.cache.stats() if self.embedder is not None else {}
+
+    def search_task_chunks(self, task_id: str, question: str, query_embedding: Optional[List[float]] = None,
+                           match_count: int = 2, similarity_threshold: float = 0.3) -> List[Dict]:
+        """
+        Return the ``match_count`` best solution steps of a task for a question.
+
+        A wider candidate pool is pulled from both retrievers and fused, so a
+        smaller final ``match_count`` keeps the same recall as pure vector
+        search with a larger one. Without ``query_embedding`` the question is
+        embedded through the retriever's embedder (and its cache).
+        """
+
+        query_embedding = self._query_embedding(question, query_embedding)
+        candidate_count = match_count * self.candidate_multiplier
+
+        vector_rows = self.supabase.rpc('search_task_chunks', {
+            'task_id_param': task_id,
+            'query_embedding': query_embedding,
+            'similarity_threshold': similarity_threshold,
+            'match_count': candidate_count
+        }).execute().data or []
+
+        chunks = {task_chunk_doc_id(task_id, row['step_idx']): row for row in vector_rows}
+        vector_scores = {key: row['similarity'] for key, row in chunks.items()}
+
+        lexical_scores = dict(self.task_index.search(
+            question, limit=candidate_count, group=f"task:{task_id}"
+        ))
+
+        ranked = fuse_scores(vector_scores, lexical_scores, self.lexical_weight)[:match_count]
+
+        # Lexical-only hits were never returned by pgvector, fetch their text
+        missing_steps = [int(key.rsplit(':', 1)[1]) for key, _ in ranked if key not in chunks]
+        if missing_steps:
+            rows = self.supabase.table('task_chunks').select('step_idx, chunk_contents(chunk_md)') \
+                .eq('task_id', task_id).in_('step_idx', missing_steps).execute().data or []
+            for row in rows:
+                chunks[task_chunk_doc_id(task_id, row['step_idx'])] = {
+                    'step_idx': row['step_idx'],
+                    'chunk_md': (row.get('chunk_contents') or {}).get('chunk_md', '')
+                }
+
+        results = []
+        for key, score in ranked:
+            row = chunks.get(key)
+            if row is None:
+                continue
+            results.append({
+                'chunk_md': row['chunk_md'],
+                'step_idx': row['step_idx'],
+                'similarity': vector_scores.get(key),
+                'lexical_score': lexical_scores.get(key),
+                'score': score
+            })
+
+        return results
+
+    def search_concept_chunks(self, question: str, query_embedding: Optional[List[float]] = None,
+                              exam_filter: Optional[str] = None, topic_filter: Optional[str] = None,
+                              match_count: int = 2, similarity_threshold: float = 0.3) -> List[Dict]:
+        """
+        Return the ``match_count`` best concept chunks for a question, fused like task chunks.
+
+        Exam/subject filtered queries are routed to the partitioned concept
+        table, which searches only the matching partition's vector index.
+        """
+
+        query_embedding = self._query_embedding(question, query_embedding)
+        candidate_count = match_count * self.candidate_multiplier
+        rpc_name = 'search_concept_chunks_partitioned' if self.partitioned_concepts else 'search_concept_chunks'
+
+        vector_rows = self.supabase.rpc(rpc_name, {
+            'query_embedding': query_embedding,
+            'exam_filter': exam_filter,
+            'topic_filter': topic_filter,
+            'similarity_threshold': similarity_threshold,
+            'match_count': candidate_count
+        }).execute().data or []
+
+        # search_concept_chunks does not return ids, key vector hits by content
+        texts = {}
+        vector_scores = {}
+        for row in vector_rows:
+            key = content_key(row['chunk_md'])
+            texts[key] = row['chunk_md']
+            vector_scores[key] = max(vector_scores.get(key, 0.0), row['similarity'])
+
+        lexical_scores = {}
+        lexical_concepts = {}
+        for doc_id, score in self.concept_index.search(question, limit=candidate_count * 4):
+            _, concept_id, key = doc_id.split(':', 2)
+            if key in lexical_scores:
+                continue
+            lexical_scores[key] = score
+            lexical_concepts[key] = concept_id
+
+        if (exam_filter or topic_filter) and lexical_concepts:
+            query = self.supabase.table('concept_docs').select('id') \
+                .in_('id', list(set(lexical_concepts.values())))
+            if exam_filter:
+                query = query.eq('exam_type', exam_filter)
+            if topic_filter:
+                query = query.eq('subject', topic_filter)
+            allowed = {row['id'] for row in query.execute().data or []}
+            lexical_scores = {
+                key: score for key, score in lexical_scores.items()
+                if lexical_concepts[key] in allowed
+            }
+
+        lexical_scores = dict(sorted(lexical_scores.items(), key=lambda item: item[1], reverse=True)[:candidate_count])
+        ranked = fuse_scores(vector_scores, lexical_scores, self.lexical_weight)[:match_count]
+
+        missing_concepts = {lexical_concepts[key] for key, _ in ranked if key not in texts}
+        if missing_concepts:
+            rows = self.supabase.table('concept_chunks').select('concept_id, chunk_md') \
+                .in_('concept_id', list(missing_concepts)).execute().data or []
+            for row in rows:
+                key = content_key(row['chunk_md'])
+                texts.setdefault(key, row['chunk_md'])
+
+        results = []
+        for key, score in ranked:
+            if key not in texts:
+                continue
+            results.append({
+                'chunk_md': texts[key],
+                'similarity': vector_scores.get(key),
+                'lexical_score': lexical_scores.get(key),
+                'score': score
+            })
+
+        return results
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Watch mode for the task and concept importers.
+
+Monitors the task and concept directories (inotify through watchdog, or
+mtime polling when watchdog is missing, inotify is unavailable or --polling
+is given), debounces bursts of editor writes and re-imports only the files
+that changed. Files imported in the same burst share embedding requests, so
+ten edited files cost one OpenAI call instead of ten.
+
+Usage: python watch_imports.py --tasks-dir tasks/ --concepts-dir concepts/
+       python watch_imports.py --concepts-dir concepts/ --polling --initial-scan
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from import_tasks import TaskParser, SUPABASE_URL, SUPABASE_SERVICE_KEY, OPENAI_API_KEY
+from import_concepts import ConceptParser
+from retrieval import DEFAULT_TASK_INDEX_PATH, DEFAULT_CONCEPT_INDEX_PATH
+import instrumentation
+
+DEFAULT_STATE_PATH = Path('rag_index') / 'watch_state.json'
+
+# Editor swap/backup files that must not trigger imports
+IGNORED_PREFIXES = ('.', '#', '~')
+IGNORED_SUFFIXES = ('~', '.swp', '.swx', '.tmp')
+
+def is_source_file(path: Path) -> bool:
+    """Markdown files the importers handle, excluding editor temp files."""
+    return (path.suffix == '.md'
+            and not path.name.startswith(IGNORED_PREFIXES)
+            and not path.name.endswith(IGNORED_SUFFIXES))
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+class ImportState:
+    """
+    Content hash of every imported file and the task id created for each task
+    file, so edits update the existing task instead of creating a new one and
+    saves without changes are skipped.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+    
+    def get(self, file_path: Path) -> Dict:
+        return self.files.get(str(file_path.resolve()), {})
+    
+    def update(self, file_path: Path, **fields):
+        self.files.setdefault(str(file_path.resolve()), {}).update(fields)
+    
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent ``generate_embeddings`` calls into shared requests.
+    
+    Callers arriving within ``window`` seconds of the first one are served by
+    a single call to ``embed`` over their de-duplicated texts (which itself
+    splits into requests of up to 100 inputs).
+    """
+    
+    def __init__(self, embed, window: float = 0.05):
+        self.embed = embed
+        self.window = window
+        self.pending: List[Tuple[List[str], asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        self.calls = 0
+        self.flushes = 0
+        self.texts = 0
+    
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((texts, future))
+        self.calls += 1
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+        return await future
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        pending, self.pending, self.flush_task = self.pending, [], None
+        
+        unique_texts = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+        self.flushes += 1
+        self.texts += len(unique_texts)
+        try:
+            embeddings = await self.embed(unique_texts)
+            # A short response would leave some callers waiting forever
+            if len(embeddings) != len(unique_texts):
+                raise Exception(f"Expected {len(unique_texts)} embeddings, got {len(embeddings)}")
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        
+        embeddings_by_text = dict(zip(unique_texts, embeddings))
+        for texts, future in pending:
+            future.set_result([embeddings_by_text[text] for text in texts])
+
+class PollingWatcher:
+    """Detects changed files by comparing (mtime, size) snapshots of the directories."""
+    
+    def __init__(self, directories: List[Path], interval: float):
+        self.directories = directories
+        self.interval = interval
+        self.snapshot = self.scan()
+    
+    def scan(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for directory in self.directories:
+            for path in directory.glob('*.md'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+    
+    async def run(self, changes: asyncio.Queue):
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = self.scan()
+            for path, signature in snapshot.items():
+                if self.snapshot.get(path) != signature:
+                    changes.put_nowait(path)
+            self.snapshot = snapshot
+
+def start_inotify_watcher(directories: List[Path], loop: asyncio.AbstractEventLoop, changes: asyncio.Queue):
+    """
+    Start a watchdog observer feeding changed paths into ``changes``.
+    Returns None when watchdog is not installed or the native observer fails.
+    """
+    
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        print("watchdog is not installed, falling back to polling")
+        return None
+    
+    # Only writes count: watchdog also reports opens and closes on inotify,
+    # and reading the files while importing them must not start another batch
+    class Handler(FileSystemEventHandler):
+        def on_created(self, event):
+            self.changed(event.src_path, event)
+        
+        def on_modified(self, event):
+            self.changed(event.src_path, event)
+        
+        def on_moved(self, event):
+            # Editors often save via rename, so the destination is the changed file
+            self.changed(event.dest_path, event)
+        
+        def changed(self, path, event):
+            if not event.is_directory:
+                loop.call_soon_threadsafe(changes.put_nowait, Path(path))
+    
+    observer = Observer()
+    try:
+        for directory in directories:
+            observer.schedule(Handler(), str(directory), recursive=False)
+        observer.start()
+    except OSError as e:
+        # e.g. inotify watch limit reached or a filesystem without inotify
+        print(f"Native file watching unavailable ({e}), falling back to polling")
+        return None
+    return observer
+
+class ImportWatcher:
+    """Debounces file changes and re-imports the affected files in batches."""
+    
+    def __init__(self, tasks_dir: Optional[Path], concepts_dir: Optional[Path], state: ImportState,
+                 task_parser: Optional[TaskParser], concept_parser: Optional[ConceptParser],
+                 debounce: float, max_delay: float):
+        self.tasks_dir = tasks_dir.resolve() if tasks_dir else None
+        self.concepts_dir = concepts_dir.resolve() if concepts_dir else None
+        self.state = state
+        self.task_parser = task_parser
+        self.concept_parser = concept_parser
+        self.debounce = debounce
+        self.max_delay = max_delay
+        
+        # Both importers share one batcher, so a burst touching tasks and concepts still shares requests
+        parser = task_parser or concept_parser
+        self.batcher = EmbeddingBatcher(parser.generate_embeddings)
+        for parser in (task_parser, concept_parser):
+            if parser is not None:
+                parser.generate_embeddings = self.batcher.generate_embeddings
+    
+        # Task files matching several existing tasks; left alone rather than duplicated
+        self.ambiguous: Set[Path] = set()
+    
+    def seed_task_ids(self, batch_size: int = 100):
+        """
+        Record the task id of task files imported before the watcher kept
+        state (e.g. by import_tasks.py --directory), so editing them updates
+        the task instead of creating a duplicate. A file matches the task whose
+        solution_md is its exact content (it is then unchanged), or else the
+        only task with its title.
+        """
+        
+        if self.tasks_dir is None:
+            return
+        
+        unknown = {}
+        for path in sorted(self.tasks_dir.glob('*.md')):
+            if is_source_file(path) and not self.state.get(path).get('task_id'):
+                # Read like process_task_file does, so solution_md compares equal
+                content = path.read_text(encoding='utf-8')
+                metadata, _ = self.task_parser.parse_markdown_task(content)
+                unknown[path] = (content, metadata['title'])
+        
+        titles = sorted({title for _, title in unknown.values() if title})
+        tasks_by_title: Dict[str, List[Dict]] = {}
+        for i in range(0, len(titles), batch_size):
+            result = self.task_parser.supabase.table('tasks').select('id, title, solution_md').in_(
+                'title', titles[i:i + batch_size]
+            ).execute()
+            for row in result.data:
+                tasks_by_title.setdefault(row['title'], []).append(row)
+        
+        matched = 0
+        for path, (content, title) in unknown.items():
+            tasks = tasks_by_title.get(title, [])
+            unchanged = [task for task in tasks if task['solution_md'] == content]
+            if unchanged:
+                self.state.update(path, task_id=unchanged[0]['id'], hash=file_hash(path))
+            elif len(tasks) == 1:
+                self.state.update(path, task_id=tasks[0]['id'])
+            elif tasks:
+                self.ambiguous.add(path.resolve())
+                print(f"Warning: {path} matches {len(tasks)} tasks titled '{title}', it will not be imported")
+                continue
+            else:
+                continue
+            matched += 1
+        
+        if unknown:
+            print(f"Matched {matched}/{len(unknown)} task files without recorded state to existing tasks")
+            self.state.save()
+    
+    def kind_of(self, path: Path) -> Optional[str]:
+        parent = path.resolve().parent
+        if self.tasks_dir is not None and parent == self.tasks_dir:
+            return 'task'
+        if self.concepts_dir is not None and parent == self.concepts_dir:
+            return 'concept'
+        return None
+    
+    async def collect_batch(self, changes: asyncio.Queue) -> Set[Path]:
+        """
+        Wait for a change, then keep collecting until ``debounce`` seconds pass
+        without one (or ``max_delay`` after the first), so a burst of saves
+        becomes a single batch.
+        """
+        
+        batch = {await changes.get()}
+        first = time.monotonic()
+        while True:
+            timeout = min(self.debounce, self.max_delay - (time.monotonic() - first))
+            if timeout <= 0:
+                break
+            try:
+                batch.add(await asyncio.wait_for(changes.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    def changed_files(self, paths: Set[Path]) -> List[Tuple[str, Path, str]]:
+        """Existing source files whose content differs from the last import, as (kind, path, hash)."""
+        
+        changed = []
+        for path in sorted(paths):
+            kind = self.kind_of(path)
+            if kind is None or not is_source_file(path):
+                continue
+            if not path.exists():
+                print(f"Removed: {path} (its imported data is kept)")
+                continue
+            try:
+                content_hash = file_hash(path)
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            if self.state.get(path).get('hash') == content_hash:
+                continue
+            changed.append((kind, path, content_hash))
+        return changed
+    
+    async def import_file(self, kind: str, path: Path, content_hash: str) -> Dict:
+        if kind == 'task':
+            if path.resolve() in self.ambiguous:
+                return {'status': 'skipped', 'reason': 'Matches several existing tasks'}
+            result = await self.task_parser.process_task_file(path, self.state.get(path).get('task_id'))
+            if result.get('status') == 'success':
+                self.state.update(path, hash=content_hash, task_id=result['task_id'])
+        else:
+            result = await self.concept_parser.process_concept_file(path)
+            if result.get('status') == 'success':
+                self.state.update(path, hash=content_hash, concept_id=result['concept_id'])
+        return result
+    
+    async def import_batch(self, changed: List[Tuple[str, Path, str]]):
+        """Import the changed files concurrently so their embedding requests coalesce."""
+        
+        started = time.perf_counter()
+        flushes_before = self.batcher.flushes
+        
+        # Near-duplicates are collapsed within a batch; a long-lived detector
+        # would flag a re-imported file against its own previous version
+        if self.concept_parser is not None:
+            self.concept_parser.reset_duplicate_detectors()
+        
+        with instrumentation.instrumented_run('watch_imports'):
+            results = await asyncio.gather(
+                *(self.import_file(kind, path, content_hash) for kind, path, content_hash in changed),
+                return_exceptions=True
+            )
+            
+            errors = 0
+            for (kind, path, _), result in zip(changed, results):
+                if isinstance(result, Exception):
+                    errors += 1
+                    print(f"✗ Error importing {path}: {result}")
+                elif result.get('status') == 'success':
+                    print(f"✓ Imported {kind} {path.name}")
+            
+            kinds = {kind for kind, _, _ in changed}
+            if 'task' in kinds:
+                self.task_parser.save_index()
+            if 'concept' in kinds:
+                self.concept_parser.save_index()
+            self.state.save()
+            
+            instrumentation.count('files_imported', len(changed) - errors)
+            instrumentation.count('files_failed', errors)
+            instrumentation.count('embedding_flushes', self.batcher.flushes - flushes_before)
+            if errors:
+                instrumentation.mark_failed()
+        
+        print(f"Re-imported {len(changed) - errors}/{len(changed)} files in {time.perf_counter() - started:.1f}s "
+              f"with {self.batcher.flushes - flushes_before} shared embedding batches")
+    
+    async def run(self, changes: asyncio.Queue):
+        while True:
+            paths = await self.collect_batch(changes)
+            changed = self.changed_files(paths)
+            if changed:
+                await self.import_batch(changed)
+    
+    def initial_changes(self) -> List[Path]:
+        """Source files that changed while the watcher was not running."""
+        
+        paths = []
+        for directory in (self.tasks_dir, self.concepts_dir):
+            if directory is not None:
+                paths.extend(path for path in directory.glob('*.md') if is_source_file(path))
+        return paths
+
+async def main():
+    parser = argparse.ArgumentParser(description='Re-import task and concept files as they change')
+    parser.add_argument('--tasks-dir', type=str, help='Directory of task markdown files to watch')
+    parser.add_argument('--concepts-dir', type=str, help='Directory of concept markdown files to watch')
+    parser.add_argument('--debounce', type=float, default=1.5,
+                        help='Seconds without changes before a burst is imported')
+    parser.add_argument('--max-delay', type=float, default=10.0,
+                        help='Longest wait after the first change of a burst')
+    parser.add_argument('--polling', action='store_true', help='Poll file mtimes instead of using inotify')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls')
+    parser.add_argument('--initial-scan', action='store_true',
+                        help='First import files that changed since the last recorded import')
+    parser.add_argument('--state-path', type=str, default=str(DEFAULT_STATE_PATH),
+                        help='File recording imported content hashes and task ids')
+    parser.add_argument('--task-index-path', type=str, default=str(DEFAULT_TASK_INDEX_PATH))
+    parser.add_argument('--concept-index-path', type=str, default=str(DEFAULT_CONCEPT_INDEX_PATH))
+    parser.add_argument('--dedup-threshold', type=float, default=0.85,
+                        help='Jaccard similarity above which concept chunks are collapsed (0 disables)')
+    
+    args = parser.parse_args()
+    
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY or not OPENAI_API_KEY:
+        print("Error: Missing required environment variables")
+        print("Required: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, OPENAI_API_KEY")
+        return
+    
+    if not args.tasks_dir and not args.concepts_dir:
+        parser.print_help()
+        return
+    
+    directories = [Path(d) for d in (args.tasks_dir, args.concepts_dir) if d]
+    for directory in directories:
+        if not directory.is_dir():
+            print(f"Error: Directory not found: {directory}")
+            return
+    
+    watcher = ImportWatcher(
+        Path(args.tasks_dir) if args.tasks_dir else None,
+        Path(args.concepts_dir) if args.concepts_dir else None,
+        ImportState(Path(args.state_path)),
+        TaskParser(Path(args.task_index_path)) if args.tasks_dir else None,
+        ConceptParser(Path(args.concept_index_path), args.dedup_threshold) if args.concepts_dir else None,
+        args.debounce,
+        args.max_delay
+    )
+    
+    watcher.seed_task_ids()
+    
+    loop = asyncio.get_running_loop()
+    changes: asyncio.Queue = asyncio.Queue()
+    
+    if args.initial_scan:
+        for path in watcher.initial_changes():
+            changes.put_nowait(path)
+    
+    observer = None if args.polling else start_inotify_watcher(directories, loop, changes)
+    poller = None
+    if observer is None:
+        poller = asyncio.create_task(PollingWatcher(directories, args.poll_interval).run(changes))
+        print(f"Polling {', '.join(map(str, directories))} every {args.poll_interval}s")
+    else:
+        print(f"Watching {', '.join(map(str, directories))} (inotify)")
+    
+    try:
+        await watcher.run(changes)
+    finally:
+        if poller is not None:
+            poller.cancel()
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nStopped watching")
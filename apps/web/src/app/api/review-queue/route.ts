@@ -0,0 +1,60 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { createClient } from '@/lib/supabase/server';
+
+interface ReviewQueueEntry {
+  task_id: number;
+  reason: string;
+  priority: number;
+  next_review: string;
+}
+
+// Очередь повторений пользователя (строится планировщиком spaced_repetition.py)
+export async function GET(request: NextRequest) {
+  try {
+    const supabase = createClient();
+    const { data: { user } } = await supabase.auth.getUser();
+
+    if (!user) {
+      return NextResponse.json(
+        { error: 'Unauthorized' },
+        { status: 401 }
+      );
+    }
+
+    const { data, error } = await supabase
+      .from('review_queues')
+      .select('queue, next_due, built_at')
+      .eq('user_id', user.id)
+      .maybeSingle();
+
+    if (error) {
+      console.error('Error fetching review queue:', error);
+      return NextResponse.json(
+        { error: 'Failed to fetch review queue' },
+        { status: 500 }
+      );
+    }
+
+    let queue: ReviewQueueEntry[] = data?.queue || [];
+
+    // ?due=today — только задачи, которые нужно повторить до конца дня
+    if (request.nextUrl.searchParams.get('due') === 'today') {
+      const endOfDay = new Date();
+      endOfDay.setHours(23, 59, 59, 999);
+      queue = queue.filter(entry => new Date(entry.next_review) <= endOfDay);
+    }
+
+    return NextResponse.json({
+      queue,
+      next_due: data?.next_due || null,
+      built_at: data?.built_at || null
+    });
+
+  } catch (error) {
+    console.error('Error in review queue GET:', error);
+    return NextResponse.json(
+      { error: 'Internal server error' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,248 @@
+-- Exam/subject partitioned concept chunks
+-- search_concept_chunks filters by exam/subject only after the ivfflat scan over
+-- all concept_chunks, so filtered queries either scan too much or return too few
+-- rows. Here every (exam_type, subject) pair gets its own leaf partition with its
+-- own vector index, and filtered searches are pruned to the matching partition.
+
+CREATE TABLE IF NOT EXISTS concept_chunks_partitioned (
+    chunk_id UUID DEFAULT gen_random_uuid(),
+    concept_id UUID NOT NULL REFERENCES concept_docs(id) ON DELETE CASCADE,
+    exam_type VARCHAR(50) NOT NULL DEFAULT '',
+    subject VARCHAR(100) NOT NULL DEFAULT '',
+    chunk_md TEXT NOT NULL,
+    embedding VECTOR(1536),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (exam_type, subject, chunk_id)
+) PARTITION BY LIST (exam_type);
+
+CREATE INDEX IF NOT EXISTS idx_concept_chunks_partitioned_concept ON concept_chunks_partitioned(concept_id);
+
+ALTER TABLE concept_chunks_partitioned ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Public read access to partitioned concept chunks" ON concept_chunks_partitioned
+    FOR SELECT USING (true);
+
+-- Below this many rows a partition is scanned exactly instead of through ivfflat
+CREATE OR REPLACE FUNCTION concept_partition_min_indexed_rows()
+RETURNS INT AS $$
+    SELECT 1000;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Name of the leaf partition for an (exam_type, subject) pair
+CREATE OR REPLACE FUNCTION concept_partition_name(p_exam TEXT, p_subject TEXT)
+RETURNS TEXT AS $$
+    SELECT 'concept_chunks_p_' || substr(md5(coalesce(p_exam, '')), 1, 8)
+        || '_' || substr(md5(coalesce(p_subject, '')), 1, 8);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Create the exam partition and its subject sub-partition if missing
+CREATE OR REPLACE FUNCTION ensure_concept_partition(p_exam TEXT, p_subject TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    exam_table TEXT := 'concept_chunks_p_' || substr(md5(coalesce(p_exam, '')), 1, 8);
+    leaf_table TEXT := concept_partition_name(p_exam, p_subject);
+BEGIN
+    IF to_regclass(exam_table) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF concept_chunks_partitioned FOR VALUES IN (%L) PARTITION BY LIST (subject)',
+            exam_table, coalesce(p_exam, '')
+        );
+    END IF;
+
+    IF to_regclass(leaf_table) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%L)',
+            leaf_table, exam_table, coalesce(p_subject, '')
+        );
+    END IF;
+
+    RETURN leaf_table;
+END;
+$$ LANGUAGE plpgsql;
+
+-- (Re)build the vector index of one leaf partition.
+-- ivfflat centroids are trained on existing rows, so the index is only created
+-- once a partition is large enough, with lists scaled to its size. p_force
+-- rebuilds an existing index after a bulk load.
+CREATE OR REPLACE FUNCTION maintain_concept_partition_index(
+    p_exam TEXT,
+    p_subject TEXT,
+    p_force BOOLEAN DEFAULT FALSE
+)
+RETURNS TEXT AS $$
+DECLARE
+    leaf_table TEXT := concept_partition_name(p_exam, p_subject);
+    index_name TEXT := leaf_table || '_embedding_idx';
+    row_count BIGINT;
+    lists INT;
+BEGIN
+    IF to_regclass(leaf_table) IS NULL THEN
+        RETURN 'missing';
+    END IF;
+
+    EXECUTE format('SELECT count(*) FROM %I', leaf_table) INTO row_count;
+
+    IF row_count < concept_partition_min_indexed_rows() THEN
+        EXECUTE format('DROP INDEX IF EXISTS %I', index_name);
+        RETURN 'exact';
+    END IF;
+
+    IF to_regclass(index_name) IS NOT NULL AND NOT p_force THEN
+        RETURN 'indexed';
+    END IF;
+
+    lists := greatest(1, round(sqrt(row_count)))::INT;
+    EXECUTE format('DROP INDEX IF EXISTS %I', index_name);
+    EXECUTE format(
+        'CREATE INDEX %I ON %I USING ivfflat (embedding vector_cosine_ops) WITH (lists = %s)',
+        index_name, leaf_table, lists
+    );
+
+    RETURN 'rebuilt';
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replace the chunks of a concept in its exam/subject partition
+CREATE OR REPLACE FUNCTION insert_concept_chunks_partitioned(
+    p_concept_id UUID,
+    p_chunks JSONB
+)
+RETURNS INT AS $$
+DECLARE
+    doc_exam TEXT;
+    doc_subject TEXT;
+    inserted_count INT;
+BEGIN
+    SELECT coalesce(exam_type, ''), coalesce(subject, '')
+    INTO doc_exam, doc_subject
+    FROM concept_docs
+    WHERE id = p_concept_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Concept % not found', p_concept_id;
+    END IF;
+
+    PERFORM ensure_concept_partition(doc_exam, doc_subject);
+
+    -- The concept may have moved to another exam/subject since the last import
+    DELETE FROM concept_chunks_partitioned WHERE concept_id = p_concept_id;
+
+    INSERT INTO concept_chunks_partitioned (concept_id, exam_type, subject, chunk_md, embedding)
+    SELECT p_concept_id, doc_exam, doc_subject, x.chunk_md, x.embedding
+    FROM jsonb_to_recordset(p_chunks) AS x(chunk_md TEXT, embedding VECTOR(1536));
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+
+    PERFORM maintain_concept_partition_index(doc_exam, doc_subject);
+
+    RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Copy one exam/subject slice of the legacy concept_chunks table
+CREATE OR REPLACE FUNCTION backfill_concept_partition(p_exam TEXT, p_subject TEXT)
+RETURNS INT AS $$
+DECLARE
+    inserted_count INT;
+BEGIN
+    PERFORM ensure_concept_partition(p_exam, p_subject);
+
+    DELETE FROM concept_chunks_partitioned
+    WHERE exam_type = coalesce(p_exam, '') AND subject = coalesce(p_subject, '');
+
+    INSERT INTO concept_chunks_partitioned (chunk_id, concept_id, exam_type, subject, chunk_md, embedding, created_at)
+    SELECT cc.chunk_id, cc.concept_id, coalesce(cd.exam_type, ''), coalesce(cd.subject, ''),
+           cc.chunk_md, cc.embedding, cc.created_at
+    FROM concept_chunks cc
+    JOIN concept_docs cd ON cc.concept_id = cd.id
+    WHERE coalesce(cd.exam_type, '') = coalesce(p_exam, '')
+      AND coalesce(cd.subject, '') = coalesce(p_subject, '');
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+
+    PERFORM maintain_concept_partition_index(p_exam, p_subject, TRUE);
+
+    RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partition-routed concept search.
+-- Each branch compares the partition keys with plain equality so the planner
+-- prunes to the matching exam (and subject) partition before the vector scan.
+CREATE OR REPLACE FUNCTION search_concept_chunks_partitioned(
+    query_embedding VECTOR(1536),
+    exam_filter VARCHAR DEFAULT NULL,
+    topic_filter VARCHAR DEFAULT NULL,
+    similarity_threshold FLOAT DEFAULT 0.3,
+    match_count INT DEFAULT 2
+)
+RETURNS TABLE (
+    chunk_md TEXT,
+    similarity FLOAT
+) AS $$
+BEGIN
+    IF exam_filter IS NOT NULL AND topic_filter IS NOT NULL THEN
+        RETURN QUERY
+        SELECT cp.chunk_md, (1 - (cp.embedding <=> query_embedding)) AS similarity
+        FROM concept_chunks_partitioned cp
+        WHERE cp.exam_type = exam_filter
+          AND cp.subject = topic_filter
+          AND (1 - (cp.embedding <=> query_embedding)) > similarity_threshold
+        ORDER BY cp.embedding <=> query_embedding
+        LIMIT match_count;
+    ELSIF exam_filter IS NOT NULL THEN
+        RETURN QUERY
+        SELECT cp.chunk_md, (1 - (cp.embedding <=> query_embedding)) AS similarity
+        FROM concept_chunks_partitioned cp
+        WHERE cp.exam_type = exam_filter
+          AND (1 - (cp.embedding <=> query_embedding)) > similarity_threshold
+        ORDER BY cp.embedding <=> query_embedding
+        LIMIT match_count;
+    ELSIF topic_filter IS NOT NULL THEN
+        RETURN QUERY
+        SELECT cp.chunk_md, (1 - (cp.embedding <=> query_embedding)) AS similarity
+        FROM concept_chunks_partitioned cp
+        WHERE cp.subject = topic_filter
+          AND (1 - (cp.embedding <=> query_embedding)) > similarity_threshold
+        ORDER BY cp.embedding <=> query_embedding
+        LIMIT match_count;
+    ELSE
+        RETURN QUERY
+        SELECT cp.chunk_md, (1 - (cp.embedding <=> query_embedding)) AS similarity
+        FROM concept_chunks_partitioned cp
+        WHERE (1 - (cp.embedding <=> query_embedding)) > similarity_threshold
+        ORDER BY cp.embedding <=> query_embedding
+        LIMIT match_count;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Exact (index-free) search used by the partition benchmark as ground truth
+CREATE OR REPLACE FUNCTION search_concept_chunks_exact(
+    query_embedding VECTOR(1536),
+    exam_filter VARCHAR DEFAULT NULL,
+    topic_filter VARCHAR DEFAULT NULL,
+    match_count INT DEFAULT 2
+)
+RETURNS TABLE (
+    chunk_md TEXT,
+    similarity FLOAT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT cc.chunk_md, (1 - (cc.embedding <=> query_embedding)) AS similarity
+    FROM concept_chunks cc
+    JOIN concept_docs cd ON cc.concept_id = cd.id
+    WHERE (exam_filter IS NULL OR cd.exam_type = exam_filter)
+      AND (topic_filter IS NULL OR cd.subject = topic_filter)
+    ORDER BY cc.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$ LANGUAGE plpgsql SET enable_indexscan = off;
+
+GRANT EXECUTE ON FUNCTION search_concept_chunks_partitioned TO authenticated, anon;
+GRANT EXECUTE ON FUNCTION insert_concept_chunks_partitioned TO service_role;
+GRANT EXECUTE ON FUNCTION backfill_concept_partition TO service_role;
+GRANT EXECUTE ON FUNCTION maintain_concept_partition_index TO service_role;
+GRANT EXECUTE ON FUNCTION search_concept_chunks_exact TO service_role;
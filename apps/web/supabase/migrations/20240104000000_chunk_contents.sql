@@ -0,0 +1,148 @@
+-- Content-addressed task chunk storage
+-- Many tasks share identical solution steps, so chunk text and its embedding
+-- are stored once in chunk_contents, keyed by the SHA-256 of the chunk text,
+-- and task_chunks only references them. Importers embed a chunk only when its
+-- hash is not in chunk_contents yet.
+
+CREATE TABLE IF NOT EXISTS chunk_contents (
+    content_hash CHAR(64) PRIMARY KEY, -- hex SHA-256 of chunk_md (UTF-8)
+    chunk_md TEXT NOT NULL,
+    embedding VECTOR(1536),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE task_chunks ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES chunk_contents(content_hash);
+ALTER TABLE task_chunks ALTER COLUMN chunk_md DROP NOT NULL;
+
+-- Move existing chunks into the shared store, keeping one embedding per text
+INSERT INTO chunk_contents (content_hash, chunk_md, embedding)
+SELECT DISTINCT ON (hash) hash, chunk_md, embedding
+FROM (
+    SELECT encode(sha256(convert_to(chunk_md, 'UTF8')), 'hex') AS hash, chunk_md, embedding, created_at
+    FROM task_chunks
+    WHERE chunk_md IS NOT NULL
+) existing
+ORDER BY hash, (embedding IS NULL), created_at
+ON CONFLICT (content_hash) DO NOTHING;
+
+UPDATE task_chunks
+SET content_hash = encode(sha256(convert_to(chunk_md, 'UTF8')), 'hex'),
+    chunk_md = NULL,
+    embedding = NULL
+WHERE content_hash IS NULL AND chunk_md IS NOT NULL;
+
+-- The vector index now lives on the deduplicated store
+DROP INDEX IF EXISTS idx_task_chunks_embedding;
+CREATE INDEX IF NOT EXISTS idx_chunk_contents_embedding ON chunk_contents USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+CREATE INDEX IF NOT EXISTS idx_task_chunks_content_hash ON task_chunks(content_hash);
+
+ALTER TABLE chunk_contents ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can read chunk contents" ON chunk_contents
+    FOR SELECT USING (
+        EXISTS (
+            SELECT 1 FROM task_chunks
+            JOIN tasks ON tasks.id = task_chunks.task_id
+            WHERE task_chunks.content_hash = chunk_contents.content_hash
+            AND tasks.is_public = true
+        )
+    );
+
+-- Search task chunks through the shared store
+CREATE OR REPLACE FUNCTION search_task_chunks(
+    task_id_param UUID,
+    query_embedding VECTOR(1536),
+    similarity_threshold FLOAT DEFAULT 0.3,
+    match_count INT DEFAULT 4
+)
+RETURNS TABLE (
+    chunk_md TEXT,
+    step_idx INTEGER,
+    similarity FLOAT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        cc.chunk_md,
+        tc.step_idx,
+        (1 - (cc.embedding <=> query_embedding)) AS similarity
+    FROM task_chunks tc
+    JOIN chunk_contents cc ON cc.content_hash = tc.content_hash
+    WHERE
+        tc.task_id = task_id_param
+        AND (1 - (cc.embedding <=> query_embedding)) > similarity_threshold
+    ORDER BY cc.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Return the hashes from p_hashes that still need an embedding
+CREATE OR REPLACE FUNCTION missing_chunk_contents(p_hashes TEXT[])
+RETURNS TABLE (content_hash TEXT) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT h.hash
+    FROM unnest(p_hashes) AS h(hash)
+    LEFT JOIN chunk_contents cc ON cc.content_hash = h.hash
+    WHERE cc.content_hash IS NULL OR cc.embedding IS NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Store newly embedded chunk contents; existing hashes are left untouched
+CREATE OR REPLACE FUNCTION upsert_chunk_contents(p_contents JSONB)
+RETURNS INT AS $$
+DECLARE
+    inserted_count INT;
+BEGIN
+    INSERT INTO chunk_contents (content_hash, chunk_md, embedding)
+    SELECT x.content_hash, x.chunk_md, x.embedding
+    FROM jsonb_to_recordset(p_contents) AS x(
+        content_hash TEXT,
+        chunk_md TEXT,
+        embedding VECTOR(1536)
+    )
+    ON CONFLICT (content_hash) DO UPDATE
+        SET embedding = EXCLUDED.embedding
+        WHERE chunk_contents.embedding IS NULL;
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+    RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replace the chunks of a task with references into chunk_contents.
+-- Chunks may carry content_hash only (contents already stored) or chunk_md
+-- with an inline embedding, which is added to the shared store first.
+CREATE OR REPLACE FUNCTION insert_task_chunks(
+    p_task_id UUID,
+    p_chunks JSONB
+)
+RETURNS INT AS $$
+DECLARE
+    inserted_count INT;
+BEGIN
+    -- Delete existing chunks for this task
+    DELETE FROM task_chunks WHERE task_id = p_task_id;
+
+    INSERT INTO chunk_contents (content_hash, chunk_md, embedding)
+    SELECT DISTINCT ON (hash) hash, chunk_md, embedding
+    FROM (
+        SELECT coalesce(x.content_hash, encode(sha256(convert_to(x.chunk_md, 'UTF8')), 'hex')) AS hash,
+               x.chunk_md, x.embedding
+        FROM jsonb_to_recordset(p_chunks) AS x(content_hash TEXT, chunk_md TEXT, embedding VECTOR(1536))
+        WHERE x.chunk_md IS NOT NULL AND x.embedding IS NOT NULL
+    ) inline_contents
+    ON CONFLICT (content_hash) DO NOTHING;
+
+    INSERT INTO task_chunks (task_id, step_idx, content_hash)
+    SELECT p_task_id, x.step_idx,
+           coalesce(x.content_hash, encode(sha256(convert_to(x.chunk_md, 'UTF8')), 'hex'))
+    FROM jsonb_to_recordset(p_chunks) AS x(step_idx INT, content_hash TEXT, chunk_md TEXT);
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+    RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION missing_chunk_contents TO service_role;
+GRANT EXECUTE ON FUNCTION upsert_chunk_contents TO service_role;
@@ -0,0 +1,79 @@
+-- Bulk concept synchronization
+-- import_concepts.py --sync upserts concept_docs by tag in batches and
+-- replaces the chunks of many concepts per call instead of issuing an
+-- existence check, an insert/update and two chunk RPCs for every file.
+
+-- Tags identify concept files, so they must be unique for upserts.
+-- Keep the most recently updated row of any duplicated tag.
+DELETE FROM concept_docs cd
+USING concept_docs newer
+WHERE cd.tag = newer.tag
+  AND (newer.updated_at, newer.id) > (cd.updated_at, cd.id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'concept_docs_tag_key'
+    ) THEN
+        ALTER TABLE concept_docs ADD CONSTRAINT concept_docs_tag_key UNIQUE (tag);
+    END IF;
+END;
+$$;
+
+-- Replace the chunks of every concept in p_chunks, in both concept_chunks and
+-- the exam/subject partitions. p_chunks is a flat array of
+-- {concept_id, chunk_md, embedding}; concepts listed without chunks keep none.
+CREATE OR REPLACE FUNCTION insert_concept_chunks_bulk(p_chunks JSONB)
+RETURNS INT AS $$
+DECLARE
+    concept_ids UUID[];
+    slice RECORD;
+    inserted_count INT;
+BEGIN
+    SELECT array_agg(DISTINCT x.concept_id)
+    INTO concept_ids
+    FROM jsonb_to_recordset(p_chunks) AS x(concept_id UUID);
+
+    IF concept_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM concept_chunks WHERE concept_id = ANY(concept_ids);
+
+    INSERT INTO concept_chunks (concept_id, chunk_md, embedding)
+    SELECT x.concept_id, x.chunk_md, x.embedding
+    FROM jsonb_to_recordset(p_chunks) AS x(concept_id UUID, chunk_md TEXT, embedding VECTOR(1536))
+    WHERE x.chunk_md IS NOT NULL;
+
+    GET DIAGNOSTICS inserted_count = ROW_COUNT;
+
+    -- Concepts may have moved to another exam/subject since the last import
+    DELETE FROM concept_chunks_partitioned WHERE concept_id = ANY(concept_ids);
+
+    FOR slice IN
+        SELECT DISTINCT coalesce(exam_type, '') AS exam_type, coalesce(subject, '') AS subject
+        FROM concept_docs
+        WHERE id = ANY(concept_ids)
+    LOOP
+        PERFORM ensure_concept_partition(slice.exam_type, slice.subject);
+    END LOOP;
+
+    INSERT INTO concept_chunks_partitioned (concept_id, exam_type, subject, chunk_md, embedding)
+    SELECT x.concept_id, coalesce(cd.exam_type, ''), coalesce(cd.subject, ''), x.chunk_md, x.embedding
+    FROM jsonb_to_recordset(p_chunks) AS x(concept_id UUID, chunk_md TEXT, embedding VECTOR(1536))
+    JOIN concept_docs cd ON cd.id = x.concept_id
+    WHERE x.chunk_md IS NOT NULL;
+
+    FOR slice IN
+        SELECT DISTINCT coalesce(exam_type, '') AS exam_type, coalesce(subject, '') AS subject
+        FROM concept_docs
+        WHERE id = ANY(concept_ids)
+    LOOP
+        PERFORM maintain_concept_partition_index(slice.exam_type, slice.subject);
+    END LOOP;
+
+    RETURN inserted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION insert_concept_chunks_bulk TO service_role;
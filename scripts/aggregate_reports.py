@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Weekly report aggregation.
+Streams one week of attempts joined to tasks in a single query, ordered by
+user, and folds them into lesson_reports rows (tasks_solved, accuracy,
+topics_covered, weak_topics) one user at a time, so memory stays bounded by
+the largest user rather than the week. Rows are bulk-inserted with
+pdf_url NULL, ready for generate_pdf.py.
+Usage: python aggregate_reports.py --week-start 2024-07-15
+"""
+
+import os
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta, timezone
+from dotenv import load_dotenv
+import db
+import instrumentation
+import sys
+
+# Load environment variables
+load_dotenv()
+
+REPORT_INSERT_COLUMNS = (
+    "user_id", "week_start", "week_end", "tasks_solved",
+    "accuracy", "topics_covered", "weak_topics"
+)
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    
+    parser = argparse.ArgumentParser(description="Aggregate a week of attempts into lesson_reports")
+    parser.add_argument(
+        "--week-start",
+        type=date.fromisoformat,
+        default=None,
+        help="Monday of the week to report (default: the last completed week, UTC)"
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Replace the week's existing reports instead of only adding reports for users without one"
+    )
+    parser.add_argument(
+        "--weak-accuracy",
+        type=float,
+        default=0.6,
+        help="Topics answered correctly less often than this are weak"
+    )
+    parser.add_argument(
+        "--weak-min-attempts",
+        type=int,
+        default=2,
+        help="Attempts a topic needs in the week before it can be weak"
+    )
+    parser.add_argument("--max-weak-topics", type=int, default=5, help="Weak topics listed per report")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Reports inserted per statement")
+    parser.add_argument("--itersize", type=int, default=10000, help="Rows fetched per round-trip")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Aggregate and report counts without writing lesson_reports"
+    )
+    instrumentation.add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main function for weekly report aggregation."""
+    
+    args = parse_args(argv)
+    with instrumentation.instrumented_run("aggregate_reports", args.profile):
+        run(args)
+
+def run(args):
+    """Aggregate the week selected by ``args`` into lesson_reports."""
+    
+    if not os.getenv("SUPABASE_DB_URL"):
+        print("Error: SUPABASE_DB_URL must be set")
+        sys.exit(1)
+    
+    week_start = args.week_start or last_completed_week()
+    if week_start.weekday() != 0:
+        print(f"Warning: {week_start} is not a Monday")
+    week_end = week_start + timedelta(days=6)
+    
+    try:
+        conn = db.connect()
+        cur = conn.cursor()
+        
+        if args.replace:
+            cur.execute("DELETE FROM lesson_reports WHERE week_start = %s", (week_start,))
+            print(f"Removed {cur.rowcount} existing reports for {week_start}")
+        
+        inserted = aggregate_week(conn, cur, week_start, week_end, args)
+        
+        if args.dry_run:
+            conn.rollback()
+            print(f"Dry run: would insert {inserted} reports for {week_start} - {week_end}")
+            return
+        
+        conn.commit()
+        print(f"\nInserted {inserted} reports for {week_start} - {week_end}")
+        
+    except Exception as e:
+        print(f"Error during report aggregation: {e}")
+        instrumentation.mark_failed()
+        if 'conn' in locals():
+            conn.rollback()
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db.release(conn)
+        db.print_statement_summary()
+
+def last_completed_week(today=None):
+    """Monday of the last full Monday-Sunday week before ``today`` (UTC)."""
+    
+    today = today or datetime.now(timezone.utc).date()
+    return today - timedelta(days=today.weekday() + 7)
+
+def stream_topic_totals(conn, week_start, itersize):
+    """
+    Yield ``(user_id, topic, attempts, correct, tasks_solved)`` for the week,
+    ordered by user. Users who already have a report for the week are left
+    out, so a re-run only adds missing reports.
+    
+    Every task has one topic, so distinct correctly solved tasks per
+    (user, topic) add up to the user's distinct solved tasks.
+    """
+    
+    week_from = datetime.combine(week_start, datetime.min.time(), tzinfo=timezone.utc)
+    yield from db.stream(conn, """
+        SELECT a.user_id, t.topic,
+               COUNT(*) AS attempts_count,
+               COUNT(*) FILTER (WHERE a.is_correct) AS correct_count,
+               COUNT(DISTINCT a.task_id) FILTER (WHERE a.is_correct) AS solved_count
+        FROM attempts a
+        JOIN tasks t ON t.id = a.task_id
+        WHERE a.ts >= %s AND a.ts < %s
+          AND a.user_id IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM lesson_reports lr
+              WHERE lr.user_id = a.user_id AND lr.week_start = %s
+          )
+        GROUP BY a.user_id, t.topic
+        ORDER BY a.user_id, t.topic
+    """, (week_from, week_from + timedelta(days=7), week_start), itersize=itersize, name="weekly_attempts")
+
+def build_report(user_id, topics, week_start, week_end, weak_accuracy, weak_min_attempts, max_weak_topics):
+    """
+    lesson_reports row for one user from their ``(topic, attempts, correct,
+    solved)`` totals. topics_covered lists topics by attempts, weak_topics the
+    least accurate topics below ``weak_accuracy``.
+    """
+    
+    attempts = sum(topic[1] for topic in topics)
+    correct = sum(topic[2] for topic in topics)
+    tasks_solved = sum(topic[3] for topic in topics)
+    
+    topics_covered = [topic[0] for topic in sorted(topics, key=lambda topic: (-topic[1], topic[0]))]
+    weak = [
+        (topic[2] / topic[1], topic[0])
+        for topic in topics
+        if topic[1] >= weak_min_attempts and topic[2] / topic[1] < weak_accuracy
+    ]
+    weak_topics = [name for _, name in sorted(weak)[:max_weak_topics]]
+    
+    return (
+        user_id,
+        week_start,
+        week_end,
+        tasks_solved,
+        correct / attempts if attempts else 0.0,
+        json.dumps(topics_covered, ensure_ascii=False),
+        json.dumps(weak_topics, ensure_ascii=False)
+    )
+
+def aggregate_week(conn, cur, week_start, week_end, args):
+    """
+    Fold the streamed topic totals into one report per user and insert them
+    ``args.batch_size`` at a time. Returns the number of reports built.
+    """
+    
+    started = time.perf_counter()
+    insert_seconds = 0.0
+    pending = []
+    built = 0
+    attempts_count = 0
+    
+    def flush():
+        nonlocal insert_seconds
+        if not args.dry_run:
+            insert_started = time.perf_counter()
+            db.bulk_insert(cur, "lesson_reports", REPORT_INSERT_COLUMNS, pending, page_size=args.batch_size)
+            insert_seconds += time.perf_counter() - insert_started
+        pending.clear()
+    
+    def finish_user(user_id, topics):
+        nonlocal built
+        pending.append(build_report(
+            user_id, topics, week_start, week_end,
+            args.weak_accuracy, args.weak_min_attempts, args.max_weak_topics
+        ))
+        built += 1
+        if len(pending) >= args.batch_size:
+            flush()
+    
+    current_user = None
+    topics = []
+    for user_id, topic, attempts, correct, solved in stream_topic_totals(conn, week_start, args.itersize):
+        if user_id != current_user:
+            if topics:
+                finish_user(current_user, topics)
+            current_user = user_id
+            topics = []
+        topics.append((topic, attempts, correct, solved))
+        attempts_count += attempts
+    
+    if topics:
+        finish_user(current_user, topics)
+    if pending:
+        flush()
+    
+    instrumentation.record_stage("aggregate", time.perf_counter() - started - insert_seconds)
+    instrumentation.record_stage("insert", insert_seconds)
+    instrumentation.count("attempts_aggregated", attempts_count)
+    instrumentation.count("reports_built", built)
+    return built
+
+if __name__ == "__main__":
+    main()
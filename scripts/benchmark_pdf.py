@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for weekly report rendering.
+Compares the per-document setup of the original script (template, stylesheet
+and fonts rebuilt for every report), a long-lived ReportRenderer and the
+ReportLab direct engine side by side, in ms per PDF and peak RSS for 1, 100
+and 1000 synthetic reports. Every case runs in a fresh process so peak RSS
+is not inherited from earlier cases.
+Usage: python benchmark_pdf.py --counts 1,100,1000 --modes per-document,renderer,direct
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import sys
+import time
+from datetime import date, timedelta
+
+from jinja2 import Template
+from weasyprint import HTML, CSS
+
+from generate_pdf import REPORT_TEMPLATE, ReportRenderer, get_pdf_styles, report_context
+
+TOPICS = [
+    "Квадратные уравнения", "Тригонометрия", "Логарифмы", "Производная",
+    "Планиметрия", "Стереометрия", "Вероятность", "Неравенства"
+]
+
+def synthetic_reports(count, seed=7):
+    """lesson_reports-shaped tuples with a realistic mix of active and idle weeks."""
+
+    rng = random.Random(seed)
+    reports = []
+    for index in range(count):
+        week_start = date(2024, 9, 2) + timedelta(weeks=index % 30)
+        active = rng.random() < 0.6
+        topics = rng.sample(TOPICS, rng.randint(1, 5)) if active else []
+        weak = rng.sample(topics, min(len(topics), rng.randint(0, 2)))
+        reports.append((
+            index + 1,
+            f"00000000-0000-4000-8000-{index:012d}",
+            week_start,
+            week_start + timedelta(days=6),
+            rng.randint(5, 60) if active else 0,
+            rng.uniform(0.4, 0.95) if active else 0.0,
+            json.dumps(topics, ensure_ascii=False),
+            json.dumps(weak, ensure_ascii=False)
+        ))
+    return reports
+
+def render_per_document(report_data):
+    """The original path: everything is rebuilt for each report."""
+
+    html = HTML(string=Template(REPORT_TEMPLATE).render(**report_context(report_data)))
+    return html.write_pdf(stylesheets=[CSS(string=get_pdf_styles())])
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_case(mode, count):
+    """Render ``count`` reports in this process; returns timing and memory stats."""
+
+    reports = synthetic_reports(count)
+
+    started = time.perf_counter()
+    if mode == "renderer":
+        render = ReportRenderer().render_pdf
+    elif mode == "direct":
+        from report_direct import DirectReportRenderer
+        render = DirectReportRenderer(report_context).render_pdf
+    else:
+        render = render_per_document
+
+    total_bytes = 0
+    for report in reports:
+        total_bytes += len(render(report))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "reports": count,
+        "ms_per_pdf": elapsed * 1000 / count,
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "avg_pdf_kb": total_bytes / count / 1024
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark weekly report rendering")
+    parser.add_argument("--counts", type=str, default="1,100,1000", help="Comma-separated report counts")
+    parser.add_argument("--modes", type=str, default="per-document,renderer,direct")
+    parser.add_argument("--output", type=str, help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    counts = [int(count) for count in args.counts.split(",") if count.strip()]
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for count in counts:
+        for mode in modes:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (mode, count))
+            results.append(result)
+            print(f"{mode:<14} {count:>5} reports: {result['ms_per_pdf']:>8.1f} ms/PDF, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    print(f"\n{'reports':>7} {'mode':<14} {'ms/PDF':>8} {'peak MB':>8}")
+    for result in results:
+        print(f"{result['reports']:>7} {result['mode']:<14} {result['ms_per_pdf']:>8.1f} {result['peak_rss_mb']:>8.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
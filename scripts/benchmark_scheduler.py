@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Scheduler benchmark harness.
+Generates synthetic load at several scales with generate_load.py and times
+the weak-topic fold and schedule_reviews_bulk end to end and per phase, with
+and without writes. Every run is appended as a JSON line tagged with the git
+commit, so results can be compared across commits with --compare.
+
+Runs against LOADTEST_DB_URL (or --db-url) and resets its tables per scale.
+Usage: python benchmark_scheduler.py --scales 1000,10000,100000 --repeat 3
+"""
+
+import os
+import json
+import argparse
+import statistics
+import subprocess
+import time
+import psycopg2
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import sys
+
+from generate_load import create_schema, reset_tables, generate_load
+from spaced_repetition import schedule_reviews, schedule_reviews_bulk
+from srs_engine import update_repetitions
+from weak_topics import update_weak_topics
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "scheduler.jsonl")
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Benchmark the spaced repetition scheduler")
+    parser.add_argument("--db-url", type=str, default=os.getenv("LOADTEST_DB_URL"),
+                        help="Benchmark database (defaults to LOADTEST_DB_URL)")
+    parser.add_argument("--scales", type=str, default="1000,10000,100000", help="Comma-separated user counts")
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--attempts-per-user", type=float, default=60)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scale and mode")
+    parser.add_argument("--per-user-max", type=int, default=2000,
+                        help="Also time the legacy per-user mode up to this many users")
+    parser.add_argument("--output", type=str, default=DEFAULT_OUTPUT, help="JSONL file results are appended to")
+    parser.add_argument("--compare", action="store_true", help="Print stored results per commit and exit")
+    return parser.parse_args()
+
+def main():
+    """Main function for the scheduler benchmark."""
+
+    args = parse_args()
+
+    if args.compare:
+        compare_results(args.output)
+        return
+
+    if not args.db_url:
+        print("Error: LOADTEST_DB_URL or --db-url must be set")
+        sys.exit(1)
+
+    commit = git_commit()
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    results = []
+
+    conn = psycopg2.connect(args.db_url)
+    try:
+        cur = conn.cursor()
+        for users in scales:
+            results.extend(benchmark_scale(conn, cur, users, args, commit))
+        cur.close()
+    finally:
+        conn.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    print_summary(results)
+    print(f"\nAppended {len(results)} results to {args.output}")
+
+def git_commit():
+    """Short hash of HEAD, with a -dirty suffix for uncommitted changes."""
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def benchmark_scale(conn, cur, users, args, commit):
+    """Generate one scale and time every mode ``args.repeat`` times."""
+
+    print(f"\n=== {users} users ===")
+    create_schema(cur)
+    reset_tables(cur)
+    load = generate_load(cur, users, args.tasks, args.topics, args.attempts_per_user)
+    # Committed first: the fold and the replay only see attempts of finished transactions
+    conn.commit()
+    print(f"Generated {load['attempts']} attempts in {load['seconds']:.1f}s")
+
+    # The counters and repetition states the scheduler reads are part of the fixture;
+    # timed runs below never commit
+    folded, _ = update_weak_topics(cur, rebuild=True)
+    pairs = update_repetitions(conn, cur, rebuild=True)
+    conn.commit()
+    if not folded or not pairs:
+        raise RuntimeError(f"Fixture for {users} users is empty: {folded} attempts folded, {pairs} repetition pairs")
+
+    base = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "users": users,
+        "tasks": load["tasks"],
+        "attempts": load["attempts"]
+    }
+    results = []
+
+    modes = ["weak_topic_fold", "bulk-dry-run", "bulk"]
+    if users <= args.per_user_max:
+        modes.append("per-user")
+
+    for mode in modes:
+        for run in range(args.repeat):
+            timings = {}
+            started = time.perf_counter()
+            if mode == "weak_topic_fold":
+                update_weak_topics(cur, rebuild=True)
+                reviews = None
+            elif mode == "per-user":
+                schedule_reviews(cur)
+                reviews = None
+            else:
+                reviews = len(schedule_reviews_bulk(cur, dry_run=mode == "bulk-dry-run", timings=timings))
+            seconds = time.perf_counter() - started
+
+            if mode == "bulk-dry-run" and not reviews:
+                conn.rollback()
+                raise RuntimeError(f"Bulk dry run for {users} users scheduled no reviews")
+
+            # Every run starts from the same state
+            conn.rollback()
+            results.append({
+                **base,
+                "mode": mode,
+                "run": run,
+                "seconds": seconds,
+                "phases": timings,
+                "reviews": reviews
+            })
+
+    return results
+
+def print_summary(results):
+    """Median seconds per scale and mode, with per-phase medians for bulk runs."""
+
+    groups = {}
+    for result in results:
+        groups.setdefault((result["users"], result["mode"]), []).append(result)
+
+    print(f"\n{'users':>8} {'mode':<16} {'median s':>9}  phases (median s)")
+    for (users, mode), runs in sorted(groups.items()):
+        median = statistics.median(run["seconds"] for run in runs)
+        phase_names = sorted({name for run in runs for name in run.get("phases") or {}})
+        phases = ", ".join(
+            f"{name}={statistics.median(run['phases'].get(name, 0.0) for run in runs):.2f}"
+            for name in phase_names
+        )
+        print(f"{users:>8} {mode:<16} {median:>9.2f}  {phases}")
+
+def compare_results(path):
+    """Print median seconds per commit for every stored scale and mode."""
+
+    if not os.path.exists(path):
+        print(f"No results at {path}")
+        return
+
+    groups = {}
+    commits = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result["commit"] not in commits:
+                commits.append(result["commit"])
+            groups.setdefault((result["users"], result["mode"], result["commit"]), []).append(result["seconds"])
+
+    keys = sorted({(users, mode) for users, mode, _ in groups})
+    print(f"{'users':>8} {'mode':<16} " + " ".join(f"{commit:>14}" for commit in commits))
+    for users, mode in keys:
+        cells = []
+        for commit in commits:
+            seconds = groups.get((users, mode, commit))
+            cells.append(f"{statistics.median(seconds):>14.2f}" if seconds else f"{'-':>14}")
+        print(f"{users:>8} {mode:<16} " + " ".join(cells))
+
+if __name__ == "__main__":
+    main()
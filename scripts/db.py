@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Shared database access for the Python jobs.
+One connection pool per process, server-side streaming cursors, bulk
+INSERT/COPY helpers, statement timing hooks and retries on transient errors,
+so every job behaves the same way against Supabase's pooler.
+
+Settings: SUPABASE_DB_URL, DB_POOL_SIZE (default 5), DB_SLOW_QUERY_MS (log
+statements slower than this) and DB_STATEMENT_STATS=1 (per-statement summary).
+"""
+
+import os
+import io
+import random
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+# Errors worth retrying: dropped/refused connections, pooler restarts,
+# serialization failures and deadlocks
+TRANSIENT_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    psycopg2.errors.SerializationFailure,
+    psycopg2.errors.DeadlockDetected
+)
+
+_pool = None
+_pool_pid = None
+# Pools inherited through fork: kept referenced, never closed, because
+# finalizing their connections would terminate the parent's sessions
+_inherited_pools = []
+_statement_hooks = []
+_statement_stats = {}
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor reporting every statement's duration to the registered hooks."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _notify(query, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _notify(query, time.perf_counter() - started, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _notify(sql, time.perf_counter() - started, self.rowcount)
+
+def add_statement_hook(hook):
+    """Call ``hook(query, seconds, rowcount)`` after every statement."""
+
+    _statement_hooks.append(hook)
+
+def _statement_label(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return " ".join(str(query).split())[:80]
+
+def _notify(query, seconds, rowcount):
+    for hook in _statement_hooks:
+        hook(query, seconds, rowcount)
+
+def _log_slow(threshold_ms):
+    def hook(query, seconds, rowcount):
+        if seconds * 1000 >= threshold_ms:
+            print(f"[db] {seconds * 1000:.0f} ms ({rowcount} rows): {_statement_label(query)}")
+    return hook
+
+def _collect_stats(query, seconds, rowcount):
+    label = _statement_label(query)
+    count, total = _statement_stats.get(label, (0, 0.0))
+    _statement_stats[label] = (count + 1, total + seconds)
+
+def print_statement_summary(limit=15):
+    """Print the statements with the most total time (needs DB_STATEMENT_STATS=1)."""
+
+    if not _statement_stats:
+        return
+    print(f"\n{'calls':>7} {'total s':>8} {'mean ms':>8}  statement")
+    ranked = sorted(_statement_stats.items(), key=lambda item: item[1][1], reverse=True)
+    for label, (count, total) in ranked[:limit]:
+        print(f"{count:>7} {total:>8.2f} {total * 1000 / count:>8.1f}  {label}")
+
+if os.getenv("DB_SLOW_QUERY_MS"):
+    add_statement_hook(_log_slow(float(os.getenv("DB_SLOW_QUERY_MS"))))
+if os.getenv("DB_STATEMENT_STATS") == "1":
+    add_statement_hook(_collect_stats)
+
+def retry(func, attempts=3, base_delay=0.5):
+    """
+    Call ``func()``, retrying transient errors with exponential backoff and
+    jitter. ``func`` must be safe to repeat, e.g. a whole transaction.
+    """
+
+    for attempt in range(attempts):
+        try:
+            return func()
+        except TRANSIENT_ERRORS as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            print(f"[db] transient error ({e.__class__.__name__}: {str(e).strip()}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def get_pool(maxconn=None, dsn=None):
+    """
+    This process's connection pool, created on first use. Forked or spawned
+    workers get their own pool instead of sharing the parent's sockets.
+    """
+
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid != os.getpid():
+        _inherited_pools.append(_pool)
+        _pool = None
+    if _pool is None:
+        dsn = dsn or os.getenv("SUPABASE_DB_URL")
+        if not dsn:
+            raise RuntimeError("SUPABASE_DB_URL must be set")
+        _pool = retry(lambda: ThreadedConnectionPool(
+            1,
+            maxconn or int(os.getenv("DB_POOL_SIZE", "5")),
+            dsn,
+            cursor_factory=TimedCursor,
+            keepalives=1,
+            keepalives_idle=30
+        ))
+        _pool_pid = os.getpid()
+    return _pool
+
+def close_pool():
+    """Close every connection of this process's pool."""
+
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
+    _pool = None
+
+def connect():
+    """Take a connection from this process's pool; hand it back with release()."""
+
+    return retry(get_pool().getconn)
+
+def release(conn):
+    """Return ``conn`` to the pool, discarding it if it was closed or broke."""
+
+    if not conn.closed:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+    get_pool().putconn(conn, close=bool(conn.closed))
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection. Uncommitted work is rolled back when the
+    block exits and broken connections are discarded instead of being
+    returned to the pool.
+    """
+
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+async def create_async_pool(max_size=None, dsn=None, attempts=3, base_delay=0.5):
+    """
+    asyncpg pool for the async jobs. The statement cache is off because
+    Supabase's transaction pooler does not keep prepared statements between
+    transactions. Connecting is retried like retry().
+    """
+
+    # asyncpg is only needed by the async jobs
+    import asyncio
+    import asyncpg
+
+    dsn = dsn or os.getenv("SUPABASE_DB_URL")
+    if not dsn:
+        raise RuntimeError("SUPABASE_DB_URL must be set")
+
+    for attempt in range(attempts):
+        try:
+            return await asyncpg.create_pool(
+                dsn,
+                min_size=1,
+                max_size=max_size or int(os.getenv("DB_POOL_SIZE", "5")),
+                statement_cache_size=0
+            )
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            print(f"[db] transient error ({e.__class__.__name__}: {str(e).strip()}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def transaction(func, attempts=3):
+    """Run ``func(cur)`` in its own committed transaction, retried as a whole."""
+
+    def attempt():
+        with connection() as conn:
+            with conn.cursor() as cur:
+                result = func(cur)
+            conn.commit()
+            return result
+
+    return retry(attempt, attempts)
+
+def stream(conn, query, params=None, itersize=10000, name="stream"):
+    """
+    Yield rows of ``query`` through a server-side cursor, ``itersize`` rows
+    per round-trip, without materializing the result. The cursor lives in
+    the current transaction, so do not commit ``conn`` while iterating.
+    """
+
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+
+def bulk_insert(cur, table, columns, rows, on_conflict="", page_size=1000, returning=None):
+    """
+    Insert ``rows`` with multi-row VALUES statements. ``on_conflict`` is an
+    optional ON CONFLICT clause; with ``returning`` the returned rows are
+    fetched and returned, otherwise the affected row count.
+    """
+
+    rows = list(rows)
+    if not rows:
+        return [] if returning else 0
+
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {on_conflict}"
+    if returning:
+        return execute_values(cur, f"{query} RETURNING {returning}", rows, page_size=page_size, fetch=True)
+
+    execute_values(cur, query, rows, page_size=page_size)
+    return cur.rowcount
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def copy_rows(cur, table, columns, rows, batch_size=100000):
+    """Stream ``rows`` into ``table`` with COPY in batches. Returns the row count."""
+
+    total = 0
+    pending = 0
+    buffer = io.StringIO()
+
+    def flush():
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row))
+        buffer.write("\n")
+        pending += 1
+        if pending >= batch_size:
+            flush()
+            total += pending
+            pending = 0
+
+    if pending:
+        flush()
+        total += pending
+
+    return total
+
+def lock_xid_watermark(cur, job_name):
+    """
+    Lock ``job_name``'s scheduler_state row for the current transaction and
+    return ``(after, until)``: rows with ``after <= attempts.inserted_xid < until``
+    are the ones committed since the job last saved its mark. ``after`` is
+    None when the job has no mark yet. Both are xid8 values as text; pass
+    them back as ``%s::xid8``.
+
+    ``until`` is the oldest transaction still running, so every row below it
+    is committed and visible, however late it committed or old its ts.
+    """
+
+    cur.execute("""
+        INSERT INTO scheduler_state (job_name) VALUES (%s)
+        ON CONFLICT (job_name) DO NOTHING
+    """, (job_name,))
+    cur.execute("""
+        SELECT high_water_xid::text, pg_snapshot_xmin(pg_current_snapshot())::text
+        FROM scheduler_state
+        WHERE job_name = %s
+        FOR UPDATE
+    """, (job_name,))
+    return cur.fetchone()
+
+def save_xid_watermark(cur, job_name, until):
+    """Store ``until`` from lock_xid_watermark() as ``job_name``'s new mark."""
+
+    cur.execute("""
+        UPDATE scheduler_state
+        SET high_water_xid = %s::xid8, last_run_at = NOW(), updated_at = NOW()
+        WHERE job_name = %s
+    """, (until, job_name))
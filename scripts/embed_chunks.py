@@ -2,24 +2,69 @@
 """
 Script to generate embeddings for task chunks and store them in Supabase.
 Processes task solutions and creates vector embeddings for RAG functionality.
+
+Chunk text and embeddings are stored once per distinct text in
+chunk_contents (keyed by SHA-256); task_chunks rows only reference them, and
+chunks whose text already has a stored embedding are not embedded again.
+
+Runs as an asyncio pipeline: read -> preprocess -> embed -> write, with
+bounded queues between the stages. A full queue blocks the stage feeding
+it, so the slowest stage sets the pace while database reads, markdown
+conversion, OpenAI requests and inserts for different tasks overlap.
 """
 
 import os
+import argparse
+import asyncio
+import hashlib
 import markdown
-import psycopg2
 import tiktoken
-import openai
+import aiohttp
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import time
 import sys
+import db
+import instrumentation
 
 # Load environment variables
 load_dotenv()
 
-def main():
+# Upper bound on embeddings kept in memory for reuse within one run
+EMBEDDING_CACHE_SIZE = 20000
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Inputs per embeddings request and pause after each request (rate limits)
+EMBED_BATCH_SIZE = 100
+REQUEST_DELAY = 0.1
+
+# Tokenizer shared by every chunks() call in this process
+_encoder = None
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    
+    parser = argparse.ArgumentParser(description="Generate embeddings for task chunks")
+    parser.add_argument("--queue-size", type=int, default=64, help="Capacity of each queue between stages")
+    parser.add_argument("--preprocess-workers", type=int, default=2, help="Threads converting and chunking markdown")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--writers", type=int, default=2, help="Concurrent insert transactions")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="Seconds between progress and queue-depth lines")
+    instrumentation.add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main function to generate embeddings for task chunks."""
     
+    args = parse_args(argv)
+    with instrumentation.instrumented_run("embed_chunks", args.profile):
+        run(args)
+
+def run(args):
+    """Embed every task that has no chunks yet."""
+    
     # Check required environment variables
     required_vars = ["SUPABASE_DB_URL", "OPENAI_API_KEY"]
     missing_vars = [var for var in required_vars if not os.getenv(var)]
@@ -28,99 +73,380 @@ def main():
         print(f"Error: Missing required environment variables: {', '.join(missing_vars)}")
         sys.exit(1)
     
-    # Initialize connections
     try:
-        conn = psycopg2.connect(os.getenv("SUPABASE_DB_URL"))
-        cur = conn.cursor()
-        enc = tiktoken.encoding_for_model("text-embedding-3-small")
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        asyncio.run(run_pipeline(args))
     except Exception as e:
-        print(f"Error initializing connections: {e}")
-        sys.exit(1)
+        print(f"Error during processing: {e}")
+        instrumentation.mark_failed()
+
+class StageStats:
+    """Per-stage counters: busy time, idle time waiting for input, time blocked on a full output queue."""
     
-    try:
-        # Get tasks that don't have embeddings yet
-        cur.execute("""
-            SELECT t.id, t.solution_md 
-            FROM tasks t 
-            LEFT JOIN task_chunks tc ON t.id = tc.task_id 
-            WHERE tc.task_id IS NULL
-        """)
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+class QueueStats:
+    """Sampled depth of one bounded queue."""
+    
+    def __init__(self, name, queue):
+        self.name = name
+        self.queue = queue
+        self.samples = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.full_samples = 0
+    
+    def sample(self):
+        depth = self.queue.qsize()
+        self.samples += 1
+        self.depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+        if self.queue.full():
+            self.full_samples += 1
+    
+    def describe(self):
+        return f"{self.name}={self.queue.qsize()}/{self.queue.maxsize}"
+
+async def get_item(queue, stats):
+    """Take the next item, counting the wait as idle time of the consuming stage."""
+    
+    started = time.perf_counter()
+    item = await queue.get()
+    stats.starved += time.perf_counter() - started
+    return item
+
+async def put_item(queue, item, stats):
+    """Queue an item, counting a wait on a full queue as backpressure on the producing stage."""
+    
+    started = time.perf_counter()
+    await queue.put(item)
+    stats.blocked += time.perf_counter() - started
+
+async def read_tasks(pool, output, stats):
+    """Stream tasks without chunks through a server-side cursor."""
+    
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            cursor = conn.cursor("""
+                SELECT t.id, t.solution_md
+                FROM tasks t
+                LEFT JOIN task_chunks tc ON t.id = tc.task_id
+                WHERE tc.task_id IS NULL
+            """, prefetch=500)
+            
+            started = time.perf_counter()
+            async for task_id, solution_md in cursor:
+                stats.busy += time.perf_counter() - started
+                stats.items += 1
+                await put_item(output, (task_id, solution_md), stats)
+                started = time.perf_counter()
+
+def preprocess(solution_md):
+    """Convert markdown to plain text and split it into chunks, skipping very short ones."""
+    
+    text = BeautifulSoup(markdown.markdown(solution_md), "html.parser").get_text()
+    return [chunk for chunk in chunks(text, max_tokens=400) if len(chunk.strip()) >= 50]
+
+async def preprocess_worker(executor, source, output, stats, failures):
+    """Chunk task solutions in a thread so the event loop keeps feeding the other stages."""
+    
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await get_item(source, stats)
+        if item is None:
+            return
         
-        tasks = cur.fetchall()
+        task_id, solution_md = item
+        started = time.perf_counter()
+        try:
+            task_chunks = await loop.run_in_executor(executor, preprocess, solution_md)
+        except Exception as e:
+            print(f"✗ Error processing task {task_id}: {e}")
+            failures.append(task_id)
+            continue
+        finally:
+            stats.busy += time.perf_counter() - started
         
-        if not tasks:
-            print("No tasks to process - all tasks already have embeddings")
+        stats.items += 1
+        await put_item(output, (task_id, task_chunks), stats)
+
+async def fetch_stored_hashes(pool, hashes):
+    """The subset of ``hashes`` that already has an embedding in chunk_contents."""
+    
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT content_hash FROM chunk_contents
+            WHERE content_hash = ANY($1::text[]) AND embedding IS NOT NULL
+        """, hashes)
+    return {row["content_hash"] for row in rows}
+
+async def embed_worker(pool, session, cache, inflight, source, output, stats, failures, counts):
+    """
+    Embed the chunks of one task per item. Identical text reuses the cached
+    embedding, or waits for the request of another worker already embedding it.
+    Text already stored in chunk_contents is not embedded; its embedding is
+    None, meaning only the reference has to be written.
+    """
+    
+    while True:
+        item = await get_item(source, stats)
+        if item is None:
             return
         
-        print(f"Processing {len(tasks)} tasks...")
+        task_id, task_chunks = item
+        started = time.perf_counter()
+        try:
+            hashes = [hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in task_chunks]
+            embeddings = {}
+            missing = {}
+            waiting = {}
+            for chunk_hash, chunk in zip(hashes, task_chunks):
+                if chunk_hash in cache:
+                    embeddings[chunk_hash] = cache[chunk_hash]
+                elif chunk_hash in inflight:
+                    waiting[chunk_hash] = inflight[chunk_hash]
+                elif chunk_hash not in missing:
+                    missing[chunk_hash] = chunk
+                    inflight[chunk_hash] = asyncio.get_running_loop().create_future()
+            
+            to_embed = []
+            if missing:
+                try:
+                    stored = await fetch_stored_hashes(pool, list(missing))
+                    to_embed = [chunk_hash for chunk_hash in missing if chunk_hash not in stored]
+                    created = await create_embeddings(session, [missing[chunk_hash] for chunk_hash in to_embed]) if to_embed else []
+                    # A short response would leave the futures of the unmatched hashes unresolved
+                    if len(created) != len(to_embed):
+                        raise Exception(f"Expected {len(to_embed)} embeddings, got {len(created)}")
+                except Exception as e:
+                    for chunk_hash in missing:
+                        inflight.pop(chunk_hash).set_exception(e)
+                    raise
+                resolved = dict.fromkeys(stored)
+                resolved.update(zip(to_embed, created))
+                for chunk_hash, embedding in resolved.items():
+                    embeddings[chunk_hash] = embedding
+                    if len(cache) < EMBEDDING_CACHE_SIZE:
+                        cache[chunk_hash] = embedding
+                    inflight.pop(chunk_hash).set_result(embedding)
+            for chunk_hash, future in waiting.items():
+                embeddings[chunk_hash] = await future
+            
+            rows = [
+                (task_id, chunk_hash, chunk, embeddings[chunk_hash])
+                for chunk_hash, chunk in zip(hashes, task_chunks)
+            ]
+            counts["created"] += len(to_embed)
+            counts["reused"] += len(task_chunks) - len(to_embed)
+        except Exception as e:
+            print(f"✗ Error processing task {task_id}: {e}")
+            failures.append(task_id)
+            continue
+        finally:
+            stats.busy += time.perf_counter() - started
         
-        processed_count = 0
+        stats.items += 1
+        await put_item(output, (task_id, rows), stats)
+
+async def write_worker(pool, source, stats, failures, counts):
+    """
+    Insert each task's chunks in its own transaction, so a failing task loses
+    only its own rows: new contents into chunk_contents, then one task_chunks
+    reference per chunk.
+    """
+    
+    while True:
+        item = await get_item(source, stats)
+        if item is None:
+            return
         
-        for task_id, solution_md in tasks:
-            try:
-                # Convert markdown to plain text
-                text = BeautifulSoup(markdown.markdown(solution_md), "html.parser").get_text()
-                
-                # Generate chunks
-                chunks_generated = 0
-                for chunk in chunks(text, max_tokens=400):
-                    if len(chunk.strip()) < 50:  # Skip very short chunks
-                        continue
-                    
-                    # Generate embedding
-                    embedding = create_embedding(chunk)
-                    
-                    # Insert into database
-                    cur.execute(
-                        "INSERT INTO task_chunks (task_id, chunk, embedding) VALUES (%s, %s, %s)",
-                        (task_id, chunk, embedding)
+        task_id, rows = item
+        started = time.perf_counter()
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # Sorted by hash, so writers sharing contents lock them in the same order
+                    contents = sorted({
+                        chunk_hash: (chunk_hash, chunk, vector_literal(embedding))
+                        for _, chunk_hash, chunk, embedding in rows
+                        if embedding is not None
+                    }.values())
+                    if contents:
+                        await conn.executemany("""
+                            INSERT INTO chunk_contents (content_hash, chunk, embedding)
+                            VALUES ($1, $2, $3::text::vector)
+                            ON CONFLICT (content_hash) DO UPDATE
+                                SET embedding = EXCLUDED.embedding
+                                WHERE chunk_contents.embedding IS NULL
+                        """, contents)
+                    await conn.executemany(
+                        "INSERT INTO task_chunks (task_id, content_hash) VALUES ($1, $2)",
+                        [(row_task_id, chunk_hash) for row_task_id, chunk_hash, _, _ in rows]
                     )
-                    
-                    chunks_generated += 1
-                    
-                    # Rate limiting - sleep to avoid OpenAI rate limits
-                    time.sleep(0.1)
-                
-                processed_count += 1
-                print(f"✓ Processed task {task_id}: {chunks_generated} chunks")
-                
-                # Commit after each task
-                conn.commit()
-                
-            except Exception as e:
-                print(f"✗ Error processing task {task_id}: {e}")
-                conn.rollback()
-                continue
-        
-        print(f"\nProcessed {processed_count}/{len(tasks)} tasks successfully!")
-        
-    except Exception as e:
-        print(f"Error during processing: {e}")
+            stats.items += 1
+            counts["chunks"] += len(rows)
+            print(f"✓ Processed task {task_id}: {len(rows)} chunks")
+        except Exception as e:
+            print(f"✗ Error processing task {task_id}: {e}")
+            failures.append(task_id)
+        finally:
+            stats.busy += time.perf_counter() - started
+
+async def monitor_queues(queue_stats, stage_stats, interval):
+    """Sample queue depths and print a progress line every ``interval`` seconds."""
+    
+    ticks_per_line = max(1, round(interval / 0.5))
+    tick = 0
+    while True:
+        await asyncio.sleep(0.5)
+        for stats in queue_stats:
+            stats.sample()
+        tick += 1
+        if tick % ticks_per_line == 0:
+            progress = " ".join(f"{stats.name}={stats.items}" for stats in stage_stats)
+            depths = " ".join(stats.describe() for stats in queue_stats)
+            print(f"  {progress} | queues {depths}")
+
+def print_pipeline_stats(stage_stats, queue_stats, elapsed):
+    """Per-stage busy/idle/blocked time and queue depths; the busiest stage is the bottleneck."""
+    
+    print(f"\n{'stage':<11} {'items':>7} {'busy s':>8} {'starved s':>10} {'blocked s':>10}")
+    for stats in stage_stats:
+        print(f"{stats.name:<11} {stats.items:>7} {stats.busy:>8.2f} {stats.starved:>10.2f} {stats.blocked:>10.2f}")
+    
+    print(f"\n{'queue':<11} {'capacity':>8} {'mean':>6} {'max':>5} {'full':>6}")
+    for stats in queue_stats:
+        mean = stats.depth_sum / stats.samples if stats.samples else 0
+        full = stats.full_samples / stats.samples if stats.samples else 0
+        print(f"{stats.name:<11} {stats.queue.maxsize:>8} {mean:>6.1f} {stats.max_depth:>5} {full:>6.0%}")
+    print(f"\nPipeline finished in {elapsed:.1f}s")
+    
+    # Busy time of concurrent workers is summed, so it can exceed wall time
+    for stats in stage_stats:
+        instrumentation.record_stage(stats.name, stats.busy)
+        instrumentation.record_stage(f"{stats.name}_blocked", stats.blocked)
+    for stats in queue_stats:
+        instrumentation.count(f"queue_{stats.name}_max_depth", stats.max_depth)
+
+async def run_pipeline(args):
+    """Run the read -> preprocess -> embed -> write pipeline until every task is written."""
+    
+    started = time.perf_counter()
+    get_encoder()
+    # Writers, the reader and embedders looking up stored contents
+    pool = await db.create_async_pool(max_size=args.writers + 2)
+    
+    preprocess_queue = asyncio.Queue(args.queue_size)
+    embed_queue = asyncio.Queue(args.queue_size)
+    write_queue = asyncio.Queue(args.queue_size)
+    queue_stats = [
+        QueueStats("preprocess", preprocess_queue),
+        QueueStats("embed", embed_queue),
+        QueueStats("write", write_queue)
+    ]
+    read_stats, preprocess_stats, embed_stats, write_stats = stage_stats = [
+        StageStats(name) for name in ("read", "preprocess", "embed", "write")
+    ]
+    
+    failures = []
+    counts = {"created": 0, "reused": 0, "chunks": 0}
+    # Identical solution steps across tasks are embedded once per run
+    embedding_cache = {}
+    # Hashes being embedded right now -> future resolving to the embedding
+    inflight = {}
+    
+    executor = ThreadPoolExecutor(max_workers=args.preprocess_workers)
+    headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+    monitor = asyncio.create_task(monitor_queues(queue_stats, stage_stats, args.stats_interval))
+    workers = []
+    try:
+        async with aiohttp.ClientSession(headers=headers) as session:
+            print("Processing tasks without embeddings...")
+            
+            reader = asyncio.create_task(read_tasks(pool, preprocess_queue, read_stats))
+            preprocessors = [
+                asyncio.create_task(preprocess_worker(executor, preprocess_queue, embed_queue, preprocess_stats, failures))
+                for _ in range(args.preprocess_workers)
+            ]
+            embedders = [
+                asyncio.create_task(embed_worker(pool, session, embedding_cache, inflight, embed_queue, write_queue, embed_stats, failures, counts))
+                for _ in range(args.embed_concurrency)
+            ]
+            writers = [
+                asyncio.create_task(write_worker(pool, write_queue, write_stats, failures, counts))
+                for _ in range(args.writers)
+            ]
+            workers = [reader] + preprocessors + embedders + writers
+            
+            # Shut the stages down in order: one sentinel per worker once the upstream stage is done
+            await reader
+            for stage_workers, queue in ((preprocessors, preprocess_queue), (embedders, embed_queue), (writers, write_queue)):
+                for _ in stage_workers:
+                    await queue.put(None)
+                await asyncio.gather(*stage_workers)
     finally:
-        cur.close()
-        conn.close()
+        monitor.cancel()
+        for worker in workers:
+            worker.cancel()
+        executor.shutdown(wait=False)
+        await pool.close()
+    
+    task_count = read_stats.items
+    if not task_count:
+        print("No tasks to process - all tasks already have embeddings")
+        return
+    
+    print_pipeline_stats(stage_stats, queue_stats, time.perf_counter() - started)
+    instrumentation.count("tasks_processed", write_stats.items)
+    instrumentation.count("tasks_failed", len(failures))
+    instrumentation.count("chunks_written", counts["chunks"])
+    instrumentation.count("embeddings_created", counts["created"])
+    instrumentation.count("embeddings_reused", counts["reused"])
+    
+    print(f"\nProcessed {write_stats.items}/{task_count} tasks successfully!")
+    print(f"Reused stored or cached embeddings for {counts['reused']} chunks")
+
+def get_encoder():
+    """Return the process-wide tiktoken encoder, loading it on first use."""
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    return _encoder
 
 def chunks(text: str, max_tokens: int = 400):
     """Split text into chunks with specified maximum tokens."""
-    enc = tiktoken.encoding_for_model("text-embedding-3-small")
+    enc = get_encoder()
     tokens = enc.encode(text)
     
     for i in range(0, len(tokens), max_tokens):
         chunk_tokens = tokens[i:i + max_tokens]
         yield enc.decode(chunk_tokens)
 
-def create_embedding(text: str) -> list:
-    """Create embedding for given text using OpenAI API."""
-    try:
-        response = openai.Embedding.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response["data"][0]["embedding"]
-    except Exception as e:
-        print(f"Error creating embedding: {e}")
-        raise
+def vector_literal(embedding) -> str:
+    """pgvector text form of an embedding."""
+    return "[" + ",".join(repr(float(value)) for value in embedding) + "]"
+
+async def create_embeddings(session: aiohttp.ClientSession, texts: list) -> list:
+    """Create embeddings for texts using the OpenAI API, EMBED_BATCH_SIZE inputs per request."""
+    embeddings = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        async with session.post(
+            "https://api.openai.com/v1/embeddings",
+            json={"model": EMBEDDING_MODEL, "input": texts[i:i + EMBED_BATCH_SIZE]}
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"OpenAI API error: {response.status} - {error_text}")
+            result = await response.json()
+        embeddings.extend(item["embedding"] for item in sorted(result["data"], key=lambda item: item["index"]))
+        
+        # Rate limiting - pause to avoid OpenAI rate limits
+        await asyncio.sleep(REQUEST_DELAY)
+    return embeddings
 
 if __name__ == "__main__":
     main()
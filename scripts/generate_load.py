@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for scheduler benchmarks.
+Fills a local Postgres database with users, tasks and attempts drawn from
+realistic distributions: heavy-tailed user activity, Zipf topic popularity,
+ability-vs-difficulty correctness, log-normal solve times and evening-heavy
+study sessions.
+
+Never point this at production: it reads LOADTEST_DB_URL (or --db-url) and
+--reset truncates the tables it fills.
+Usage: python generate_load.py --users 10000 --tasks 2000 --topics 40 --create-schema --reset
+"""
+
+import os
+import argparse
+import math
+import random
+import time
+import uuid
+import psycopg2
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import sys
+
+import db
+
+# Load environment variables
+load_dotenv()
+
+# Stand-alone copy of the tables the scheduler touches, without auth.users
+# references, so an empty local database can host the benchmark
+LOADTEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+  id            bigserial primary key,
+  exam          text    not null default 'ege',
+  topic         text    not null,
+  subtopic      text,
+  difficulty    int     not null check (difficulty between 1 and 5),
+  statement_md  text    not null default '',
+  answer        text    not null default '',
+  solution_md   text    not null default '',
+  created_at    timestamptz default now()
+);
+
+CREATE TABLE IF NOT EXISTS attempts (
+  id               bigserial primary key,
+  user_id          uuid,
+  task_id          bigint references tasks(id) on delete cascade,
+  ts               timestamptz default now(),
+  answer_submitted text,
+  is_correct       boolean,
+  time_spent_s     int,
+  inserted_xid     xid8 default pg_current_xact_id()
+);
+
+CREATE TABLE IF NOT EXISTS recommendations (
+  id            bigserial primary key,
+  user_id       uuid,
+  task_id       bigint references tasks(id) on delete cascade,
+  reason        text not null check (reason in ('weak_topic', 'spaced_repetition', 'difficulty_ramp')),
+  priority      int default 1 check (priority between 1 and 5),
+  next_review   timestamptz not null,
+  created_at    timestamptz default now(),
+  unique (user_id, task_id)
+);
+
+CREATE TABLE IF NOT EXISTS scheduler_state (
+  job_name         text primary key,
+  high_water_mark  timestamptz,
+  last_run_at      timestamptz,
+  last_full_sweep  timestamptz,
+  high_water_xid   xid8,
+  updated_at       timestamptz default now()
+);
+
+CREATE TABLE IF NOT EXISTS task_repetitions (
+  id               bigserial primary key,
+  user_id          uuid,
+  task_id          bigint references tasks(id) on delete cascade,
+  easiness_factor  real default 2.5 check (easiness_factor >= 1.3),
+  interval_days    int default 1 check (interval_days > 0),
+  repetition_count int default 0,
+  stability        real check (stability > 0),
+  difficulty       real check (difficulty between 1 and 10),
+  last_reviewed    timestamptz,
+  next_review      timestamptz,
+  quality_score    int,
+  created_at       timestamptz default now(),
+  updated_at       timestamptz default now(),
+  unique (user_id, task_id)
+);
+
+CREATE TABLE IF NOT EXISTS weak_topic_buckets (
+  user_id        uuid,
+  topic          text not null,
+  day            date not null,
+  attempts_count int not null default 0,
+  correct_count  int not null default 0,
+  last_attempt   timestamptz,
+  primary key (user_id, topic, day)
+);
+
+CREATE TABLE IF NOT EXISTS weak_topic_counters (
+  user_id        uuid,
+  topic          text not null,
+  attempts_count int not null default 0,
+  correct_count  int not null default 0,
+  last_attempt   timestamptz,
+  updated_at     timestamptz default now(),
+  primary key (user_id, topic)
+);
+
+CREATE TABLE IF NOT EXISTS review_queues (
+  user_id        uuid primary key,
+  queue          jsonb not null default '[]',
+  queue_length   int not null default 0,
+  next_due       timestamptz,
+  built_at       timestamptz default now()
+);
+
+CREATE OR REPLACE VIEW weak_topics_live AS
+SELECT user_id, topic, 1 - correct_count::float / attempts_count AS error_rate,
+       attempts_count, last_attempt
+FROM weak_topic_counters
+WHERE attempts_count >= 3;
+
+CREATE INDEX IF NOT EXISTS idx_attempts_user_ts ON attempts(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_attempts_task_user ON attempts(task_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_attempts_ts ON attempts(ts);
+-- Columns added after the first load-test schema, for databases created earlier
+ALTER TABLE attempts ADD COLUMN IF NOT EXISTS inserted_xid xid8 default pg_current_xact_id();
+ALTER TABLE scheduler_state ADD COLUMN IF NOT EXISTS high_water_xid xid8;
+CREATE INDEX IF NOT EXISTS idx_attempts_inserted_xid ON attempts(inserted_xid);
+CREATE INDEX IF NOT EXISTS idx_task_repetitions_next_review ON task_repetitions(next_review);
+CREATE INDEX IF NOT EXISTS idx_tasks_topic_difficulty ON tasks(topic, difficulty);
+CREATE INDEX IF NOT EXISTS idx_recommendations_next_review ON recommendations(next_review);
+CREATE INDEX IF NOT EXISTS idx_weak_topic_buckets_day ON weak_topic_buckets(day);
+"""
+
+# Relative study activity per hour of day: quiet nights, evening peak
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 1, 2, 3, 4, 4, 4, 5, 6, 6, 7, 8, 9, 10, 12, 14, 14, 11, 6, 3]
+
+COPY_BATCH_SIZE = 200000
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Generate synthetic scheduler load")
+    parser.add_argument("--db-url", type=str, default=os.getenv("LOADTEST_DB_URL"),
+                        help="Target database (defaults to LOADTEST_DB_URL)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--attempts-per-user", type=float, default=60,
+                        help="Mean attempts per user; activity is heavy-tailed around it")
+    parser.add_argument("--days", type=int, default=45, help="Spread attempts over the last N days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--create-schema", action="store_true", help="Create stand-alone benchmark tables")
+    parser.add_argument("--reset", action="store_true", help="Truncate benchmark tables first")
+    return parser.parse_args()
+
+def main():
+    """Main function for load generation."""
+
+    args = parse_args()
+
+    if not args.db_url:
+        print("Error: LOADTEST_DB_URL or --db-url must be set")
+        sys.exit(1)
+
+    try:
+        conn = psycopg2.connect(args.db_url)
+        cur = conn.cursor()
+
+        if args.create_schema:
+            create_schema(cur)
+        if args.reset:
+            reset_tables(cur)
+
+        stats = generate_load(
+            cur,
+            users=args.users,
+            tasks=args.tasks,
+            topics=args.topics,
+            attempts_per_user=args.attempts_per_user,
+            days=args.days,
+            seed=args.seed
+        )
+
+        conn.commit()
+        print(f"Generated {stats['users']} users, {stats['tasks']} tasks and "
+              f"{stats['attempts']} attempts in {stats['seconds']:.1f}s")
+
+    except Exception as e:
+        print(f"Error during load generation: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        sys.exit(1)
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+def create_schema(cur):
+    """Create the stand-alone benchmark tables if they do not exist."""
+
+    cur.execute(LOADTEST_SCHEMA)
+
+def reset_tables(cur):
+    """Empty every table the generator and the scheduler write to."""
+
+    cur.execute("""
+        TRUNCATE attempts, recommendations, review_queues, weak_topic_buckets,
+                 weak_topic_counters, task_repetitions, scheduler_state, tasks
+        RESTART IDENTITY CASCADE
+    """)
+
+def zipf_weights(count, exponent=1.1):
+    """Zipf popularity weights for ``count`` ranked items."""
+
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+def generate_tasks(rng, tasks, topics):
+    """
+    Tasks as (topic, difficulty) tuples: topics follow a Zipf distribution
+    (a few topics hold most tasks), difficulty peaks at 3.
+    """
+
+    topic_names = [f"topic_{index:03d}" for index in range(topics)]
+    task_topics = rng.choices(topic_names, weights=zipf_weights(topics, 0.8), k=tasks)
+    return [
+        (topic, min(5, max(1, round(rng.triangular(1, 5, 3)))))
+        for topic in task_topics
+    ]
+
+def generate_attempts(rng, user_count, task_rows, attempts_per_user, days, now):
+    """
+    Yield (user_id, task_id, ts, is_correct, time_spent_s) attempts.
+
+    Each user gets a log-normal number of attempts, an ability drawn from a
+    normal distribution and a few favourite topics. A third of the attempts
+    revisit an earlier task, so repetition candidates exist.
+    """
+
+    tasks_by_topic = {}
+    for task_id, (topic, difficulty) in enumerate(task_rows, start=1):
+        tasks_by_topic.setdefault(topic, []).append((task_id, difficulty))
+    topics = sorted(tasks_by_topic)
+    topic_weights = zipf_weights(len(topics))
+    hours = list(range(24))
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Log-normal with the requested mean: mean = exp(mu + sigma^2 / 2)
+    sigma = 1.0
+    mu = math.log(max(attempts_per_user, 1)) - sigma ** 2 / 2
+
+    for _ in range(user_count):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        ability = rng.gauss(3.0, 1.0)
+        favourites = rng.choices(topics, weights=topic_weights, k=3)
+        active_days = sorted(rng.sample(range(days), k=min(days, max(1, int(rng.expovariate(1 / 8)) + 1))))
+        count = max(1, int(rng.lognormvariate(mu, sigma)))
+        history = []
+
+        for _ in range(count):
+            if history and rng.random() < 0.33:
+                task_id, difficulty = rng.choice(history)
+            else:
+                topic = rng.choice(favourites) if rng.random() < 0.7 else rng.choice(topics)
+                task_id, difficulty = rng.choice(tasks_by_topic[topic])
+                history.append((task_id, difficulty))
+
+            day = rng.choice(active_days)
+            hour = rng.choices(hours, weights=HOUR_WEIGHTS)[0]
+            ts = midnight - timedelta(days=days - 1 - day) + timedelta(hours=hour, minutes=rng.randrange(60))
+            ts = min(ts, now)
+
+            # Logistic chance of success from ability minus difficulty
+            is_correct = rng.random() < 1 / (1 + math.exp(-(ability - difficulty + 0.5)))
+            time_spent = int(min(1800, rng.lognormvariate(math.log(45 + 15 * difficulty), 0.6)))
+
+            yield user_id, task_id, ts, is_correct, time_spent
+
+def generate_load(cur, users, tasks, topics, attempts_per_user, days=45, seed=42):
+    """
+    Insert synthetic tasks and attempts. Task ids are assumed to start at 1,
+    so run on freshly reset tables. Returns counts and elapsed seconds.
+    """
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    task_rows = generate_tasks(rng, tasks, topics)
+    db.copy_rows(cur, "tasks", ["topic", "difficulty"], task_rows, batch_size=COPY_BATCH_SIZE)
+
+    attempt_count = db.copy_rows(
+        cur, "attempts", ["user_id", "task_id", "ts", "is_correct", "time_spent_s"],
+        generate_attempts(rng, users, task_rows, attempts_per_user, days, now),
+        batch_size=COPY_BATCH_SIZE
+    )
+
+    cur.execute("ANALYZE tasks")
+    cur.execute("ANALYZE attempts")
+
+    return {
+        "users": users,
+        "tasks": len(task_rows),
+        "attempts": attempt_count,
+        "seconds": time.perf_counter() - started
+    }
+
+if __name__ == "__main__":
+    main()
@@ -5,111 +5,32 @@ Creates beautiful PDF reports using WeasyPrint from HTML templates.
 """
 
 import os
-import psycopg2
+import argparse
+import hashlib
+import time
+from psycopg2.extras import execute_values
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import sys
-from weasyprint import HTML, CSS
 from jinja2 import Template
 import json
+from report_sinks import create_sink
+import db
+import instrumentation
 
 # Load environment variables
 load_dotenv()
 
-def main():
-    """Main function for PDF generation."""
-    
-    if not os.getenv("SUPABASE_DB_URL"):
-        print("Error: SUPABASE_DB_URL must be set")
-        sys.exit(1)
-    
-    try:
-        conn = psycopg2.connect(os.getenv("SUPABASE_DB_URL"))
-        cur = conn.cursor()
-        
-        # Get lesson reports that need PDF generation
-        cur.execute("""
-            SELECT id, user_id, week_start, week_end, tasks_solved, 
-                   accuracy, topics_covered, weak_topics
-            FROM lesson_reports
-            WHERE pdf_url IS NULL
-            ORDER BY created_at DESC
-            LIMIT 10
-        """)
-        
-        reports = cur.fetchall()
-        
-        if not reports:
-            print("No reports to generate PDFs for")
-            return
-        
-        generated_count = 0
-        
-        for report in reports:
-            try:
-                pdf_path = generate_report_pdf(report)
-                
-                if pdf_path:
-                    # Update database with PDF URL
-                    cur.execute("""
-                        UPDATE lesson_reports 
-                        SET pdf_url = %s 
-                        WHERE id = %s
-                    """, (pdf_path, report[0]))
-                    
-                    generated_count += 1
-                    print(f"✓ Generated PDF for report {report[0]}")
-                
-            except Exception as e:
-                print(f"✗ Error generating PDF for report {report[0]}: {e}")
-                continue
-        
-        conn.commit()
-        print(f"\nGenerated {generated_count} PDFs successfully!")
-        
-    except Exception as e:
-        print(f"Error during PDF generation: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+REPORT_COLUMNS = """
+    id, user_id, week_start, week_end, tasks_solved,
+    accuracy, topics_covered, weak_topics
+"""
 
-def generate_report_pdf(report_data):
-    """Generate PDF for a single report."""
-    
-    report_id, user_id, week_start, week_end, tasks_solved, accuracy, topics_covered, weak_topics = report_data
-    
-    # Create HTML content
-    html_content = create_html_report(report_data)
-    
-    # Generate PDF
-    pdf_filename = f"report_{report_id}_{user_id}_{week_start}.pdf"
-    pdf_path = f"./reports/{pdf_filename}"
-    
-    # Create reports directory if it doesn't exist
-    os.makedirs("./reports", exist_ok=True)
-    
-    # Generate PDF using WeasyPrint
-    html = HTML(string=html_content)
-    css = CSS(string=get_pdf_styles())
-    
-    html.write_pdf(pdf_path, stylesheets=[css])
-    
-    return pdf_path
+# Bump when rendering changes in a way REPORT_TEMPLATE and the styles do not show
+RENDER_VERSION = 1
 
-def create_html_report(report_data):
-    """Create HTML content for the report."""
-    
-    report_id, user_id, week_start, week_end, tasks_solved, accuracy, topics_covered, weak_topics = report_data
-    
-    # Parse JSON fields
-    topics_covered = json.loads(topics_covered) if topics_covered else []
-    weak_topics = json.loads(weak_topics) if weak_topics else []
-    
-    template = Template("""
+REPORT_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -171,18 +92,435 @@ def create_html_report(report_data):
         </div>
     </body>
     </html>
-    """)
-    
-    return template.render(
-        week_start=week_start,
-        week_end=week_end,
-        tasks_solved=tasks_solved,
-        accuracy_percent=round(accuracy * 100, 1),
-        topics_count=len(topics_covered),
-        topics_covered=topics_covered,
-        weak_topics=weak_topics,
-        generated_at=datetime.now().strftime("%d.%m.%Y %H:%M")
+"""
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    
+    parser = argparse.ArgumentParser(description="Generate PDFs for weekly reports")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Render every pending report in a process pool instead of the latest 10"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Render processes in batch mode")
+    parser.add_argument("--page-size", type=int, default=500, help="Pending reports fetched per page")
+    parser.add_argument("--commit-every", type=int, default=100, help="Commit pdf_url updates every N PDFs")
+    parser.add_argument(
+        "--engine",
+        choices=["weasyprint", "direct"],
+        default="weasyprint",
+        help="weasyprint: HTML/CSS layout; direct: draw the fixed layout straight to PDF with ReportLab"
+    )
+    parser.add_argument(
+        "--sink",
+        choices=["local", "s3"],
+        default="local",
+        help="Where rendered PDFs go: local directory or S3-compatible object storage"
+    )
+    parser.add_argument("--output-dir", type=str, default="./reports", help="Directory of the local sink")
+    parser.add_argument(
+        "--no-reuse",
+        action="store_true",
+        help="Render every report even when an identical one was rendered before"
     )
+    instrumentation.add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main function for PDF generation."""
+    
+    args = parse_args(argv)
+    with instrumentation.instrumented_run("generate_pdf", args.profile):
+        run(args)
+
+def run(args):
+    """Render pending reports as selected by ``args``."""
+    
+    if not os.getenv("SUPABASE_DB_URL"):
+        print("Error: SUPABASE_DB_URL must be set")
+        sys.exit(1)
+    
+    set_render_engine(args.engine)
+    
+    try:
+        sink = create_sink(args.sink, args.output_dir)
+        conn = db.connect()
+        cur = conn.cursor()
+        
+        if args.batch:
+            generate_reports_batch(
+                conn, cur, sink, args.workers, args.page_size, args.commit_every,
+                reuse=not args.no_reuse, engine=args.engine
+            )
+            return
+        
+        # Get lesson reports that need PDF generation
+        with instrumentation.stage("fetch"):
+            cur.execute("""
+                SELECT {columns}
+                FROM lesson_reports
+                WHERE pdf_url IS NULL
+                ORDER BY created_at DESC
+                LIMIT 10
+            """.format(columns=REPORT_COLUMNS))
+            
+            reports = cur.fetchall()
+        
+        if not reports:
+            print("No reports to generate PDFs for")
+            return
+        
+        generated_count = 0
+        
+        for report in reports:
+            try:
+                key = report_filename(report)
+                with instrumentation.stage("render"):
+                    pdf_bytes = get_renderer().render_pdf(report)
+                with instrumentation.stage("upload"):
+                    pdf_url = sink.put_many([(key, pdf_bytes)])[key]
+                
+                if pdf_url:
+                    # Update database with PDF URL
+                    cur.execute("""
+                        UPDATE lesson_reports 
+                        SET pdf_url = %s 
+                        WHERE id = %s
+                    """, (pdf_url, report[0]))
+                    
+                    generated_count += 1
+                    print(f"✓ Generated PDF for report {report[0]}")
+                
+            except Exception as e:
+                print(f"✗ Error generating PDF for report {report[0]}: {e}")
+                instrumentation.count("reports_failed")
+                continue
+        
+        conn.commit()
+        instrumentation.count("reports_generated", generated_count)
+        print(f"\nGenerated {generated_count} PDFs successfully!")
+        
+    except Exception as e:
+        print(f"Error during PDF generation: {e}")
+        instrumentation.mark_failed()
+        if 'conn' in locals():
+            conn.rollback()
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db.release(conn)
+        db.print_statement_summary()
+
+def fetch_pending_page(cur, after_id, page_size):
+    """Next page of reports without a PDF, by id, so updated rows never shift pages."""
+    
+    cur.execute("""
+        SELECT {columns}
+        FROM lesson_reports
+        WHERE pdf_url IS NULL
+        AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """.format(columns=REPORT_COLUMNS), (after_id, page_size))
+    return cur.fetchall()
+
+def save_pdf_urls(conn, cur, updates, renders=()):
+    """
+    Store (report_id, pdf_url) pairs and newly rendered (content_hash, sink,
+    pdf_url, template_version) entries, then commit them together.
+    """
+    
+    db.bulk_insert(
+        cur, "report_renders", ("content_hash", "sink", "pdf_url", "template_version"), renders,
+        on_conflict="ON CONFLICT (content_hash, sink) DO NOTHING"
+    )
+    
+    if updates:
+        execute_values(cur, """
+            UPDATE lesson_reports AS lr
+            SET pdf_url = v.pdf_url
+            FROM (VALUES %s) AS v(id, pdf_url)
+            WHERE lr.id = v.id
+        """, updates, template="(%s::bigint, %s)")
+    
+    conn.commit()
+
+def template_version(engine="weasyprint"):
+    """Short hash of everything besides report data that shapes the PDF."""
+    
+    source = f"{RENDER_VERSION}\n{engine}\n{REPORT_TEMPLATE}\n{get_pdf_styles()}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+def report_content_hash(report_data, version):
+    """
+    Hash of the template inputs of a report. The generation timestamp is left
+    out, so reports showing the same data render to the same hash.
+    """
+    
+    context = report_context(report_data)
+    context.pop("generated_at")
+    payload = json.dumps({"template_version": version, **context}, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def fetch_known_renders(cur, content_hashes, sink_location):
+    """
+    pdf_url of already rendered reports, keyed by content hash. Only renders
+    stored in the sink at ``sink_location`` count, so a run never hands out
+    URLs of another bucket, directory or public base URL.
+    """
+    
+    if not content_hashes:
+        return {}
+    
+    cur.execute("""
+        SELECT content_hash, pdf_url
+        FROM report_renders
+        WHERE content_hash = ANY(%s)
+        AND sink = %s
+    """, (list(content_hashes), sink_location))
+    return dict(cur.fetchall())
+
+def report_filename(report_data):
+    """Object key / file name of a report's own PDF."""
+    
+    report_id, user_id, week_start = report_data[0], report_data[1], report_data[2]
+    return f"report_{report_id}_{user_id}_{week_start}.pdf"
+
+def render_report(report_data):
+    """
+    Process pool task: render one report in memory, returning
+    (report_id, pdf_bytes, error, render_seconds).
+    """
+    
+    started = time.perf_counter()
+    try:
+        return report_data[0], get_renderer().render_pdf(report_data), None, time.perf_counter() - started
+    except Exception as e:
+        return report_data[0], None, str(e), time.perf_counter() - started
+
+def upload_rendered(sink, rendered, version):
+    """
+    Ship rendered PDFs to the sink in one concurrent batch.
+    
+    ``rendered`` holds (key, pdf_bytes, report_ids, content_hash) tuples;
+    returns the (report_id, pdf_url) updates and report_renders entries.
+    """
+    
+    urls = sink.put_many([(key, data) for key, data, _, _ in rendered])
+    updates = []
+    renders = []
+    for key, _, report_ids, content_hash in rendered:
+        updates.extend((report_id, urls[key]) for report_id in report_ids)
+        if content_hash:
+            renders.append((content_hash, sink.location, urls[key], version))
+    return updates, renders
+
+def generate_reports_batch(conn, cur, sink, workers, page_size=500, commit_every=100, reuse=True,
+                           engine="weasyprint"):
+    """
+    Render all pending reports in a process pool.
+    
+    Pending reports are streamed page by page and rendered into memory;
+    every ``commit_every`` PDFs are uploaded to ``sink`` in one concurrent
+    batch and their URLs committed, so a crash only loses work that was not
+    committed yet. Failed reports keep pdf_url NULL for the next run.
+    
+    With ``reuse``, reports whose template inputs hash to a PDF already
+    rendered into this sink (report_renders) get its URL without rendering,
+    and identical reports within a page are rendered once.
+    """
+    
+    started = time.perf_counter()
+    generated_count = 0
+    reused_count = 0
+    failed_count = 0
+    updates = []
+    rendered = []
+    after_id = 0
+    version = template_version(engine)
+    
+    def flush():
+        nonlocal updates, rendered
+        with instrumentation.stage("upload"):
+            uploaded, renders = upload_rendered(sink, rendered, version)
+        with instrumentation.stage("save"):
+            save_pdf_urls(conn, cur, updates + uploaded, renders)
+        updates, rendered = [], []
+    
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=set_render_engine,
+        initargs=(engine,)
+    ) as executor:
+        while True:
+            with instrumentation.stage("fetch"):
+                reports = fetch_pending_page(cur, after_id, page_size)
+            if not reports:
+                break
+            after_id = reports[-1][0]
+            
+            # (object key, report ids waiting for it, content hash) per future
+            futures = {}
+            if reuse:
+                with instrumentation.stage("reuse_lookup"):
+                    hashes = {report[0]: report_content_hash(report, version) for report in reports}
+                    known = fetch_known_renders(cur, set(hashes.values()), sink.location)
+                pending = {}
+                for report in reports:
+                    content_hash = hashes[report[0]]
+                    if content_hash in known:
+                        updates.append((report[0], known[content_hash]))
+                        reused_count += 1
+                    elif content_hash in pending:
+                        pending[content_hash].append(report[0])
+                    else:
+                        pending[content_hash] = [report[0]]
+                        future = executor.submit(render_report, report)
+                        futures[future] = (f"report_{content_hash[:32]}.pdf", pending[content_hash], content_hash)
+            else:
+                for report in reports:
+                    futures[executor.submit(render_report, report)] = (report_filename(report), [report[0]], None)
+            
+            for future in as_completed(futures):
+                report_id, pdf_bytes, error, render_seconds = future.result()
+                key, report_ids, content_hash = futures[future]
+                # Worker time, summed over processes
+                instrumentation.record_stage("render", render_seconds)
+                if error:
+                    failed_count += len(report_ids)
+                    print(f"✗ Error generating PDF for report {report_id}: {error}")
+                    continue
+                
+                generated_count += 1
+                reused_count += len(report_ids) - 1
+                rendered.append((key, pdf_bytes, report_ids, content_hash))
+                if len(rendered) + len(updates) >= commit_every:
+                    flush()
+            
+            elapsed = time.perf_counter() - started
+            print(f"  {generated_count} rendered, {reused_count} reused, {generated_count / elapsed:.1f} PDFs/s")
+    
+    flush()
+    
+    instrumentation.count("reports_generated", generated_count)
+    instrumentation.count("reports_reused", reused_count)
+    instrumentation.count("reports_failed", failed_count)
+    elapsed = time.perf_counter() - started
+    print(f"\nGenerated {generated_count} PDFs and reused {reused_count} ({failed_count} failed) "
+          f"in {elapsed:.1f}s with {workers} workers: "
+          f"{generated_count / elapsed if elapsed else 0:.1f} PDFs/s")
+    return generated_count
+
+class ReportRenderer:
+    """
+    Long-lived report renderer.
+    
+    The Jinja template, the parsed stylesheet and the font configuration are
+    built once and reused for every report rendered by this process.
+    """
+    
+    def __init__(self, output_dir="./reports"):
+        # WeasyPrint takes seconds to import; only load it when this engine is used
+        from weasyprint import HTML, CSS
+        try:
+            from weasyprint.text.fonts import FontConfiguration
+        except ImportError:  # WeasyPrint < 53
+            from weasyprint.fonts import FontConfiguration
+        
+        self.html_document = HTML
+        self.output_dir = output_dir
+        self.template = Template(REPORT_TEMPLATE)
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(string=get_pdf_styles(), font_config=self.font_config)
+    
+    def render_html(self, report_data):
+        """Render the report HTML."""
+        
+        return self.template.render(**report_context(report_data))
+    
+    def render_pdf(self, report_data):
+        """Render the report to PDF bytes."""
+        
+        html = self.html_document(string=self.render_html(report_data))
+        return html.write_pdf(stylesheets=[self.stylesheet], font_config=self.font_config)
+    
+    def write_pdf(self, report_data, filename=None):
+        """Render the report into ``output_dir`` and return the file path."""
+        
+        pdf_path = os.path.join(self.output_dir, filename or report_filename(report_data))
+        
+        # Create reports directory if it doesn't exist
+        os.makedirs(self.output_dir, exist_ok=True)
+        
+        html = self.html_document(string=self.render_html(report_data))
+        html.write_pdf(pdf_path, stylesheets=[self.stylesheet], font_config=self.font_config)
+        
+        return pdf_path
+
+# Renderer shared by all reports of this process (including pool workers)
+_renderer = None
+_render_engine = "weasyprint"
+
+def set_render_engine(engine):
+    """Select the engine used by get_renderer() in this process."""
+    
+    global _renderer, _render_engine
+    if engine != _render_engine:
+        _renderer = None
+    _render_engine = engine
+
+def get_renderer():
+    """Return this process's renderer, creating it on first use."""
+    
+    global _renderer
+    if _renderer is None:
+        if _render_engine == "direct":
+            # ReportLab is only needed for the direct engine
+            from report_direct import DirectReportRenderer
+            _renderer = DirectReportRenderer(report_context)
+        else:
+            _renderer = ReportRenderer()
+    return _renderer
+
+def generate_report_pdf(report_data):
+    """Generate PDF for a single report."""
+    
+    return get_renderer().write_pdf(report_data)
+
+def create_html_report(report_data):
+    """Create HTML content for the report."""
+    
+    return get_renderer().render_html(report_data)
+
+def parse_json_list(value):
+    """jsonb columns arrive decoded from psycopg2, text columns as JSON strings."""
+    
+    if not value:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
+
+def report_context(report_data):
+    """Template variables for a lesson_reports row."""
+    
+    report_id, user_id, week_start, week_end, tasks_solved, accuracy, topics_covered, weak_topics = report_data
+    
+    # Parse JSON fields
+    topics_covered = parse_json_list(topics_covered)
+    weak_topics = parse_json_list(weak_topics)
+    
+    return {
+        "week_start": week_start,
+        "week_end": week_end,
+        "tasks_solved": tasks_solved,
+        "accuracy_percent": round((accuracy or 0) * 100, 1),
+        "topics_count": len(topics_covered),
+        "topics_covered": topics_covered,
+        "weak_topics": weak_topics,
+        "generated_at": datetime.now().strftime("%d.%m.%Y %H:%M")
+    }
+
 
 def get_pdf_styles():
     """Get CSS styles for PDF generation."""
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Shared instrumentation for the Python jobs.
+Timed stages and counters for the current run, an optional --profile flag
+(cProfile or pyinstrument) and a Prometheus text-format metrics file per
+job, written for node-exporter's textfile collector so Grafana can chart
+job durations, stage times and counts across runs.
+
+Metrics go to METRICS_TEXTFILE_DIR (default ./metrics) as
+academgrad_job_<job>.prom; profiles to PROFILE_DIR (default ./profiles).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+class RunMetrics:
+    """Stage times and counters collected during one job run."""
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.time()
+        self.started_perf = time.perf_counter()
+        # stage -> [calls, seconds]
+        self.stages = {}
+        self.counters = {}
+        self.failed = False
+
+    def add_stage(self, name, seconds, calls=1):
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stage[0] += calls
+        stage[1] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def duration(self):
+        return time.perf_counter() - self.started_perf
+
+    def to_prometheus(self, success):
+        """The run as Prometheus text exposition format."""
+
+        job = _label_value(self.job)
+        lines = [
+            "# HELP academgrad_job_duration_seconds Wall time of the job's last run.",
+            "# TYPE academgrad_job_duration_seconds gauge",
+            f'academgrad_job_duration_seconds{{job="{job}"}} {self.duration():.6f}',
+            "# HELP academgrad_job_last_run_timestamp_seconds Unix time the job's last run started.",
+            "# TYPE academgrad_job_last_run_timestamp_seconds gauge",
+            f'academgrad_job_last_run_timestamp_seconds{{job="{job}"}} {self.started:.3f}',
+            "# HELP academgrad_job_success Whether the job's last run succeeded (1) or failed (0).",
+            "# TYPE academgrad_job_success gauge",
+            f'academgrad_job_success{{job="{job}"}} {1 if success else 0}',
+            "# HELP academgrad_job_stage_seconds Time spent in each stage during the last run.",
+            "# TYPE academgrad_job_stage_seconds gauge"
+        ]
+        for name, (calls, seconds) in sorted(self.stages.items()):
+            lines.append(f'academgrad_job_stage_seconds{{job="{job}",stage="{_label_value(name)}"}} {seconds:.6f}')
+        lines += [
+            "# HELP academgrad_job_stage_calls Times each stage ran during the last run.",
+            "# TYPE academgrad_job_stage_calls gauge"
+        ]
+        for name, (calls, seconds) in sorted(self.stages.items()):
+            lines.append(f'academgrad_job_stage_calls{{job="{job}",stage="{_label_value(name)}"}} {calls}')
+        lines += [
+            "# HELP academgrad_job_items Items counted during the last run.",
+            "# TYPE academgrad_job_items gauge"
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'academgrad_job_items{{job="{job}",counter="{_label_value(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Print stage times and counters."""
+
+        total = self.duration()
+        print(f"\n{'stage':<24} {'calls':>7} {'seconds':>9} {'share':>6}")
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True):
+            print(f"{name:<24} {calls:>7} {seconds:>9.2f} {seconds / total if total else 0:>6.0%}")
+        print(f"{'total':<24} {'':>7} {total:>9.2f}")
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value}")
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Run of this process; stages and counts outside instrumented_run() go to a throwaway run
+_run = RunMetrics("unnamed")
+
+@contextmanager
+def stage(name):
+    """Time the block as one call of stage ``name``."""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _run.add_stage(name, time.perf_counter() - started)
+
+def record_stage(name, seconds, calls=1):
+    """Add time measured elsewhere (e.g. in worker processes) to stage ``name``."""
+
+    _run.add_stage(name, seconds, calls)
+
+def count(name, value=1):
+    """Add ``value`` to counter ``name``."""
+
+    _run.count(name, value)
+
+def mark_failed():
+    """Report the current run as failed even if it returns normally."""
+
+    _run.failed = True
+
+def add_profile_argument(parser):
+    """Add --profile [cprofile|pyinstrument] to an argparse parser."""
+
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="cprofile",
+        choices=PROFILERS,
+        default=None,
+        help="Profile the run with cProfile (default) or pyinstrument and save the output"
+    )
+
+def write_metrics(run, success, directory=None):
+    """Atomically replace the job's .prom file so the collector never reads a partial file."""
+
+    directory = directory or os.getenv("METRICS_TEXTFILE_DIR", "./metrics")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"academgrad_job_{run.job}.prom")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(run.to_prometheus(success))
+    os.replace(temp_path, path)
+    return path
+
+@contextmanager
+def _profiler(mode, job):
+    if not mode:
+        yield
+        return
+
+    directory = os.getenv("PROFILE_DIR", "./profiles")
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+
+    if mode == "pyinstrument":
+        # Optional dependency, only needed for this profiler
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = os.path.join(directory, f"{job}-{stamp}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            print(profiler.output_text(unicode=True, color=False))
+            print(f"Saved pyinstrument profile to {path}")
+        return
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(directory, f"{job}-{stamp}.prof")
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+        print(f"Saved cProfile stats to {path} (open with snakeviz or pstats)")
+
+@contextmanager
+def instrumented_run(job, profile=None):
+    """
+    Collect stages and counters for the block as job ``job``, profile it when
+    asked and write the metrics file afterwards. A SystemExit with a non-zero
+    code, any other exception or mark_failed() marks the run as failed.
+    """
+
+    global _run
+    run = _run = RunMetrics(job)
+    success = False
+    try:
+        with _profiler(profile, job):
+            yield run
+        success = not run.failed
+    except SystemExit as e:
+        success = e.code in (None, 0) and not run.failed
+        raise
+    finally:
+        run.summary()
+        try:
+            print(f"Wrote metrics to {write_metrics(run, success)}")
+        except OSError as e:
+            print(f"Could not write metrics: {e}")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the scheduled Python jobs.
+Runs embed (embed_chunks.py), repetitions (srs_engine.py), schedule
+(spaced_repetition.py), aggregate (aggregate_reports.py) and reports
+(generate_pdf.py) in one process. A job's
+module, and with it WeasyPrint, tiktoken, BeautifulSoup or openai, is
+imported only when that job runs; jobs run together by ``all`` share the
+warm tiktoken encoder and the db pool.
+Prints import (startup) time versus work time for every job.
+Usage: python jobs.py schedule --shards 4 --balance
+       python jobs.py all --schedule-args "--shards 4 --balance" --reports-args "--batch"
+"""
+
+import argparse
+import importlib
+import shlex
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+# Job name -> module providing main(argv)
+JOBS = {
+    "embed": "embed_chunks",
+    "repetitions": "srs_engine",
+    "schedule": "spaced_repetition",
+    "aggregate": "aggregate_reports",
+    "reports": "generate_pdf"
+}
+
+def parse_args(argv=None):
+    """Parse command line arguments; unknown ones are passed to the job."""
+
+    parser = argparse.ArgumentParser(
+        description="Run the scheduled Python jobs",
+        allow_abbrev=False
+    )
+    parser.add_argument("job", choices=list(JOBS) + ["all"])
+    parser.add_argument(
+        "--repetitions-args",
+        type=str,
+        default="",
+        help="Arguments for the repetitions job when running all"
+    )
+    parser.add_argument(
+        "--schedule-args",
+        type=str,
+        default="",
+        help="Arguments for the schedule job when running all"
+    )
+    parser.add_argument(
+        "--aggregate-args",
+        type=str,
+        default="",
+        help="Arguments for the aggregate job when running all"
+    )
+    parser.add_argument(
+        "--reports-args",
+        type=str,
+        default="",
+        help="Arguments for the reports job when running all"
+    )
+    args, job_args = parser.parse_known_args(argv)
+
+    if args.job == "all" and job_args:
+        parser.error(f"unrecognized arguments for all: {' '.join(job_args)}")
+    return args, job_args
+
+def run_job(name, job_args):
+    """Import and run one job; returns its timings and exit status."""
+
+    started = time.perf_counter()
+    module = importlib.import_module(JOBS[name])
+    imported = time.perf_counter()
+
+    print(f"=== {name} ({JOBS[name]}.py) ===")
+    try:
+        module.main(job_args)
+        status = 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        print(f"Error running {name}: {e}")
+        status = 1
+
+    return {
+        "job": name,
+        "status": status,
+        "import_seconds": imported - started,
+        "work_seconds": time.perf_counter() - imported
+    }
+
+def print_timings(results, startup_seconds):
+    """Startup (interpreter, shared and per-job imports) versus work time."""
+
+    print(f"\n{'job':<10} {'import s':>9} {'work s':>9}  status")
+    for result in results:
+        status = "ok" if result["status"] == 0 else f"exit {result['status']}"
+        print(f"{result['job']:<10} {result['import_seconds']:>9.2f} {result['work_seconds']:>9.2f}  {status}")
+
+    startup = startup_seconds + sum(result["import_seconds"] for result in results)
+    work = sum(result["work_seconds"] for result in results)
+    total = startup + work
+    print(f"\nStartup {startup:.2f}s ({startup_seconds:.2f}s shared), work {work:.2f}s, "
+          f"startup share {startup / total if total else 0:.0%}")
+
+def main(argv=None):
+    """Main function for the jobs entry point."""
+
+    args, job_args = parse_args(argv)
+    # Imported here so its psycopg2 import counts towards startup time
+    import db
+
+    if args.job == "all":
+        runs = [
+            ("embed", []),
+            # Reviews are scheduled from the task_repetitions this job updates
+            ("repetitions", shlex.split(args.repetitions_args)),
+            ("schedule", shlex.split(args.schedule_args)),
+            # Reports for the last week are aggregated before they are rendered
+            ("aggregate", shlex.split(args.aggregate_args)),
+            ("reports", shlex.split(args.reports_args))
+        ]
+    else:
+        runs = [(args.job, job_args)]
+
+    startup_seconds = time.perf_counter() - STARTED
+    results = []
+    try:
+        for name, run_args in runs:
+            results.append(run_job(name, run_args))
+    finally:
+        db.close_pool()
+
+    print_timings(results, startup_seconds)
+    if any(result["status"] != 0 for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Direct-to-PDF renderer for weekly reports.
+Draws the fixed weekly report layout (header, three stat cards, topic lists)
+with ReportLab instead of laying out HTML/CSS with WeasyPrint. It renders the
+same report_context() fields at a fraction of the time and memory.
+"""
+
+import io
+import os
+from reportlab.lib.colors import HexColor
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+# Fonts with Cyrillic glyphs; REPORT_FONT_PATH / REPORT_FONT_BOLD_PATH override
+FONT_CANDIDATES = {
+    "regular": [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans.ttf",
+        "/Library/Fonts/DejaVuSans.ttf"
+    ],
+    "bold": [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+        "/Library/Fonts/DejaVuSans-Bold.ttf"
+    ]
+}
+
+# Colors from get_pdf_styles()
+PRIMARY = HexColor("#007bff")
+TEXT = HexColor("#333333")
+MUTED = HexColor("#666666")
+CARD = HexColor("#f8f9fa")
+RULE = HexColor("#dee2e6")
+TOPIC = HexColor("#e9ecef")
+WEAK = HexColor("#f8d7da")
+DANGER = HexColor("#dc3545")
+NOTE = HexColor("#fff3cd")
+WARNING = HexColor("#ffc107")
+
+MARGIN = 2 * cm
+
+def find_font(kind):
+    """Path of a DejaVu font of ``kind`` ('regular' or 'bold')."""
+
+    override = os.getenv("REPORT_FONT_BOLD_PATH" if kind == "bold" else "REPORT_FONT_PATH")
+    for path in ([override] if override else []) + FONT_CANDIDATES[kind]:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        f"No DejaVu Sans {kind} font found; install fonts-dejavu-core or set REPORT_FONT_PATH"
+    )
+
+def register_fonts():
+    """Register the report fonts with ReportLab once per process."""
+
+    if "DejaVuSans" not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont("DejaVuSans", find_font("regular")))
+        pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", find_font("bold")))
+
+class DirectReportRenderer:
+    """
+    ReportLab renderer with the ReportRenderer interface.
+
+    ``report_context`` turns a lesson_reports row into template variables
+    (generate_pdf.report_context). Fonts are registered once; every report is
+    drawn on a fresh canvas.
+    """
+
+    def __init__(self, report_context, output_dir="./reports"):
+        self.report_context = report_context
+        self.output_dir = output_dir
+        register_fonts()
+
+    def render_pdf(self, report_data):
+        """Render the report to PDF bytes."""
+
+        buffer = io.BytesIO()
+        self.draw(canvas.Canvas(buffer, pagesize=A4), self.report_context(report_data))
+        return buffer.getvalue()
+
+    def write_pdf(self, report_data, filename=None):
+        """Render the report into ``output_dir`` and return the file path."""
+
+        if filename is None:
+            report_id, user_id, week_start = report_data[0], report_data[1], report_data[2]
+            filename = f"report_{report_id}_{user_id}_{week_start}.pdf"
+        pdf_path = os.path.join(self.output_dir, filename)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(pdf_path, "wb") as f:
+            f.write(self.render_pdf(report_data))
+
+        return pdf_path
+
+    def draw(self, pdf, context):
+        """Draw the report layout of ``context`` on ``pdf`` and save it."""
+
+        width, height = A4
+        content_width = width - 2 * MARGIN
+        pdf.setTitle("Недельный отчет")
+
+        # Header
+        y = height - MARGIN - 0.8 * cm
+        pdf.setFillColor(PRIMARY)
+        pdf.setFont("DejaVuSans-Bold", 22)
+        pdf.drawCentredString(width / 2, y, "Недельный отчет")
+        y -= 0.9 * cm
+        pdf.setFillColor(MUTED)
+        pdf.setFont("DejaVuSans", 13)
+        pdf.drawCentredString(width / 2, y, f"{context['week_start']} - {context['week_end']}")
+        y -= 0.5 * cm
+        pdf.setStrokeColor(PRIMARY)
+        pdf.setLineWidth(2)
+        pdf.line(MARGIN, y, width - MARGIN, y)
+
+        # Stat cards
+        y -= 1 * cm
+        cards = [
+            (str(context["tasks_solved"]), "Задач решено"),
+            (f"{context['accuracy_percent']}%", "Точность"),
+            (str(context["topics_count"]), "Тем изучено")
+        ]
+        card_width, card_height, gap = 4.5 * cm, 3 * cm, (content_width - 3 * 4.5 * cm) / 2
+        for index, (value, label) in enumerate(cards):
+            x = MARGIN + index * (card_width + gap)
+            pdf.setFillColor(CARD)
+            pdf.roundRect(x, y - card_height, card_width, card_height, 8, stroke=0, fill=1)
+            pdf.setFillColor(PRIMARY)
+            pdf.setFont("DejaVuSans-Bold", 24)
+            pdf.drawCentredString(x + card_width / 2, y - 1.5 * cm, value)
+            pdf.setFillColor(MUTED)
+            pdf.setFont("DejaVuSans", 10)
+            pdf.drawCentredString(x + card_width / 2, y - 2.3 * cm, label)
+        y -= card_height + 1.2 * cm
+
+        # Topics
+        y = self.draw_section_title(pdf, y, "Изученные темы")
+        if context["topics_covered"]:
+            y = self.draw_list(pdf, y, context["topics_covered"], TOPIC, PRIMARY)
+        else:
+            pdf.setFillColor(TEXT)
+            pdf.setFont("DejaVuSans", 11)
+            pdf.drawString(MARGIN, y - 0.5 * cm, "В этом периоде темы не изучались")
+            y -= 1 * cm
+
+        # Weak topics
+        if context["weak_topics"]:
+            y -= 0.6 * cm
+            y = self.draw_section_title(pdf, y, "Слабые места")
+            y = self.draw_list(pdf, y, context["weak_topics"], WEAK, DANGER)
+            y = self.ensure_space(pdf, y, 1.6 * cm)
+            pdf.setFillColor(NOTE)
+            pdf.roundRect(MARGIN, y - 1.3 * cm, content_width, 1.1 * cm, 4, stroke=0, fill=1)
+            pdf.setFillColor(WARNING)
+            pdf.rect(MARGIN, y - 1.3 * cm, 4, 1.1 * cm, stroke=0, fill=1)
+            pdf.setFillColor(TEXT)
+            pdf.setFont("DejaVuSans", 11)
+            pdf.drawString(MARGIN + 0.5 * cm, y - 0.9 * cm, "Рекомендуем уделить больше внимания этим темам")
+
+        # Footer
+        pdf.setStrokeColor(RULE)
+        pdf.setLineWidth(1)
+        pdf.line(MARGIN, MARGIN + 0.6 * cm, width - MARGIN, MARGIN + 0.6 * cm)
+        pdf.setFillColor(MUTED)
+        pdf.setFont("DejaVuSans", 9)
+        pdf.drawCentredString(width / 2, MARGIN, f"Отчет сгенерирован {context['generated_at']}")
+
+        pdf.showPage()
+        pdf.save()
+
+    def ensure_space(self, pdf, y, needed):
+        """Start a new page when less than ``needed`` is left above the footer."""
+
+        if y - needed < MARGIN + 1.2 * cm:
+            pdf.showPage()
+            return A4[1] - MARGIN
+        return y
+
+    def draw_section_title(self, pdf, y, title):
+        y = self.ensure_space(pdf, y, 1.5 * cm)
+        pdf.setFillColor(PRIMARY)
+        pdf.setFont("DejaVuSans-Bold", 15)
+        pdf.drawString(MARGIN, y, title)
+        pdf.setStrokeColor(RULE)
+        pdf.setLineWidth(1)
+        pdf.line(MARGIN, y - 0.3 * cm, A4[0] - MARGIN, y - 0.3 * cm)
+        return y - 0.5 * cm
+
+    def draw_list(self, pdf, y, items, background, accent):
+        """Draw list items as shaded rows with a colored left border."""
+
+        row_height = 0.9 * cm
+        for item in items:
+            y = self.ensure_space(pdf, y, row_height + 0.2 * cm)
+            y -= 0.2 * cm
+            pdf.setFillColor(background)
+            pdf.roundRect(MARGIN, y - row_height, A4[0] - 2 * MARGIN, row_height, 4, stroke=0, fill=1)
+            pdf.setFillColor(accent)
+            pdf.rect(MARGIN, y - row_height, 4, row_height, stroke=0, fill=1)
+            pdf.setFillColor(TEXT)
+            pdf.setFont("DejaVuSans", 11)
+            pdf.drawString(MARGIN + 0.5 * cm, y - 0.6 * cm, str(item))
+            y -= row_height
+        return y
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Output sinks for rendered report PDFs.
+Reports are rendered into memory and handed to a sink in batches; the sink
+stores them and returns the URL to save in lesson_reports.pdf_url.
+
+LocalSink writes to a directory (the stand-in for tests and local runs);
+S3Sink uploads to S3 or any S3-compatible store (MinIO, Supabase Storage S3
+endpoint) with concurrent PUTs.
+
+Every sink has a ``location`` naming where its PDFs end up and which base URL
+they are served from; stored URLs are only valid for the same location.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+class LocalSink:
+    """Write PDFs under ``directory``; URLs are ``base_url``/key or the file path."""
+
+    def __init__(self, directory="./reports", base_url=None):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.location = f"local:{os.path.abspath(directory)}|{self.base_url or ''}"
+
+    def url_for(self, key):
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return os.path.join(self.directory, key)
+
+    def put_many(self, items):
+        """Store ``[(key, pdf_bytes)]``; returns ``{key: url}``."""
+
+        urls = {}
+        for key, data in items:
+            path = os.path.join(self.directory, key)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            urls[key] = self.url_for(key)
+        return urls
+
+class S3Sink:
+    """
+    Upload PDFs to an S3 bucket with up to ``max_concurrency`` parallel PUTs.
+
+    URLs are ``public_base_url``/key when given (CDN or public bucket domain),
+    otherwise the endpoint's path-style URL or the AWS virtual-hosted URL.
+    """
+
+    def __init__(self, bucket, prefix="reports/", endpoint_url=None, public_base_url=None,
+                 region=None, max_concurrency=16):
+        # boto3 is only needed when uploading to object storage
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.region = region
+        self.max_concurrency = max_concurrency
+        self.location = f"s3:{endpoint_url or 'aws'}/{bucket}/{prefix}|{self.public_base_url or ''}"
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(max_pool_connections=max_concurrency, retries={"max_attempts": 5, "mode": "standard"})
+        )
+
+    def url_for(self, key):
+        object_key = self.prefix + key
+        if self.public_base_url:
+            return f"{self.public_base_url}/{object_key}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{object_key}"
+        region = self.region or self.client.meta.region_name
+        return f"https://{self.bucket}.s3.{region}.amazonaws.com/{object_key}"
+
+    def put(self, key, data):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            Body=data,
+            ContentType="application/pdf"
+        )
+        return key, self.url_for(key)
+
+    def put_many(self, items):
+        """Upload ``[(key, pdf_bytes)]`` concurrently; returns ``{key: url}``."""
+
+        if not items:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as executor:
+            return dict(executor.map(lambda item: self.put(*item), items))
+
+def create_sink(kind, directory="./reports"):
+    """
+    Build the sink selected by ``kind`` ('local' or 's3'). S3 settings come
+    from REPORTS_S3_BUCKET, REPORTS_S3_PREFIX, S3_ENDPOINT_URL, AWS_REGION and
+    REPORTS_PUBLIC_BASE_URL; credentials from the usual AWS variables.
+    """
+
+    if kind == "s3":
+        bucket = os.getenv("REPORTS_S3_BUCKET")
+        if not bucket:
+            raise ValueError("REPORTS_S3_BUCKET must be set for the s3 sink")
+        return S3Sink(
+            bucket,
+            prefix=os.getenv("REPORTS_S3_PREFIX", "reports/"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            public_base_url=os.getenv("REPORTS_PUBLIC_BASE_URL"),
+            region=os.getenv("AWS_REGION")
+        )
+
+    return LocalSink(directory, base_url=os.getenv("REPORTS_PUBLIC_BASE_URL"))
@@ -2,43 +2,197 @@
 """
 Spaced repetition system for scheduling task reviews.
 Analyzes user performance and schedules tasks for review based on forgetting curve.
+Review dates of solved tasks come from task_repetitions, kept up to date by
+srs_engine.py (run it first).
 """
 
 import os
-import psycopg2
-from datetime import datetime, timedelta
+import argparse
+import heapq
+import math
+import time
+import zlib
+from psycopg2.extras import execute_values
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from weak_topics import update_weak_topics
+import db
+import instrumentation
 import sys
 
 # Load environment variables
 load_dotenv()
 
-def main():
+# Spaced repetition reviews are scheduled once they fall due within this horizon
+REPETITION_HORIZON = timedelta(days=2)
+
+# Row in scheduler_state holding this job's high-water mark
+STATE_JOB_NAME = "spaced_repetition"
+
+# Attempts committed late with a slightly older ts are caught by re-reading this far behind the mark
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# Review queue contents: overdue reviews stay listed this long, longest queue stored per user
+QUEUE_OVERDUE = timedelta(days=7)
+QUEUE_MAX_ENTRIES = 50
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    
+    parser = argparse.ArgumentParser(description="Schedule spaced repetition reviews")
+    parser.add_argument(
+        "--mode",
+        choices=["bulk", "per-user"],
+        default="bulk",
+        help="bulk: set-based queries for all users at once; per-user: legacy per-user queries"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split users by hash into N shards, each scheduled and committed independently (bulk mode)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for sharded scheduling"
+    )
+    parser.add_argument(
+        "--full-sweep",
+        action="store_true",
+        help="Reschedule every active user instead of only users with new attempts or due reviews"
+    )
+    parser.add_argument(
+        "--full-sweep-days",
+        type=int,
+        default=7,
+        help="Force a full sweep when the last one is older than this many days"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Compute schedules without writing recommendations or advancing the watermark"
+    )
+    parser.add_argument(
+        "--rebuild-queues",
+        action="store_true",
+        help="Rebuild the review queue of every user, not only users whose schedule changed"
+    )
+    parser.add_argument(
+        "--balance",
+        action="store_true",
+        help="Spread due reviews over a window under per-user and global daily caps (bulk mode)"
+    )
+    parser.add_argument("--balance-window", type=int, default=3, help="Days a review may be postponed")
+    parser.add_argument("--fuzz-days", type=int, default=1, help="Random +/- days applied to each review")
+    parser.add_argument("--user-daily-cap", type=int, default=15, help="Reviews per user per day")
+    parser.add_argument(
+        "--global-daily-cap",
+        type=int,
+        default=None,
+        help="Reviews per day across all users (unlimited when unset)"
+    )
+    instrumentation.add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main function for spaced repetition scheduling."""
     
+    args = parse_args(argv)
+    with instrumentation.instrumented_run("spaced_repetition", args.profile):
+        run(args)
+
+def run(args):
+    """Fold weak topics, schedule reviews and rebuild queues as selected by ``args``."""
+    
     if not os.getenv("SUPABASE_DB_URL"):
         print("Error: SUPABASE_DB_URL must be set")
         sys.exit(1)
     
+    failed = []
+    
     try:
-        conn = psycopg2.connect(os.getenv("SUPABASE_DB_URL"))
+        conn = db.connect()
         cur = conn.cursor()
         
+        # Fold new attempts into weak-topic counters; committed first so shard workers see them.
+        # A dry run folds inside the transaction rolled back below, leaving the counters and
+        # the fold watermark untouched (shard workers then see the last committed counters).
+        with instrumentation.stage("weak_topics"):
+            update_weak_topics(cur)
+            if not args.dry_run:
+                conn.commit()
+        
+        balance = None
+        if args.balance:
+            balance = {
+                "window_days": args.balance_window,
+                "fuzz_days": args.fuzz_days,
+                "user_cap": args.user_daily_cap,
+                "global_cap": args.global_daily_cap
+            }
+        
         # Generate recommendations for all users
-        schedule_reviews(cur)
+        if args.mode == "bulk":
+            since, run_state = load_watermark(cur, args.full_sweep, args.full_sweep_days)
+            
+            if args.shards > 1:
+                failed = schedule_reviews_sharded(
+                    args.shards, args.workers, since, args.dry_run, balance
+                )
+            else:
+                load = {}
+                timings = {}
+                schedules = schedule_reviews_bulk(
+                    cur, since=since, dry_run=args.dry_run, timings=timings, balance=balance, load=load
+                )
+                for phase, seconds in timings.items():
+                    instrumentation.record_stage(phase, seconds)
+                instrumentation.count("reviews_scheduled", len(schedules))
+                instrumentation.count("users_scheduled", len({row[0] for row in schedules}))
+                if load:
+                    print_load_histogram(load["before"], load["after"])
+            
+            # Leave the mark in place if any shard failed so its users are retried
+            if not failed:
+                save_watermark(cur, run_state)
+        else:
+            with instrumentation.stage("per_user"):
+                schedule_reviews(cur)
+            # Per-user mode does not track changed users
+            args.rebuild_queues = True
+        
+        if args.rebuild_queues and not args.dry_run:
+            with instrumentation.stage("rebuild_queues"):
+                rebuilt = rebuild_review_queues(cur)
+            instrumentation.count("queues_rebuilt", rebuilt)
+            print(f"Rebuilt {rebuilt} review queues")
+        
+        if args.dry_run:
+            conn.rollback()
+            print("Dry run: no recommendations written")
+            return
         
         conn.commit()
+        if failed:
+            print(f"Spaced repetition scheduling finished with {len(failed)} failed shards")
+            sys.exit(1)
         print("Spaced repetition scheduling completed successfully!")
         
     except Exception as e:
         print(f"Error during spaced repetition scheduling: {e}")
+        instrumentation.mark_failed()
         if 'conn' in locals():
             conn.rollback()
     finally:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
+            db.release(conn)
+        db.print_statement_summary()
 
 def schedule_reviews(cur):
     """Schedule reviews for all users based on their performance."""
@@ -61,7 +215,7 @@ def schedule_user_reviews(cur, user_id):
     # Get user's weak topics
     cur.execute("""
         SELECT topic, error_rate, attempts_count
-        FROM weak_topics
+        FROM weak_topics_live
         WHERE user_id = %s
         ORDER BY error_rate DESC
         LIMIT 5
@@ -93,15 +247,7 @@ def schedule_topic_reviews(cur, user_id, topic, error_rate, attempts_count):
     tasks = cur.fetchall()
     
     # Calculate review interval based on error rate
-    base_interval = 1  # 1 day
-    if error_rate > 0.7:
-        interval = base_interval  # Review tomorrow
-    elif error_rate > 0.5:
-        interval = base_interval * 2  # Review in 2 days
-    else:
-        interval = base_interval * 3  # Review in 3 days
-    
-    next_review = datetime.now() + timedelta(days=interval)
+    next_review = datetime.now() + timedelta(days=weak_topic_interval(error_rate))
     
     # Schedule reviews
     for task_id, difficulty in tasks:
@@ -112,7 +258,7 @@ def schedule_topic_reviews(cur, user_id, topic, error_rate, attempts_count):
         """, (user_id, task_id))
         
         if not cur.fetchone():
-            priority = 5 if error_rate > 0.7 else 4 if error_rate > 0.5 else 3
+            priority = weak_topic_priority(error_rate)
             
             cur.execute("""
                 INSERT INTO recommendations (user_id, task_id, reason, priority, next_review)
@@ -120,44 +266,601 @@ def schedule_topic_reviews(cur, user_id, topic, error_rate, attempts_count):
             """, (user_id, task_id, 'weak_topic', priority, next_review))
 
 def schedule_spaced_repetition(cur, user_id):
-    """Schedule spaced repetition for correctly solved tasks."""
+    """Schedule spaced repetition reviews that fall due soon."""
     
-    # Get tasks that were solved correctly but need review
+    # Get reviews srs_engine.py scheduled to fall due soon
     cur.execute("""
-        SELECT a.task_id, a.ts, COUNT(*) as correct_count
-        FROM attempts a
-        WHERE a.user_id = %s 
-        AND a.is_correct = TRUE
-        AND a.ts > NOW() - INTERVAL '30 days'
-        GROUP BY a.task_id, a.ts
-        HAVING COUNT(*) >= 2
-        ORDER BY a.ts DESC
-    """, (user_id,))
+        SELECT tr.task_id, tr.next_review
+        FROM task_repetitions tr
+        WHERE tr.user_id = %s
+        AND tr.next_review <= NOW() + %s
+        ORDER BY tr.next_review
+    """, (user_id, REPETITION_HORIZON))
     
     tasks = cur.fetchall()
     
-    for task_id, last_attempt, correct_count in tasks:
-        # Calculate spaced repetition interval
-        # Base intervals: 1, 3, 7, 14, 30 days
-        intervals = [1, 3, 7, 14, 30]
-        interval_index = min(correct_count - 1, len(intervals) - 1)
-        interval = intervals[interval_index]
+    for task_id, next_review in tasks:
+        # Check if already scheduled
+        cur.execute("""
+            SELECT id FROM recommendations 
+            WHERE user_id = %s AND task_id = %s AND next_review > NOW()
+        """, (user_id, task_id))
         
-        next_review = last_attempt + timedelta(days=interval)
+        if not cur.fetchone():
+            cur.execute("""
+                INSERT INTO recommendations (user_id, task_id, reason, priority, next_review)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (user_id, task_id, 'spaced_repetition', 2, next_review))
+
+def weak_topic_interval(error_rate):
+    """Days until a weak-topic task should be reviewed."""
+    
+    base_interval = 1  # 1 day
+    if error_rate > 0.7:
+        return base_interval  # Review tomorrow
+    elif error_rate > 0.5:
+        return base_interval * 2  # Review in 2 days
+    return base_interval * 3  # Review in 3 days
+
+def weak_topic_priority(error_rate):
+    """Recommendation priority (1-5) of a weak-topic task."""
+    
+    return 5 if error_rate > 0.7 else 4 if error_rate > 0.5 else 3
+
+def load_watermark(cur, full_sweep=False, full_sweep_days=7):
+    """
+    Decide whether this run is incremental.
+    
+    Returns ``(since, run_state)``: ``since`` is None for a full sweep, or the
+    bounds used to pick users with new attempts or reviews that came due since
+    the previous run; ``run_state`` is what :func:`save_watermark` persists.
+    """
+    
+    cur.execute("SELECT NOW(), (SELECT MAX(ts) FROM attempts)")
+    now, max_attempt_ts = cur.fetchone()
+    
+    cur.execute("""
+        SELECT high_water_mark, last_run_at, last_full_sweep
+        FROM scheduler_state
+        WHERE job_name = %s
+    """, (STATE_JOB_NAME,))
+    state = cur.fetchone()
+    
+    since = None
+    if state and not full_sweep:
+        high_water_mark, last_run_at, last_full_sweep = state
+        sweep_due = last_full_sweep is None or last_full_sweep < now - timedelta(days=full_sweep_days)
+        if high_water_mark is not None and last_run_at is not None and not sweep_due:
+            since = {
+                "attempts_after": high_water_mark - WATERMARK_OVERLAP,
+                "due_after": last_run_at
+            }
+    
+    if since is None:
+        print("Running full sweep over all active users")
+    else:
+        print(f"Running incremental pass for attempts after {since['attempts_after']} "
+              f"and reviews due after {since['due_after']}")
+    
+    run_state = {
+        "high_water_mark": max_attempt_ts or (state[0] if state else None),
+        "run_at": now,
+        "full_sweep": since is None
+    }
+    return since, run_state
+
+def save_watermark(cur, run_state):
+    """Persist the high-water mark reached by a successful run."""
+    
+    cur.execute("""
+        INSERT INTO scheduler_state (job_name, high_water_mark, last_run_at, last_full_sweep, updated_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON CONFLICT (job_name) DO UPDATE SET
+            high_water_mark = EXCLUDED.high_water_mark,
+            last_run_at = EXCLUDED.last_run_at,
+            last_full_sweep = COALESCE(EXCLUDED.last_full_sweep, scheduler_state.last_full_sweep),
+            updated_at = NOW()
+    """, (
+        STATE_JOB_NAME,
+        run_state["high_water_mark"],
+        run_state["run_at"],
+        run_state["run_at"] if run_state["full_sweep"] else None
+    ))
+
+def user_scope_clause(column, shard=None, since=None):
+    """
+    SQL condition restricting ``column`` (a user id) to the users of this run.
+    
+    ``shard`` is a ``(index, count)`` tuple selecting one hash shard; ``since``
+    (from :func:`load_watermark`) limits an incremental run to users with new
+    attempts, reviews that came due or task_repetitions reviews that entered
+    the horizon since the previous run.
+    """
+    
+    conditions = []
+    params = {}
+    
+    if shard is not None:
+        index, count = shard
+        conditions.append(f"mod(hashtext({column}::text)::bigint + 2147483648, %(shard_count)s) = %(shard_index)s")
+        params.update({"shard_index": index, "shard_count": count})
+    
+    if since is not None:
+        conditions.append(f"""{column} IN (
+            SELECT user_id FROM attempts WHERE ts > %(attempts_after)s
+            UNION
+            SELECT user_id FROM recommendations
+            WHERE next_review > %(due_after)s AND next_review <= NOW()
+            UNION
+            SELECT user_id FROM task_repetitions
+            WHERE next_review > %(due_after)s + %(repetition_horizon)s
+            AND next_review <= NOW() + %(repetition_horizon)s
+        )""")
+        params.update(since)
+        params["repetition_horizon"] = REPETITION_HORIZON
+    
+    return " AND ".join(conditions) or "TRUE", params
+
+def schedule_reviews_bulk(cur, shard=None, since=None, dry_run=False, timings=None, balance=None, load=None):
+    """
+    Schedule reviews for all active users with a few set-based queries.
+    
+    Weak topics with their candidate tasks, repeatedly solved tasks and
+    already scheduled recommendations are loaded once for everyone (or for
+    one hash shard of users, or only users changed since the watermark),
+    schedules are computed in memory and written with a single bulk upsert.
+    With ``dry_run`` nothing is written. Seconds spent per phase are added
+    to the ``timings`` dict when one is given.
+    
+    ``balance`` holds :func:`balance_schedules` options; the daily load
+    before and after balancing is then stored in the ``load`` dict.
+    """
+    
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    
+    cur.execute("SELECT NOW()")
+    (now,) = cur.fetchone()
+    
+    weak_rows = fetch_weak_topic_tasks(cur, shard, since)
+    started = record_phase(timings, "fetch_weak_topics", started)
+    repetition_rows = fetch_repetition_candidates(cur, shard, since)
+    started = record_phase(timings, "fetch_repetitions", started)
+    scheduled = fetch_scheduled_reviews(cur, shard, since)
+    started = record_phase(timings, "fetch_scheduled", started)
+    
+    schedules = compute_schedules(now, weak_rows, repetition_rows, scheduled)
+    started = record_phase(timings, "compute", started)
+    
+    if balance is not None:
+        user_load, global_load = fetch_pending_load(cur, shard, since)
+        global_cap = balance.get("global_cap")
+        if shard is not None and global_cap is not None:
+            # Each shard gets its share of the global capacity and pending load
+            global_cap = math.ceil(global_cap / shard[1])
+            global_load = {day: math.ceil(count / shard[1]) for day, count in global_load.items()}
         
+        before = daily_load(schedules)
+        schedules = balance_schedules(
+            schedules, now,
+            window_days=balance.get("window_days", 3),
+            fuzz_days=balance.get("fuzz_days", 1),
+            user_cap=balance.get("user_cap"),
+            global_cap=global_cap,
+            user_load=user_load,
+            global_load=global_load
+        )
+        if load is not None:
+            load["before"] = before
+            load["after"] = daily_load(schedules)
+        started = record_phase(timings, "balance", started)
+    changed_users = [] if dry_run else write_schedules(cur, schedules)
+    written = len(changed_users)
+    started = record_phase(timings, "write", started)
+    
+    # Only users whose recommendations changed get their queue rebuilt
+    if not dry_run:
+        rebuild_review_queues(cur, changed_users)
+    record_phase(timings, "queues", started)
+    
+    users = {row[0] for row in schedules}
+    label = f"Shard {shard[0]}/{shard[1]}: " if shard else ""
+    action = f"Computed {len(schedules)}" if dry_run else f"Scheduled {written}"
+    print(f"{label}{action} reviews for {len(users)} users "
+          f"({len(scheduled)} reviews already pending)")
+    return schedules
+
+def record_phase(timings, phase, started):
+    """Add the seconds since ``started`` to ``timings[phase]``; returns the new start."""
+    
+    now = time.perf_counter()
+    timings[phase] = timings.get(phase, 0.0) + now - started
+    return now
+
+def _init_shard_worker():
+    """Open the connection pool of a shard worker process."""
+    
+    db.get_pool(maxconn=2)
+
+def run_shard(shard_index, shard_count, since=None, dry_run=False, balance=None):
+    """
+    Schedule and commit one shard; failures roll back only this shard.
+    Transient connection errors retry the shard from scratch.
+    """
+    
+    started = time.perf_counter()
+    timings = {}
+    load = {}
+    
+    def schedule_shard():
+        # A retried attempt starts over on a fresh connection
+        timings.clear()
+        load.clear()
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                schedules = schedule_reviews_bulk(
+                    cur, (shard_index, shard_count), since, dry_run, timings, balance, load
+                )
+            if not dry_run:
+                conn.commit()
+            return schedules
+    
+    try:
+        schedules = db.retry(schedule_shard)
+        return {
+            "shard": shard_index,
+            "reviews": len(schedules),
+            "users": len({row[0] for row in schedules}),
+            "seconds": time.perf_counter() - started,
+            "timings": timings,
+            "load": load
+        }
+    except Exception as e:
+        return {
+            "shard": shard_index,
+            "error": str(e),
+            "seconds": time.perf_counter() - started
+        }
+
+def schedule_reviews_sharded(shard_count, workers, since=None, dry_run=False, balance=None):
+    """
+    Partition users into ``shard_count`` hash shards and schedule them in a
+    process pool. Each shard commits on its own, so one failing shard does
+    not roll back the others. Returns the list of failed shards.
+    """
+    
+    started = time.perf_counter()
+    results = []
+    
+    with ProcessPoolExecutor(
+        max_workers=min(workers, shard_count),
+        initializer=_init_shard_worker
+    ) as executor:
+        futures = [executor.submit(run_shard, index, shard_count, since, dry_run, balance) for index in range(shard_count)]
+        for future in as_completed(futures):
+            results.append(future.result())
+    
+    results.sort(key=lambda result: result["shard"])
+    failed = [result for result in results if "error" in result]
+    
+    # Shard phases are summed across workers, so they can exceed wall time
+    for result in results:
+        for phase, seconds in result.get("timings", {}).items():
+            instrumentation.record_stage(f"shard_{phase}", seconds)
+        instrumentation.count("reviews_scheduled", result.get("reviews", 0))
+        instrumentation.count("users_scheduled", result.get("users", 0))
+    instrumentation.count("shards_failed", len(failed))
+    
+    print(f"\n{'shard':>5} {'users':>7} {'reviews':>8} {'seconds':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['shard']:>5} {'✗ ' + result['error']}")
+        else:
+            print(f"{result['shard']:>5} {result['users']:>7} {result['reviews']:>8} {result['seconds']:>8.2f}")
+    
+    print(f"\nScheduled {shard_count - len(failed)}/{shard_count} shards "
+          f"in {time.perf_counter() - started:.2f}s")
+    
+    loads = [result["load"] for result in results if result.get("load")]
+    if loads:
+        print_load_histogram(
+            sum((load["before"] for load in loads), Counter()),
+            sum((load["after"] for load in loads), Counter())
+        )
+    return failed
+
+def fetch_weak_topic_tasks(cur, shard=None, since=None):
+    """
+    Up to 3 easiest unsolved tasks for each of the 5 weakest topics of every
+    active user, as (user_id, topic, error_rate, task_id) rows.
+    """
+    
+    scope_condition, params = user_scope_clause("user_id", shard, since)
+    cur.execute("""
+        WITH active_users AS (
+            SELECT DISTINCT user_id
+            FROM attempts
+            WHERE ts > NOW() - INTERVAL '30 days'
+            AND {scope_condition}
+        ),
+        ranked_topics AS (
+            SELECT wt.user_id, wt.topic, wt.error_rate,
+                   ROW_NUMBER() OVER (PARTITION BY wt.user_id ORDER BY wt.error_rate DESC) AS topic_rank
+            FROM weak_topics_live wt
+            JOIN active_users au ON au.user_id = wt.user_id
+        )
+        SELECT rt.user_id, rt.topic, rt.error_rate, candidate.task_id
+        FROM ranked_topics rt
+        CROSS JOIN LATERAL (
+            SELECT t.id AS task_id
+            FROM tasks t
+            LEFT JOIN attempts a ON t.id = a.task_id AND a.user_id = rt.user_id
+            WHERE t.topic = rt.topic
+            AND (a.is_correct = FALSE OR a.id IS NULL)
+            GROUP BY t.id, t.difficulty
+            ORDER BY t.difficulty ASC
+            LIMIT 3
+        ) candidate
+        WHERE rt.topic_rank <= 5
+        ORDER BY rt.user_id, rt.error_rate DESC
+    """.format(scope_condition=scope_condition), params)
+    return cur.fetchall()
+
+def fetch_repetition_candidates(cur, shard=None, since=None):
+    """
+    task_repetitions reviews of active users falling due within the horizon,
+    as (user_id, task_id, next_review) rows.
+    """
+    
+    scope_condition, params = user_scope_clause("tr.user_id", shard, since)
+    params["repetition_horizon"] = REPETITION_HORIZON
+    cur.execute("""
+        SELECT tr.user_id, tr.task_id, tr.next_review
+        FROM task_repetitions tr
+        WHERE tr.next_review <= NOW() + %(repetition_horizon)s
+        AND {scope_condition}
+        AND tr.user_id IN (
+            SELECT DISTINCT user_id FROM attempts WHERE ts > NOW() - INTERVAL '30 days'
+        )
+    """.format(scope_condition=scope_condition), params)
+    return cur.fetchall()
+
+def fetch_scheduled_reviews(cur, shard=None, since=None):
+    """(user_id, task_id) pairs that already have a review pending in the future."""
+    
+    scope_condition, params = user_scope_clause("r.user_id", shard, since)
+    cur.execute("""
+        SELECT r.user_id, r.task_id
+        FROM recommendations r
+        WHERE r.next_review > NOW()
+        AND {scope_condition}
+        AND r.user_id IN (
+            SELECT DISTINCT user_id FROM attempts WHERE ts > NOW() - INTERVAL '30 days'
+        )
+    """.format(scope_condition=scope_condition), params)
+    return set(cur.fetchall())
+
+def compute_schedules(now, weak_rows, repetition_rows, scheduled):
+    """
+    Turn loaded rows into (user_id, task_id, reason, priority, next_review)
+    schedules, skipping tasks that are already scheduled. Weak-topic reviews
+    win over spaced repetition for the same task, as in per-user mode.
+    """
+    
+    schedules = {}
+    
+    for user_id, topic, error_rate, task_id in weak_rows:
+        key = (user_id, task_id)
+        if key in scheduled or key in schedules:
+            continue
+        schedules[key] = (
+            user_id, task_id, 'weak_topic', weak_topic_priority(error_rate),
+            now + timedelta(days=weak_topic_interval(error_rate))
+        )
+    
+    due_horizon = now + REPETITION_HORIZON
+    for user_id, task_id, next_review in repetition_rows:
+        key = (user_id, task_id)
+        if key in scheduled or key in schedules:
+            continue
         # Only schedule if review is due soon
-        if next_review <= datetime.now() + timedelta(days=2):
-            # Check if already scheduled
-            cur.execute("""
-                SELECT id FROM recommendations 
-                WHERE user_id = %s AND task_id = %s AND next_review > NOW()
-            """, (user_id, task_id))
-            
-            if not cur.fetchone():
-                cur.execute("""
-                    INSERT INTO recommendations (user_id, task_id, reason, priority, next_review)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (user_id, task_id, 'spaced_repetition', 2, next_review))
+        if next_review <= due_horizon:
+            schedules[key] = (user_id, task_id, 'spaced_repetition', 2, next_review)
+    
+    return list(schedules.values())
+
+def fetch_pending_load(cur, shard=None, since=None):
+    """
+    Reviews already pending per day, as ``({(user_id, day): count}, {day: count})``.
+    The per-user load covers the users of this run, the global load everyone.
+    """
+    
+    scope_condition, params = user_scope_clause("r.user_id", shard, since)
+    cur.execute("""
+        SELECT r.user_id, (r.next_review AT TIME ZONE 'UTC')::date AS day, COUNT(*)
+        FROM recommendations r
+        WHERE r.next_review > NOW()
+        AND {scope_condition}
+        GROUP BY r.user_id, day
+    """.format(scope_condition=scope_condition), params)
+    user_load = {(user_id, day): count for user_id, day, count in cur.fetchall()}
+    
+    cur.execute("""
+        SELECT (next_review AT TIME ZONE 'UTC')::date AS day, COUNT(*)
+        FROM recommendations
+        WHERE next_review > NOW()
+        GROUP BY day
+    """)
+    global_load = dict(cur.fetchall())
+    
+    return user_load, global_load
+
+def review_day(next_review):
+    """UTC calendar day a review falls on."""
+    
+    return next_review.astimezone(timezone.utc).date()
+
+def daily_load(schedules):
+    """Number of schedules per UTC day."""
+    
+    return Counter(review_day(row[4]) for row in schedules)
+
+def balance_schedules(schedules, now, window_days=3, fuzz_days=1, user_cap=None, global_cap=None,
+                      user_load=None, global_load=None):
+    """
+    Spread schedules over days so no user or day exceeds its cap.
+    
+    Each review is first fuzzed by a stable pseudo-random offset of up to
+    ``fuzz_days`` (never before today) and may then be postponed by up to
+    ``window_days`` past its due day. Days are filled in order from a heap
+    ordered by deadline, then priority, so reviews that cannot wait are
+    placed first; a review is only placed over a cap on its last allowed day.
+    ``user_load`` and ``global_load`` hold reviews already pending per
+    ``(user_id, day)`` and per day.
+    """
+    
+    if not schedules:
+        return schedules
+    
+    today = review_day(now)
+    user_load = Counter(user_load or {})
+    global_load = Counter(global_load or {})
+    
+    opening = {}
+    for index, (user_id, task_id, reason, priority, next_review) in enumerate(schedules):
+        due = review_day(next_review)
+        # Stable per (user, task), so reruns do not reshuffle reviews
+        token = zlib.crc32(f"{user_id}:{task_id}".encode("utf-8"))
+        jitter = token % (2 * fuzz_days + 1) - fuzz_days
+        earliest = max(today, due + timedelta(days=jitter))
+        latest = max(earliest, max(due, today) + timedelta(days=window_days))
+        # The token also interleaves users among equally urgent reviews
+        opening.setdefault(earliest, []).append((latest, -priority, token, index))
+    
+    assigned = [None] * len(schedules)
+    heap = []
+    day = min(opening)
+    
+    while opening or heap:
+        if not heap:
+            day = max(day, min(opening))
+        for item in opening.pop(day, []):
+            heapq.heappush(heap, item)
+        
+        deferred = []
+        while heap and (global_cap is None or global_load[day] < global_cap):
+            item = heapq.heappop(heap)
+            latest, index = item[0], item[-1]
+            user_id = schedules[index][0]
+            if user_cap is not None and user_load[(user_id, day)] >= user_cap and latest > day:
+                deferred.append(item)
+                continue
+            assigned[index] = day
+            user_load[(user_id, day)] += 1
+            global_load[day] += 1
+        
+        # Day is full: only reviews at their deadline still go in
+        while heap and heap[0][0] <= day:
+            index = heapq.heappop(heap)[-1]
+            assigned[index] = day
+            user_load[(schedules[index][0], day)] += 1
+            global_load[day] += 1
+        
+        for item in deferred:
+            heapq.heappush(heap, item)
+        day += timedelta(days=1)
+    
+    balanced = []
+    for (user_id, task_id, reason, priority, next_review), day in zip(schedules, assigned):
+        shift = day - review_day(next_review)
+        balanced.append((user_id, task_id, reason, priority, next_review + shift))
+    return balanced
+
+def print_load_histogram(before, after, width=40):
+    """Print reviews per day before and after balancing as a text histogram."""
+    
+    days = sorted(set(before) | set(after))
+    if not days:
+        return
+    
+    peak = max(max(before.values(), default=0), max(after.values(), default=0)) or 1
+    print(f"\n{'day':<10} {'before':>7} {'after':>7}")
+    for day in days:
+        bar = "#" * round(after[day] * width / peak)
+        print(f"{day.isoformat():<10} {before[day]:>7} {after[day]:>7}  {bar}")
+    print(f"Peak day load: {max(before.values(), default=0)} -> {max(after.values(), default=0)}")
+
+def write_schedules(cur, schedules):
+    """
+    Upsert schedules in one bulk statement; pending future reviews are left
+    untouched. Returns the user id of every row actually written.
+    """
+    
+    if not schedules:
+        return []
+    
+    rows = execute_values(cur, """
+        INSERT INTO recommendations (user_id, task_id, reason, priority, next_review)
+        VALUES %s
+        ON CONFLICT (user_id, task_id) DO UPDATE SET
+            reason = EXCLUDED.reason,
+            priority = EXCLUDED.priority,
+            next_review = EXCLUDED.next_review
+        WHERE recommendations.next_review <= NOW()
+        RETURNING user_id
+    """, schedules, page_size=len(schedules), fetch=True)
+    
+    return [user_id for (user_id,) in rows]
+
+def rebuild_review_queues(cur, user_ids=None):
+    """
+    Rebuild the review_queues rows of ``user_ids`` (every user with
+    recommendations when None) from their pending and recently overdue
+    recommendations, ordered by due date and priority. Returns the number of
+    queues written.
+    """
+    
+    if user_ids is None:
+        users_source = "SELECT DISTINCT user_id FROM recommendations"
+        params = {}
+    else:
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return 0
+        users_source = "SELECT unnest(%(user_ids)s::uuid[])"
+        params = {"user_ids": user_ids}
+    
+    params.update({"overdue": QUEUE_OVERDUE, "max_entries": QUEUE_MAX_ENTRIES})
+    cur.execute("""
+        INSERT INTO review_queues (user_id, queue, queue_length, next_due, built_at)
+        SELECT u.user_id,
+               COALESCE(jsonb_agg(jsonb_build_object(
+                   'task_id', q.task_id,
+                   'reason', q.reason,
+                   'priority', q.priority,
+                   'next_review', q.next_review
+               ) ORDER BY q.next_review, q.priority DESC) FILTER (WHERE q.task_id IS NOT NULL), '[]'::jsonb),
+               COUNT(q.task_id),
+               MIN(q.next_review),
+               NOW()
+        FROM ({users_source}) AS u(user_id)
+        LEFT JOIN LATERAL (
+            SELECT r.task_id, r.reason, r.priority, r.next_review
+            FROM recommendations r
+            WHERE r.user_id = u.user_id
+            AND r.next_review > NOW() - %(overdue)s
+            ORDER BY r.next_review, r.priority DESC
+            LIMIT %(max_entries)s
+        ) q ON TRUE
+        GROUP BY u.user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            queue = EXCLUDED.queue,
+            queue_length = EXCLUDED.queue_length,
+            next_due = EXCLUDED.next_due,
+            built_at = EXCLUDED.built_at
+    """.format(users_source=users_source), params)
+    
+    return cur.rowcount
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Vectorized SM-2 / FSRS scheduling engine for task_repetitions.
+Replays attempts for millions of (user, task) pairs at once with NumPy arrays
+and writes easiness factor, interval and next_review back in bulk.
+
+SM-2 reproduces calculate_sm2_schedule from 20240718_spaced_repetition.sql
+(use --validate to compare against the SQL function). FSRS keeps its memory
+state in task_repetitions.stability / difficulty.
+
+This job is the only writer of task_repetitions (attempt_repetition_trigger is
+dropped in 20240727_attempt_watermarks.sql). Each run applies the attempts
+committed since the previous one, tracked by inserting transaction in
+scheduler_state, so spaced_repetition.py can schedule from next_review.
+"""
+
+import os
+import argparse
+from psycopg2.extras import execute_values
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import numpy as np
+import db
+import instrumentation
+import sys
+
+# Load environment variables
+load_dotenv()
+
+SECONDS_PER_DAY = 86400.0
+
+# Row in scheduler_state holding the attempts already applied
+STATE_JOB_NAME = "srs_engine"
+
+# SM-2 defaults, as in task_repetitions column defaults
+DEFAULT_EASINESS = 2.5
+MIN_EASINESS = 1.3
+
+# FSRS-4.5 default parameters
+FSRS_WEIGHTS = np.array([
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755
+])
+FSRS_DECAY = -0.5
+FSRS_FACTOR = 19.0 / 81.0
+FSRS_MAX_INTERVAL = 36500
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Batch SM-2/FSRS scheduling for task_repetitions")
+    parser.add_argument("--algorithm", choices=["sm2", "fsrs"], default="sm2")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Replay every attempt from scratch instead of only attempts committed since the last run"
+    )
+    parser.add_argument(
+        "--retention",
+        type=float,
+        default=0.9,
+        help="FSRS desired retention used to turn stability into an interval"
+    )
+    parser.add_argument("--validate", action="store_true", help="Compare SM-2 against calculate_sm2_schedule and exit")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Compute schedules without writing them or advancing the watermark"
+    )
+    instrumentation.add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main function for batch repetition scheduling."""
+
+    args = parse_args(argv)
+    with instrumentation.instrumented_run("srs_engine", args.profile):
+        run(args)
+
+def run(args):
+    """Validate the SM-2 port or apply new attempts to task_repetitions, as selected by ``args``."""
+
+    if not os.getenv("SUPABASE_DB_URL"):
+        print("Error: SUPABASE_DB_URL must be set")
+        sys.exit(1)
+
+    try:
+        conn = db.connect()
+        cur = conn.cursor()
+
+        if args.validate:
+            mismatches = validate_against_sql(cur)
+            sys.exit(1 if mismatches else 0)
+
+        update_repetitions(conn, cur, args.algorithm, args.retention, args.rebuild, args.dry_run)
+
+        if args.dry_run:
+            conn.rollback()
+            print("Dry run: task_repetitions left unchanged")
+            return
+
+        conn.commit()
+
+    except Exception as e:
+        print(f"Error during batch repetition scheduling: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        sys.exit(1)
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db.release(conn)
+        db.print_statement_summary()
+
+def update_repetitions(conn, cur, algorithm="sm2", retention=0.9, rebuild=False, dry_run=False):
+    """
+    Apply the attempts committed since the last run to task_repetitions in
+    the current transaction and advance the watermark.
+
+    The scheduler_state row stays locked until the caller commits, so
+    concurrent runs cannot apply the same attempts twice. Without a previous
+    mark (or with ``rebuild``) every attempt is replayed from default states.
+    With ``dry_run`` nothing is written. Returns the number of pairs updated.
+    """
+
+    after, until = db.lock_xid_watermark(cur, STATE_JOB_NAME)
+    rebuild = rebuild or after is None
+    if rebuild:
+        print("Replaying all attempts from default states")
+
+    with instrumentation.stage("load"):
+        pairs, reviews = load_reviews(conn, after, until, rebuild)
+    instrumentation.count("attempts_replayed", len(reviews["pair"]))
+
+    if not len(pairs["user_id"]):
+        print("No new attempts to schedule")
+    else:
+        with instrumentation.stage("replay"):
+            state = replay(pairs, reviews, algorithm, retention)
+        if not dry_run:
+            with instrumentation.stage("write"):
+                write_repetitions(cur, pairs, state)
+        print(f"Replayed {len(reviews['pair'])} attempts for {len(pairs['user_id'])} pairs with {algorithm}")
+
+    if not dry_run:
+        db.save_xid_watermark(cur, STATE_JOB_NAME, until)
+
+    instrumentation.count("pairs_updated", len(pairs["user_id"]))
+    return len(pairs["user_id"])
+
+def attempt_quality(is_correct, time_spent_s):
+    """
+    Map attempts to 0-5 quality scores like handle_attempt_repetition():
+    correct in <=30s is 5, <=60s is 4, otherwise 3; incorrect is 1.
+    ``time_spent_s`` uses NaN for unknown durations.
+    """
+
+    quality = np.where(time_spent_s <= 30, 5, np.where(time_spent_s <= 60, 4, 3))
+    return np.where(is_correct, quality, 1).astype(np.int32)
+
+def sm2_batch(easiness, interval, repetitions, quality):
+    """
+    Apply one SM-2 review to arrays of states; mirrors calculate_sm2_schedule.
+    Easiness is returned as float32 like the SQL ``real`` columns.
+    """
+
+    # Postgres evaluates real +/- numeric in double precision, then stores real
+    easiness = easiness.astype(np.float32).astype(np.float64)
+    q = quality.astype(np.float64)
+    failed = quality < 3
+
+    ef_failed = easiness - 0.8 + 0.28 * q - 0.02 * q * q
+    ef_passed = easiness + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+    new_easiness = np.maximum(
+        np.float32(MIN_EASINESS), np.where(failed, ef_failed, ef_passed).astype(np.float32)
+    )
+
+    new_repetitions = np.where(failed, 0, repetitions + 1)
+    # int * real is computed as real; round() rounds halves away from zero
+    product = interval.astype(np.float32) * new_easiness
+    grown = np.floor(product.astype(np.float64) + 0.5).astype(np.int64)
+    new_interval = np.where(
+        failed | (new_repetitions == 1), 1,
+        np.where(new_repetitions == 2, 6, grown)
+    )
+
+    return new_easiness, new_interval.astype(np.int64), new_repetitions.astype(np.int64)
+
+def fsrs_grade(quality):
+    """Map 0-5 quality to FSRS grades: 1 again, 2 hard, 3 good, 4 easy."""
+
+    return np.where(quality < 3, 1, np.where(quality == 3, 2, np.where(quality == 4, 3, 4)))
+
+def fsrs_batch(stability, difficulty, elapsed_days, grade, retention=0.9):
+    """
+    Apply one FSRS-4.5 review to arrays of memory states.
+    NaN stability marks a first review. Returns (stability, difficulty, interval_days).
+    """
+
+    w = FSRS_WEIGHTS
+    g = grade.astype(np.float64)
+    first = np.isnan(stability)
+
+    init_stability = w[grade - 1]
+    init_difficulty = np.clip(w[4] - (g - 3) * w[5], 1, 10)
+
+    s = np.where(first, 1.0, stability)
+    d = np.where(first, 5.0, difficulty)
+    t = np.maximum(np.nan_to_num(elapsed_days), 0)
+    retrievability = np.power(1 + FSRS_FACTOR * t / s, FSRS_DECAY)
+
+    mean_reverted = w[7] * w[4] + (1 - w[7]) * (d - w[6] * (g - 3))
+    next_difficulty = np.clip(mean_reverted, 1, 10)
+
+    hard_penalty = np.where(grade == 2, w[15], 1.0)
+    easy_bonus = np.where(grade == 4, w[16], 1.0)
+    recall_stability = s * (
+        np.exp(w[8]) * (11 - d) * np.power(s, -w[9])
+        * (np.exp(w[10] * (1 - retrievability)) - 1) * hard_penalty * easy_bonus + 1
+    )
+    forget_stability = (
+        w[11] * np.power(d, -w[12]) * (np.power(s + 1, w[13]) - 1)
+        * np.exp(w[14] * (1 - retrievability))
+    )
+
+    new_stability = np.where(first, init_stability, np.where(grade == 1, forget_stability, recall_stability))
+    new_difficulty = np.where(first, init_difficulty, next_difficulty)
+
+    interval = new_stability / FSRS_FACTOR * (np.power(retention, 1 / FSRS_DECAY) - 1)
+    interval = np.clip(np.floor(interval + 0.5), 1, FSRS_MAX_INTERVAL).astype(np.int64)
+
+    return new_stability, new_difficulty, interval
+
+def load_reviews(conn, after, until, rebuild=False):
+    """
+    Stream attempts that still have to be applied, ordered by (user, task, ts),
+    into column arrays: attempts inserted by transactions in ``[after, until)``
+    (see db.lock_xid_watermark), or with ``rebuild`` every attempt below
+    ``until``, including attempts from before inserted_xid was recorded.
+
+    Returns ``(pairs, reviews)``: per (user, task) pair its starting state from
+    task_repetitions (defaults for new pairs or with ``rebuild``), and per
+    attempt its pair index, timestamp and quality.
+    """
+
+    pairs = {key: [] for key in (
+        "user_id", "task_id", "easiness", "interval", "repetitions",
+        "stability", "difficulty", "last_reviewed"
+    )}
+    pair_index, review_ts, is_correct, time_spent = [], [], [], []
+
+    # Server-side cursor so millions of attempts are not fetched at once
+    with conn.cursor(name="srs_engine_attempts") as cur:
+        cur.itersize = 50000
+        cur.execute("""
+            SELECT a.user_id, a.task_id, a.ts, a.is_correct, a.time_spent_s,
+                   tr.easiness_factor, tr.interval_days, tr.repetition_count,
+                   tr.stability, tr.difficulty, tr.last_reviewed
+            FROM attempts a
+            LEFT JOIN task_repetitions tr ON tr.user_id = a.user_id AND tr.task_id = a.task_id
+            WHERE (%(rebuild)s AND a.inserted_xid IS NULL)
+               OR (a.inserted_xid < %(until)s::xid8 AND (%(rebuild)s OR a.inserted_xid >= %(after)s::xid8))
+            ORDER BY a.user_id, a.task_id, a.ts
+        """, {"rebuild": rebuild, "after": after, "until": until})
+
+        current = None
+        for (user_id, task_id, ts, correct, spent,
+             easiness, interval, repetitions, stability, difficulty, last_reviewed) in cur:
+            if (user_id, task_id) != current:
+                current = (user_id, task_id)
+                known = not rebuild and easiness is not None
+                pairs["user_id"].append(user_id)
+                pairs["task_id"].append(task_id)
+                pairs["easiness"].append(easiness if known else DEFAULT_EASINESS)
+                pairs["interval"].append(interval if known else 1)
+                pairs["repetitions"].append(repetitions if known else 0)
+                pairs["stability"].append(stability if known and stability is not None else np.nan)
+                pairs["difficulty"].append(difficulty if known and difficulty is not None else np.nan)
+                pairs["last_reviewed"].append(
+                    last_reviewed.timestamp() if known and last_reviewed is not None else np.nan
+                )
+
+            pair_index.append(len(pairs["user_id"]) - 1)
+            review_ts.append(ts.timestamp())
+            is_correct.append(bool(correct))
+            time_spent.append(np.nan if spent is None else spent)
+
+    for key in ("easiness", "stability", "difficulty", "last_reviewed"):
+        pairs[key] = np.array(pairs[key], dtype=np.float64)
+    pairs["easiness"] = pairs["easiness"].astype(np.float32)
+    pairs["interval"] = np.array(pairs["interval"], dtype=np.int64)
+    pairs["repetitions"] = np.array(pairs["repetitions"], dtype=np.int64)
+
+    pair_index = np.array(pair_index, dtype=np.int64)
+    reviews = {
+        "pair": pair_index,
+        "ts": np.array(review_ts, dtype=np.float64),
+        "quality": attempt_quality(np.array(is_correct, dtype=bool), np.array(time_spent, dtype=np.float64)),
+        "rank": review_rank(pair_index)
+    }
+    return pairs, reviews
+
+def review_rank(pair_index):
+    """Position of each attempt within its (sorted, contiguous) pair: 0, 1, 2, ..."""
+
+    if not len(pair_index):
+        return pair_index
+
+    starts = np.r_[0, np.flatnonzero(np.diff(pair_index)) + 1]
+    lengths = np.diff(np.r_[starts, len(pair_index)])
+    return np.arange(len(pair_index)) - np.repeat(starts, lengths)
+
+def replay(pairs, reviews, algorithm="sm2", retention=0.9):
+    """
+    Apply all attempts to their pairs' states.
+
+    Step k applies the k-th pending attempt of every pair that has one, so the
+    number of vectorized steps equals the longest per-pair history, not the
+    number of attempts.
+    """
+
+    state = {
+        "easiness": pairs["easiness"].copy(),
+        "interval": pairs["interval"].copy(),
+        "repetitions": pairs["repetitions"].copy(),
+        "stability": pairs["stability"].copy(),
+        "difficulty": pairs["difficulty"].copy(),
+        "last_reviewed": pairs["last_reviewed"].copy(),
+        "quality": np.zeros(len(pairs["user_id"]), dtype=np.int32)
+    }
+
+    steps = int(reviews["rank"].max()) + 1 if len(reviews["rank"]) else 0
+    for step in range(steps):
+        mask = reviews["rank"] == step
+        idx = reviews["pair"][mask]
+        quality = reviews["quality"][mask]
+        ts = reviews["ts"][mask]
+
+        if algorithm == "sm2":
+            easiness, interval, repetitions = sm2_batch(
+                state["easiness"][idx], state["interval"][idx], state["repetitions"][idx], quality
+            )
+            state["easiness"][idx] = easiness
+            state["repetitions"][idx] = repetitions
+        else:
+            elapsed = (ts - state["last_reviewed"][idx]) / SECONDS_PER_DAY
+            stability, difficulty, interval = fsrs_batch(
+                state["stability"][idx], state["difficulty"][idx], elapsed, fsrs_grade(quality), retention
+            )
+            state["stability"][idx] = stability
+            state["difficulty"][idx] = difficulty
+            state["repetitions"][idx] = np.where(quality < 3, 0, state["repetitions"][idx] + 1)
+
+        state["interval"][idx] = interval
+        state["last_reviewed"][idx] = ts
+        state["quality"][idx] = quality
+
+    state["next_review"] = state["last_reviewed"] + state["interval"] * SECONDS_PER_DAY
+    return state
+
+def write_repetitions(cur, pairs, state, page_size=10000):
+    """Upsert computed states into task_repetitions in bulk."""
+
+    def to_datetime(seconds):
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+    def optional(value):
+        return None if np.isnan(value) else float(value)
+
+    rows = [
+        (
+            pairs["user_id"][i], pairs["task_id"][i],
+            float(state["easiness"][i]), int(state["interval"][i]), int(state["repetitions"][i]),
+            optional(state["stability"][i]), optional(state["difficulty"][i]),
+            to_datetime(state["last_reviewed"][i]), to_datetime(state["next_review"][i]),
+            int(state["quality"][i])
+        )
+        for i in range(len(pairs["user_id"]))
+    ]
+
+    execute_values(cur, """
+        INSERT INTO task_repetitions (
+            user_id, task_id, easiness_factor, interval_days, repetition_count,
+            stability, difficulty, last_reviewed, next_review, quality_score
+        ) VALUES %s
+        ON CONFLICT (user_id, task_id) DO UPDATE SET
+            easiness_factor = EXCLUDED.easiness_factor,
+            interval_days = EXCLUDED.interval_days,
+            repetition_count = EXCLUDED.repetition_count,
+            stability = EXCLUDED.stability,
+            difficulty = EXCLUDED.difficulty,
+            last_reviewed = EXCLUDED.last_reviewed,
+            next_review = EXCLUDED.next_review,
+            quality_score = EXCLUDED.quality_score,
+            updated_at = NOW()
+    """, rows, page_size=page_size)
+
+    return len(rows)
+
+def validate_against_sql(cur, samples=2000, seed=7):
+    """
+    Compare sm2_batch with calculate_sm2_schedule on random inputs in one
+    round-trip. Returns the number of mismatching rows.
+    """
+
+    rng = np.random.default_rng(seed)
+    easiness = rng.uniform(MIN_EASINESS, 3.0, samples).astype(np.float32)
+    interval = rng.integers(1, 200, samples)
+    repetitions = rng.integers(0, 10, samples)
+    quality = rng.integers(0, 6, samples)
+
+    cur.execute("""
+        SELECT r.new_ef, r.new_interval, r.new_repetition_count
+        FROM unnest(%s::real[], %s::int[], %s::int[], %s::int[]) WITH ORDINALITY AS i(ef, iv, rc, q, n)
+        CROSS JOIN LATERAL calculate_sm2_schedule(i.ef, i.iv, i.rc, i.q) r
+        ORDER BY i.n
+    """, (easiness.tolist(), interval.tolist(), repetitions.tolist(), quality.tolist()))
+    expected = np.array(cur.fetchall(), dtype=np.float64)
+
+    new_easiness, new_interval, new_repetitions = sm2_batch(easiness, interval, repetitions, quality)
+
+    mismatched = (
+        ~np.isclose(new_easiness, expected[:, 0], atol=1e-5)
+        | (new_interval != expected[:, 1])
+        | (new_repetitions != expected[:, 2])
+    )
+    count = int(mismatched.sum())
+
+    print(f"SM-2 validation: {samples - count}/{samples} rows match calculate_sm2_schedule")
+    for i in np.flatnonzero(mismatched)[:10]:
+        print(f"  ef={easiness[i]:.4f} interval={interval[i]} reps={repetitions[i]} q={quality[i]}: "
+              f"python=({new_easiness[i]:.4f}, {new_interval[i]}, {new_repetitions[i]}) "
+              f"sql=({expected[i, 0]:.4f}, {int(expected[i, 1])}, {int(expected[i, 2])})")
+    return count
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Tests for review load balancing in spaced_repetition.py.
+Usage: python -m pytest scripts
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from spaced_repetition import balance_schedules, review_day
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+TODAY = NOW.date()
+
+def make_schedules(users, per_user, due=NOW):
+    return [
+        (f"user-{user}", user * 1000 + task, "repetition", 1.0, due)
+        for user in range(users) for task in range(per_user)
+    ]
+
+def loads(balanced):
+    per_user = Counter((row[0], review_day(row[4])) for row in balanced)
+    per_day = Counter(review_day(row[4]) for row in balanced)
+    return per_user, per_day
+
+def test_respects_user_and_global_caps():
+    schedules = make_schedules(users=3, per_user=10)
+    balanced = balance_schedules(schedules, NOW, window_days=5, fuzz_days=0, user_cap=4, global_cap=8)
+
+    per_user, per_day = loads(balanced)
+    assert len(balanced) == len(schedules)
+    assert max(per_user.values()) <= 4
+    assert max(per_day.values()) <= 8
+
+def test_counts_pending_load():
+    schedules = make_schedules(users=2, per_user=3)
+    balanced = balance_schedules(
+        schedules, NOW, window_days=3, fuzz_days=0, user_cap=3, global_cap=5,
+        user_load={("user-0", TODAY): 3}, global_load={TODAY: 4}
+    )
+
+    per_user, per_day = loads(balanced)
+    assert per_user[("user-0", TODAY)] == 0
+    assert per_day[TODAY] == 1
+    assert max(per_user.values()) <= 3
+    assert max(per_day.values()) <= 5
+
+def test_never_moves_reviews_earlier():
+    schedules = [
+        ("user-0", task, "repetition", float(task % 3), NOW + timedelta(days=offset))
+        for task, offset in enumerate([-3, -1, 0, 0, 1, 2, 2, 4, 7] * 4)
+    ]
+    balanced = balance_schedules(schedules, NOW, window_days=3, fuzz_days=0, user_cap=2, global_cap=3)
+
+    for before, after in zip(schedules, balanced):
+        assert review_day(after[4]) >= max(TODAY, review_day(before[4]))
+        assert after[4].time() == before[4].time()
+
+def test_fuzz_stays_within_range_and_after_today():
+    schedules = make_schedules(users=5, per_user=20, due=NOW + timedelta(days=2))
+    balanced = balance_schedules(schedules, NOW, window_days=3, fuzz_days=1)
+
+    for before, after in zip(schedules, balanced):
+        shift = review_day(after[4]) - review_day(before[4])
+        assert timedelta(days=-1) <= shift <= timedelta(days=1)
+        assert review_day(after[4]) >= TODAY
+    assert balance_schedules(schedules, NOW, window_days=3, fuzz_days=1) == balanced
+
+def test_places_over_cap_on_last_allowed_day():
+    schedules = make_schedules(users=1, per_user=3)
+    balanced = balance_schedules(schedules, NOW, window_days=0, fuzz_days=0, global_cap=1)
+
+    assert [review_day(row[4]) for row in balanced] == [TODAY] * 3
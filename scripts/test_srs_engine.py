@@ -0,0 +1,75 @@
+"""
+Tests for the vectorized SM-2/FSRS steps in srs_engine.py.
+SM-2 expectations are worked by hand from calculate_sm2_schedule in
+supabase/migrations/20240718_spaced_repetition.sql.
+Usage: python -m pytest scripts
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from srs_engine import FSRS_WEIGHTS, attempt_quality, fsrs_batch, fsrs_grade, sm2_batch
+
+# (easiness, interval, repetitions, quality) -> (easiness, interval, repetitions)
+SM2_CASES = [
+    # First correct review: ef + 0.1, interval 1
+    ((2.5, 1, 0, 5), (2.6, 1, 1)),
+    # Second review: ef unchanged at quality 4, interval 6
+    ((2.6, 1, 1, 4), (2.6, 6, 2)),
+    # Third review: ef - 0.14 at quality 3, round(6 * 2.46) = 15
+    ((2.6, 6, 2, 3), (2.46, 15, 3)),
+    ((2.5, 10, 3, 5), (2.6, 26, 4)),
+    # Lapse: ef - 0.8 + 0.28q - 0.02q^2, interval and repetitions reset
+    ((2.5, 15, 4, 1), (1.96, 1, 0)),
+    # Easiness never drops below 1.3, on either branch
+    ((1.4, 6, 2, 0), (1.3, 1, 0)),
+    ((1.3, 20, 5, 3), (1.3, 26, 6)),
+]
+
+def test_sm2_batch_matches_sql():
+    inputs = np.array([case[0] for case in SM2_CASES], dtype=np.float64)
+    easiness, interval, repetitions = sm2_batch(
+        inputs[:, 0], inputs[:, 1].astype(np.int64), inputs[:, 2].astype(np.int64),
+        inputs[:, 3].astype(np.int32)
+    )
+
+    for index, (_, expected) in enumerate(SM2_CASES):
+        assert easiness[index] == pytest.approx(expected[0], abs=1e-5)
+        assert interval[index] == expected[1]
+        assert repetitions[index] == expected[2]
+
+def test_attempt_quality_and_grades():
+    quality = attempt_quality(
+        np.array([True, True, True, True, False]),
+        np.array([20.0, 45.0, 300.0, np.nan, 10.0])
+    )
+
+    assert quality.tolist() == [5, 4, 3, 3, 1]
+    assert fsrs_grade(quality).tolist() == [4, 3, 2, 2, 1]
+
+def test_fsrs_first_review():
+    grade = np.array([1, 3, 4])
+    stability, difficulty, interval = fsrs_batch(
+        np.full(3, np.nan), np.full(3, np.nan), np.full(3, np.nan), grade
+    )
+
+    w = FSRS_WEIGHTS
+    assert stability.tolist() == pytest.approx([w[0], w[2], w[3]])
+    assert difficulty.tolist() == pytest.approx([w[4] + 2 * w[5], w[4], w[4] - w[5]])
+    # At 90% retention the interval is the stability in days, at least one day
+    assert interval.tolist() == [1, 4, 14]
+
+def test_fsrs_lapse():
+    stability, difficulty, interval = fsrs_batch(
+        np.array([10.0]), np.array([5.0]), np.array([10.0]), np.array([1])
+    )
+
+    w = FSRS_WEIGHTS
+    # Reviewed after exactly the stability, retrievability is 0.9
+    expected_stability = w[11] * 5 ** -w[12] * (11 ** w[13] - 1) * math.exp(w[14] * 0.1)
+    assert stability[0] == pytest.approx(expected_stability)
+    assert stability[0] < 10
+    assert difficulty[0] == pytest.approx(w[7] * w[4] + (1 - w[7]) * (5 + 2 * w[6]))
+    assert interval[0] == 3
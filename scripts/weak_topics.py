@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Incremental weak-topic aggregation.
+Folds attempts committed since the last run into per-(user, topic, day)
+buckets and running counters, and expires day buckets leaving the 30-day
+window, so weak_topics_live stays fresh without refreshing the materialized
+view. New attempts are found by inserting transaction (see
+db.lock_xid_watermark), so attempts committed late are still folded.
+"""
+
+import os
+import argparse
+from datetime import timedelta
+from dotenv import load_dotenv
+import db
+import sys
+
+# Load environment variables
+load_dotenv()
+
+# Row in scheduler_state holding the fold high-water mark
+STATE_JOB_NAME = "weak_topics"
+
+WINDOW_DAYS = 30
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Fold new attempts into weak-topic counters")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute buckets and counters from all attempts in the window"
+    )
+    return parser.parse_args()
+
+def main():
+    """Main function for weak-topic aggregation."""
+
+    args = parse_args()
+
+    if not os.getenv("SUPABASE_DB_URL"):
+        print("Error: SUPABASE_DB_URL must be set")
+        sys.exit(1)
+
+    try:
+        conn = db.connect()
+        cur = conn.cursor()
+
+        update_weak_topics(cur, rebuild=args.rebuild)
+
+        conn.commit()
+        print("Weak-topic aggregation completed successfully!")
+
+    except Exception as e:
+        print(f"Error during weak-topic aggregation: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        sys.exit(1)
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db.release(conn)
+        db.print_statement_summary()
+
+def update_weak_topics(cur, rebuild=False):
+    """
+    Bring weak_topic_counters up to date in the current transaction.
+
+    The scheduler_state row is locked for the duration, so concurrent runs
+    cannot fold the same attempts twice. Without a previous mark (or with
+    ``rebuild``) the counters are recomputed from the whole window.
+    """
+
+    after, until = db.lock_xid_watermark(cur, STATE_JOB_NAME)
+    cur.execute("SELECT ((NOW() - %s) AT TIME ZONE 'UTC')::date", (timedelta(days=WINDOW_DAYS),))
+    (window_start,) = cur.fetchone()
+
+    if rebuild or after is None:
+        cur.execute("DELETE FROM weak_topic_buckets")
+        cur.execute("DELETE FROM weak_topic_counters")
+        after = None
+        print("Rebuilding weak-topic counters from the full window")
+
+    folded = fold_attempts(cur, after, until, window_start)
+    expired = expire_buckets(cur, window_start)
+
+    db.save_xid_watermark(cur, STATE_JOB_NAME, until)
+
+    print(f"Folded {folded} attempts into weak-topic counters, expired {expired} day buckets")
+    return folded, expired
+
+def fold_attempts(cur, after, until, window_start):
+    """
+    Add attempts inserted by transactions in ``[after, until)`` to their day
+    buckets and counters. When ``after`` is None every attempt below
+    ``until`` is folded, including attempts from before inserted_xid was
+    recorded. Only attempts whose day is in the window count.
+    Returns the number of attempts folded.
+    """
+
+    cur.execute("""
+        WITH delta AS (
+            SELECT a.user_id, t.topic, (a.ts AT TIME ZONE 'UTC')::date AS day,
+                   COUNT(*) AS attempts_count,
+                   COUNT(*) FILTER (WHERE a.is_correct) AS correct_count,
+                   MAX(a.ts) AS last_attempt
+            FROM attempts a
+            JOIN tasks t ON a.task_id = t.id
+            WHERE (
+                CASE WHEN %(after)s::xid8 IS NULL
+                     THEN a.inserted_xid IS NULL OR a.inserted_xid < %(until)s::xid8
+                     ELSE a.inserted_xid >= %(after)s::xid8 AND a.inserted_xid < %(until)s::xid8
+                END
+            )
+            AND (a.ts AT TIME ZONE 'UTC')::date >= %(window_start)s
+            GROUP BY a.user_id, t.topic, day
+        ),
+        buckets AS (
+            INSERT INTO weak_topic_buckets (user_id, topic, day, attempts_count, correct_count, last_attempt)
+            SELECT user_id, topic, day, attempts_count, correct_count, last_attempt
+            FROM delta
+            ON CONFLICT (user_id, topic, day) DO UPDATE SET
+                attempts_count = weak_topic_buckets.attempts_count + EXCLUDED.attempts_count,
+                correct_count = weak_topic_buckets.correct_count + EXCLUDED.correct_count,
+                last_attempt = GREATEST(weak_topic_buckets.last_attempt, EXCLUDED.last_attempt)
+        ),
+        counters AS (
+            INSERT INTO weak_topic_counters (user_id, topic, attempts_count, correct_count, last_attempt)
+            SELECT user_id, topic, SUM(attempts_count), SUM(correct_count), MAX(last_attempt)
+            FROM delta
+            GROUP BY user_id, topic
+            ON CONFLICT (user_id, topic) DO UPDATE SET
+                attempts_count = weak_topic_counters.attempts_count + EXCLUDED.attempts_count,
+                correct_count = weak_topic_counters.correct_count + EXCLUDED.correct_count,
+                last_attempt = GREATEST(weak_topic_counters.last_attempt, EXCLUDED.last_attempt),
+                updated_at = NOW()
+        )
+        SELECT COALESCE(SUM(attempts_count), 0) FROM delta
+    """, {"after": after, "until": until, "window_start": window_start})
+    return cur.fetchone()[0]
+
+def expire_buckets(cur, window_start):
+    """
+    Subtract day buckets older than ``window_start`` from the counters,
+    recompute their last_attempt from the buckets left and drop counters
+    left empty. Returns the number of buckets expired.
+    """
+
+    cur.execute("""
+        WITH expired AS (
+            DELETE FROM weak_topic_buckets
+            WHERE day < %(window_start)s
+            RETURNING user_id, topic, attempts_count, correct_count
+        ),
+        totals AS (
+            SELECT user_id, topic, SUM(attempts_count) AS attempts_count,
+                   SUM(correct_count) AS correct_count, COUNT(*) AS buckets
+            FROM expired
+            GROUP BY user_id, topic
+        ),
+        updated AS (
+            UPDATE weak_topic_counters c
+            SET attempts_count = c.attempts_count - t.attempts_count,
+                correct_count = c.correct_count - t.correct_count,
+                -- The statement still sees the expired buckets, hence the day filter
+                last_attempt = (
+                    SELECT MAX(b.last_attempt)
+                    FROM weak_topic_buckets b
+                    WHERE b.user_id = c.user_id AND b.topic = c.topic
+                    AND b.day >= %(window_start)s
+                ),
+                updated_at = NOW()
+            FROM totals t
+            WHERE c.user_id = t.user_id AND c.topic = t.topic
+        )
+        SELECT COALESCE(SUM(buckets), 0) FROM totals
+    """, {"window_start": window_start})
+    expired = cur.fetchone()[0]
+
+    cur.execute("DELETE FROM weak_topic_counters WHERE attempts_count <= 0")
+    return expired
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+-- Scheduler state for incremental nightly jobs
+-- spaced_repetition.py keeps a high-water mark on attempts.ts so a nightly run
+-- only reschedules users with new attempts or reviews that came due since the
+-- previous run, with a periodic full sweep.
+
+create table public.scheduler_state (
+  job_name         text primary key,
+  high_water_mark  timestamptz,
+  last_run_at      timestamptz,
+  last_full_sweep  timestamptz,
+  updated_at       timestamptz default now()
+);
+
+-- Only the service role (which bypasses RLS) touches scheduler state
+alter table scheduler_state enable row level security;
+
+-- Incremental runs look up users by attempt time and by review due time
+create index if not exists idx_attempts_ts on public.attempts(ts);
+create index if not exists idx_recommendations_next_review on public.recommendations(next_review);
@@ -0,0 +1,8 @@
+-- FSRS memory state for the batch scheduling engine
+-- scripts/srs_engine.py --algorithm fsrs keeps per-(user, task) stability
+-- (days until recall probability drops to 90%) and difficulty (1-10) next to
+-- the SM-2 columns; both stay null for pairs only scheduled with SM-2.
+
+alter table public.task_repetitions
+  add column if not exists stability  real check (stability > 0),
+  add column if not exists difficulty real check (difficulty between 1 and 10);
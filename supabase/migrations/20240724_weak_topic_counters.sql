@@ -0,0 +1,46 @@
+-- Incremental weak-topic aggregation
+-- Instead of refreshing the weak_topics materialized view over 30 days of
+-- attempts, scripts/weak_topics.py folds only attempts newer than its
+-- scheduler_state mark into per-(user, topic, day) buckets and running
+-- counters, and subtracts whole day buckets as they leave the window.
+
+create table public.weak_topic_buckets (
+  user_id        uuid references auth.users on delete cascade,
+  topic          text not null,
+  day            date not null,
+  attempts_count int not null default 0,
+  correct_count  int not null default 0,
+  last_attempt   timestamptz,
+  primary key (user_id, topic, day)
+);
+
+create table public.weak_topic_counters (
+  user_id        uuid references auth.users on delete cascade,
+  topic          text not null,
+  attempts_count int not null default 0,
+  correct_count  int not null default 0,
+  last_attempt   timestamptz,
+  updated_at     timestamptz default now(),
+  primary key (user_id, topic)
+);
+
+-- Expiry deletes the oldest days across all users
+create index if not exists idx_weak_topic_buckets_day on public.weak_topic_buckets(day);
+
+-- Same columns and threshold as the weak_topics materialized view
+create or replace view public.weak_topics_live as
+select
+  user_id,
+  topic,
+  1 - correct_count::float / attempts_count as error_rate,
+  attempts_count,
+  last_attempt
+from weak_topic_counters
+where attempts_count >= 3;
+
+-- Only the service role (which bypasses RLS) maintains the counters
+alter table weak_topic_buckets enable row level security;
+alter table weak_topic_counters enable row level security;
+
+create policy "Users can view own weak topic counters" on weak_topic_counters
+  for select using (auth.uid() = user_id);
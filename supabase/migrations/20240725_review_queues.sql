@@ -0,0 +1,18 @@
+-- Precomputed per-user review queues
+-- spaced_repetition.py rebuilds a user's row whenever it writes that user's
+-- recommendations, so "what should I review today" is a primary-key lookup
+-- instead of a filtered scan of recommendations.
+
+create table public.review_queues (
+  user_id        uuid primary key references auth.users on delete cascade,
+  -- [{task_id, reason, priority, next_review}] ordered by next_review, priority desc
+  queue          jsonb not null default '[]',
+  queue_length   int not null default 0,
+  next_due       timestamptz,
+  built_at       timestamptz default now()
+);
+
+alter table review_queues enable row level security;
+
+create policy "Users can view own review queue" on review_queues
+  for select using (auth.uid() = user_id);
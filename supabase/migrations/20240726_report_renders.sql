@@ -0,0 +1,14 @@
+-- Rendered report PDFs by content hash
+-- generate_pdf.py hashes the template inputs of a weekly report (without the
+-- generation timestamp) together with the template version, and reuses the
+-- PDF stored here for identical reports instead of rendering it again.
+
+create table public.report_renders (
+  content_hash     char(64) primary key,
+  pdf_url          text not null,
+  template_version text not null,
+  created_at       timestamptz default now()
+);
+
+-- Only the service role (which bypasses RLS) reads and writes renders
+alter table report_renders enable row level security;
@@ -0,0 +1,27 @@
+-- Insertion-order watermarks for the batch jobs
+-- attempt_repetition_trigger applied SM-2 on every insert into attempts and
+-- set last_reviewed = now(), so scripts/srs_engine.py could not tell which
+-- attempts it still had to apply. The engine now owns task_repetitions and,
+-- like the weak-topic fold, picks up new attempts by inserting transaction
+-- instead of by ts: attempts.inserted_xid records the transaction, and
+-- scheduler_state.high_water_xid the oldest transaction still running at a
+-- job's previous run (pg_snapshot_xmin). Every transaction below that mark
+-- had finished, so attempts committed late or with an old ts are folded
+-- exactly once. Needs Postgres 13+ (xid8).
+
+drop trigger if exists attempt_repetition_trigger on attempts;
+
+-- Rows inserted before this migration stay null: the trigger already applied
+-- them, and only rebuilds read them
+alter table public.attempts add column if not exists inserted_xid xid8;
+alter table public.attempts alter column inserted_xid set default pg_current_xact_id();
+create index if not exists idx_attempts_inserted_xid on public.attempts(inserted_xid);
+
+alter table public.scheduler_state add column if not exists high_water_xid xid8;
+
+-- task_repetitions already reflects every attempt the trigger saw
+insert into scheduler_state (job_name, high_water_xid, last_run_at)
+values ('srs_engine', pg_snapshot_xmin(pg_current_snapshot()), now())
+on conflict (job_name) do update set
+  high_water_xid = excluded.high_water_xid,
+  updated_at = now();
@@ -0,0 +1,12 @@
+-- Render reuse per sink
+-- A PDF stored in report_renders is only reachable through the sink that
+-- wrote it: a local path means nothing to an S3 run, and a bucket behind a
+-- different public base URL hands out other URLs. generate_pdf.py records the
+-- sink location (kind, bucket or directory, public base URL) with each render
+-- and only reuses renders of the sink it is writing to.
+
+alter table public.report_renders add column if not exists sink text not null default '';
+
+-- Renders from before this migration have no known sink and are never reused
+alter table public.report_renders drop constraint if exists report_renders_pkey;
+alter table public.report_renders add primary key (content_hash, sink);
@@ -0,0 +1,82 @@
+-- Content-addressed task chunk storage
+-- Many tasks share identical solution steps. Chunk text and its embedding are
+-- stored once in chunk_contents, keyed by the hex SHA-256 of the text, and
+-- task_chunks only references them. scripts/embed_chunks.py embeds a chunk
+-- only when its hash has no stored embedding yet.
+
+create table if not exists public.chunk_contents (
+  content_hash text primary key check (length(content_hash) = 64),
+  chunk        text not null,
+  embedding    vector(1536),
+  created_at   timestamptz default now()
+);
+
+alter table public.task_chunks add column if not exists content_hash text references chunk_contents(content_hash);
+
+-- Move existing chunks into the shared store, keeping one embedding per text
+insert into chunk_contents (content_hash, chunk, embedding)
+select distinct on (hash) hash, chunk, embedding
+from (
+  select encode(sha256(convert_to(chunk, 'UTF8')), 'hex') as hash, chunk, embedding, id
+  from task_chunks
+  where chunk is not null
+) existing
+order by hash, (embedding is null), id
+on conflict (content_hash) do nothing;
+
+update task_chunks
+set content_hash = encode(sha256(convert_to(chunk, 'UTF8')), 'hex'),
+    chunk = null,
+    embedding = null
+where content_hash is null and chunk is not null;
+
+-- The vector index now lives on the deduplicated store
+drop index if exists idx_task_chunks_embedding;
+create index if not exists idx_chunk_contents_embedding on public.chunk_contents using ivfflat (embedding vector_cosine_ops);
+create index if not exists idx_task_chunks_content_hash on public.task_chunks(content_hash);
+
+alter table chunk_contents enable row level security;
+create policy "chunk_contents_public_read" on chunk_contents for select using (true);
+
+-- Task chunk search reads text and embeddings through the shared store
+create or replace function match_task_chunks(query_embedding vector, match_count int, taskid bigint)
+returns table(id bigint, chunk text, similarity float)
+language sql stable as $$
+  select tc.id, cc.chunk, cc.embedding <#> query_embedding as similarity
+  from task_chunks tc
+  join chunk_contents cc on cc.content_hash = tc.content_hash
+  where tc.task_id = taskid
+  order by cc.embedding <#> query_embedding
+  limit match_count
+$$;
+
+create or replace function match_task_chunks(
+  query_embedding vector(1536),
+  match_count int default 5,
+  taskid int default null
+)
+returns table (
+  id bigint,
+  task_id bigint,
+  chunk_text text,
+  embedding vector(1536),
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    tc.id,
+    tc.task_id,
+    cc.chunk,
+    cc.embedding,
+    1 - (cc.embedding <=> query_embedding) as similarity
+  from task_chunks tc
+  join chunk_contents cc on cc.content_hash = tc.content_hash
+  where (taskid is null or tc.task_id = taskid)
+    and cc.embedding is not null
+  order by cc.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;